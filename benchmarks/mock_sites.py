@@ -0,0 +1,449 @@
+# -*- coding: utf-8 -*-
+"""
+本地模拟的创作者中心页面，供基准测试驱动真实的上传器
+
+每个平台只保留上传器会用到的元素：上传入口、上传进度、定时发布选择器和发布后的跳转。
+浏览器里对这些平台域名的请求会被 route 到本地的 aiohttp 服务，其他域名的请求直接拦截，
+整个测试不需要访问外网。
+"""
+import asyncio
+from urllib.parse import urlsplit
+
+import aiohttp
+from aiohttp import web
+
+MOCK_HOSTS = (
+    "creator.douyin.com",
+    "channels.weixin.qq.com",
+    "cp.kuaishou.com",
+    "www.tiktok.com",
+    "baijiahao.baidu.com",
+)
+
+COMMON_JS = """
+const CHUNKS = %(chunks)d;
+window.pad = n => String(n).padStart(2, '0');
+window.show = (el, visible) => { el.style.display = visible ? '' : 'none'; };
+// 模拟分片上传，每个分片一次请求，服务端按 chunk_delay 延迟返回
+window.mockUpload = async function (onProgress) {
+    for (let i = 0; i < CHUNKS; i++) {
+        await fetch('/__mock__/upload/chunk?index=' + i, {method: 'POST', body: 'chunk'});
+        onProgress((i + 1) / CHUNKS);
+    }
+};
+// 输入 #话题 时请求联想接口
+window.watchSuggest = function (editor, kind) {
+    editor.addEventListener('input', () => {
+        const match = /#([^\\s#]*)$/.exec(editor.textContent || editor.value || '');
+        if (match && match[1]) fetch('/__mock__/' + kind + '?q=' + encodeURIComponent(match[1]));
+    });
+};
+"""
+
+PAGE_TEMPLATE = """<!doctype html>
+<html><head><meta charset="utf-8"><title>mock</title><script src="/__mock__/common.js"></script></head>
+<body>
+%s
+</body></html>
+"""
+
+DOUYIN_UPLOAD = """
+<div class="container-upload"><input type="file" accept="video/*"></div>
+<script>
+document.querySelector('input[type=file]').addEventListener('change', () => {
+    location.href = '/creator-micro/content/publish?enter_from=publish_page';
+});
+</script>
+"""
+
+DOUYIN_PUBLISH = """
+<div class="title-row"><div class="title-label"><span>作品标题</span></div><div class="title-input"><input type="text"></div></div>
+<div class="zone-container" contenteditable="true"></div>
+<div class="progress-div"><div class="progress-text">上传中 0%</div></div>
+<div class="long-card-preview"></div>
+<div class="semi-select"><span class="location-placeholder">输入地理位置</span><input class="location-input"></div>
+<div class="location-options"></div>
+<label class="radio-now">立即发布</label>
+<label class="radio-schedule">定时发布</label>
+<input class="semi-input" placeholder="日期和时间" style="display:none">
+<button class="publish-btn">发布</button>
+<script>
+const progress = document.querySelector('.progress-text');
+mockUpload(p => { progress.textContent = '上传中 ' + Math.round(p * 100) + '%'; }).then(() => {
+    progress.textContent = '上传完成';
+    const reupload = document.createElement('div');
+    reupload.textContent = '重新上传';
+    document.querySelector('.long-card-preview').appendChild(reupload);
+});
+const locationInput = document.querySelector('.location-input');
+document.querySelector('.location-placeholder').addEventListener('click', () => locationInput.focus());
+locationInput.addEventListener('input', async () => {
+    await fetch('/__mock__/poi/search?q=' + encodeURIComponent(locationInput.value));
+    document.querySelector('.location-options').innerHTML =
+        '<div role="listbox"><div role="option">' + locationInput.value + '</div></div>';
+});
+document.querySelector('.location-options').addEventListener('click', () => {
+    document.querySelector('.location-options').innerHTML = '';
+});
+document.querySelector('.radio-schedule').addEventListener('click', () => {
+    show(document.querySelector('.semi-input'), true);
+});
+document.querySelector('.publish-btn').addEventListener('click', () => {
+    location.href = '/creator-micro/content/manage';
+});
+</script>
+"""
+
+TENCENT_CREATE = """
+<input type="file" accept="video/*">
+<div class="media-status-content"><div class="status-msg">等待上传</div></div>
+<div class="input-editor" contenteditable="true"></div>
+<label><input type="checkbox">视频为原创</label>
+<div class="post-time">
+    <label><input type="radio" name="post-time" checked>不定时</label>
+    <label class="schedule-label"><input type="radio" name="post-time">定时</label>
+</div>
+<div class="schedule-panel" style="display:none">
+    <input placeholder="请选择发表时间" readonly>
+    <div class="weui-desktop-picker__panel" style="display:none">
+        <span class="weui-desktop-picker__panel__label year"></span>
+        <span class="weui-desktop-picker__panel__label month"></span>
+        <button class="weui-desktop-btn__icon__right">&gt;</button>
+        <table class="weui-desktop-picker__table"><tbody></tbody></table>
+    </div>
+    <input placeholder="请选择时间">
+</div>
+<div class="short-title-row"><div class="short-title-label"><span>短标题</span></div><div class="short-title-input"><span><input type="text"></span></div></div>
+<div class="form-btns"><button class="weui-desktop-btn weui-desktop-btn_primary weui-desktop-btn_disabled">发表</button></div>
+<script>
+const status = document.querySelector('.status-msg');
+const publishButton = document.querySelector('.form-btns button');
+document.querySelector('input[type=file]').addEventListener('change', () => {
+    mockUpload(p => { status.textContent = '上传中 ' + Math.round(p * 100) + '%'; }).then(() => {
+        status.textContent = '上传完成';
+        publishButton.classList.remove('weui-desktop-btn_disabled');
+    });
+});
+document.querySelector('.schedule-label').addEventListener('click', () => {
+    show(document.querySelector('.schedule-panel'), true);
+});
+const panel = document.querySelector('.weui-desktop-picker__panel');
+const dateInput = document.querySelector('input[placeholder="请选择发表时间"]');
+const view = new Date();
+view.setDate(1);
+function renderCalendar() {
+    document.querySelector('.year').textContent = view.getFullYear() + '年';
+    document.querySelector('.month').textContent = pad(view.getMonth() + 1) + '月';
+    const tbody = document.querySelector('.weui-desktop-picker__table tbody');
+    tbody.innerHTML = '';
+    const today = new Date();
+    today.setHours(0, 0, 0, 0);
+    const days = new Date(view.getFullYear(), view.getMonth() + 1, 0).getDate();
+    let row = null;
+    for (let day = 1; day <= days; day++) {
+        if ((day - 1) % 7 === 0) row = tbody.insertRow();
+        const link = document.createElement('a');
+        link.textContent = day;
+        if (new Date(view.getFullYear(), view.getMonth(), day) < today) link.className = 'weui-desktop-picker__disabled';
+        link.addEventListener('click', () => {
+            dateInput.value = view.getFullYear() + '-' + pad(view.getMonth() + 1) + '-' + pad(day);
+            show(panel, false);
+        });
+        row.insertCell().appendChild(link);
+    }
+}
+dateInput.addEventListener('click', () => { renderCalendar(); show(panel, true); });
+document.querySelector('.weui-desktop-btn__icon__right').addEventListener('click', () => {
+    view.setMonth(view.getMonth() + 1);
+    renderCalendar();
+});
+publishButton.addEventListener('click', () => {
+    if (!publishButton.classList.contains('weui-desktop-btn_disabled')) location.href = '/platform/post/list';
+});
+</script>
+"""
+
+KUAISHOU_PUBLISH = """
+<button class="_upload-btn_mock">上传视频</button>
+<input type="file" accept="video/*" style="display:none">
+<div class="editor" style="display:none">
+    <div class="upload-status"></div>
+    <div class="desc-row"><span>描述</span><div class="desc-editor" contenteditable="true"></div></div>
+    <div class="time-row">
+        <label>发布时间</label>
+        <div class="radios">
+            <label><input type="radio" class="ant-radio-input" name="publish-time" checked>立即</label>
+            <label><input type="radio" class="ant-radio-input" name="publish-time">定时</label>
+        </div>
+    </div>
+    <div class="ant-picker" style="display:none"><div class="ant-picker-input"><input placeholder="选择日期时间"></div></div>
+    <div class="ant-picker-dropdown" style="display:none">日期面板</div>
+    <button class="publish">发布</button>
+    <div class="confirm-dialog" style="display:none"><button class="confirm">确认发布</button></div>
+</div>
+<script>
+const fileInput = document.querySelector('input[type=file]');
+const uploadStatus = document.querySelector('.upload-status');
+document.querySelector('button._upload-btn_mock').addEventListener('click', () => fileInput.click());
+fileInput.addEventListener('change', () => {
+    show(document.querySelector('.editor'), true);
+    uploadStatus.textContent = '上传中';
+    mockUpload(p => { uploadStatus.textContent = '上传中 ' + Math.round(p * 100) + '%'; }).then(() => {
+        uploadStatus.textContent = '上传成功';
+    });
+});
+watchSuggest(document.querySelector('.desc-editor'), 'tag/suggest');
+document.querySelectorAll('.ant-radio-input')[1].addEventListener('click', () => {
+    show(document.querySelector('.ant-picker'), true);
+});
+const pickerInput = document.querySelector('.ant-picker-input input');
+const dropdown = document.querySelector('.ant-picker-dropdown');
+pickerInput.addEventListener('click', () => show(dropdown, true));
+pickerInput.addEventListener('keydown', event => { if (event.key === 'Enter') show(dropdown, false); });
+document.querySelector('button.publish').addEventListener('click', () => {
+    show(document.querySelector('.confirm-dialog'), true);
+});
+document.querySelector('button.confirm').addEventListener('click', () => {
+    location.href = '/article/manage/video?status=2&from=publish';
+});
+</script>
+"""
+
+TIKTOK_HOME = """
+<div id="header-more-menu-icon">...</div>
+<div class="header-menu"><div data-e2e="language-select">Language</div></div>
+<div id="lang-setting-popup-list" style="display:none"><div>English</div><div>中文</div></div>
+<script>
+const languages = document.querySelector('#lang-setting-popup-list');
+document.querySelector('[data-e2e="language-select"]').addEventListener('click', () => show(languages, true));
+languages.addEventListener('click', () => show(languages, false));
+</script>
+"""
+
+TIKTOK_UPLOAD = """
+<div class="upload-container">
+    <input type="file" accept="video/*" style="display:none">
+    <button class="select-video">Select video</button>
+    <div class="upload-form" style="display:none">
+        <div class="public-DraftEditor-content" contenteditable="true"></div>
+        <div class="upload-progress"></div>
+        <input type="radio" id="when-now" name="when" checked><label for="when-now">Now</label>
+        <input type="radio" id="when-schedule" name="when"><label for="when-schedule">Schedule</label>
+        <div class="scheduled-picker" style="display:none">
+            <div class="TUXInputBox time-box">00:00</div>
+            <div class="TUXInputBox date-box">date</div>
+            <div class="timepicker" style="display:none"><div class="hours"></div><div class="minutes"></div></div>
+            <div class="calendar-wrapper" style="display:none">
+                <span class="arrow">&lt;</span><span class="month-title"></span><span class="arrow">&gt;</span>
+                <div class="days"></div>
+            </div>
+        </div>
+        <div class="button-group"><button class="post" disabled>Post</button><button>Discard</button></div>
+    </div>
+    <div class="common-modal-confirm-modal" style="display:none">Your video is being uploaded</div>
+</div>
+<script>
+const fileInput = document.querySelector('input[type=file]');
+const postButton = document.querySelector('button.post');
+const progress = document.querySelector('.upload-progress');
+document.querySelector('button.select-video').addEventListener('click', () => fileInput.click());
+fileInput.addEventListener('change', () => {
+    show(document.querySelector('.upload-form'), true);
+    mockUpload(p => { progress.textContent = 'Uploading ' + Math.round(p * 100) + '%'; }).then(() => {
+        progress.textContent = 'Uploaded';
+        postButton.removeAttribute('disabled');
+    });
+});
+watchSuggest(document.querySelector('.public-DraftEditor-content'), 'challenge/sug');
+document.querySelector('#when-schedule').addEventListener('change', () => {
+    show(document.querySelector('.scheduled-picker'), true);
+});
+const timepicker = document.querySelector('.timepicker');
+for (let hour = 0; hour < 24; hour++) {
+    const option = document.createElement('span');
+    option.className = 'tiktok-timepicker-left';
+    option.textContent = pad(hour);
+    document.querySelector('.hours').appendChild(option);
+}
+for (let minute = 0; minute < 60; minute += 5) {
+    const option = document.createElement('span');
+    option.className = 'tiktok-timepicker-right';
+    option.textContent = pad(minute);
+    option.addEventListener('click', () => show(timepicker, false));
+    document.querySelector('.minutes').appendChild(option);
+}
+document.querySelector('.time-box').addEventListener('click', () => {
+    show(timepicker, timepicker.style.display === 'none');
+});
+const calendar = document.querySelector('.calendar-wrapper');
+const view = new Date();
+view.setDate(1);
+function renderCalendar() {
+    document.querySelector('.month-title').textContent = view.toLocaleString('en-US', {month: 'long'});
+    const days = document.querySelector('.days');
+    days.innerHTML = '';
+    const today = new Date();
+    today.setHours(0, 0, 0, 0);
+    const count = new Date(view.getFullYear(), view.getMonth() + 1, 0).getDate();
+    for (let day = 1; day <= count; day++) {
+        const option = document.createElement('span');
+        option.className = new Date(view.getFullYear(), view.getMonth(), day) < today ? 'day' : 'day valid';
+        option.textContent = day;
+        option.addEventListener('click', () => show(calendar, false));
+        days.appendChild(option);
+    }
+}
+document.querySelector('.date-box').addEventListener('click', () => { renderCalendar(); show(calendar, true); });
+const arrows = document.querySelectorAll('.calendar-wrapper .arrow');
+arrows[0].addEventListener('click', () => { view.setMonth(view.getMonth() - 1); renderCalendar(); });
+arrows[1].addEventListener('click', () => { view.setMonth(view.getMonth() + 1); renderCalendar(); });
+postButton.addEventListener('click', () => show(document.querySelector('.common-modal-confirm-modal'), true));
+</script>
+"""
+
+BAIJIAHAO_EDIT = """
+<div class="video-main-container"><input type="file" accept="video/*"></div>
+<div id="formMain" style="display:none">
+    <input placeholder="添加标题获得更多推荐">
+    <div class="cover"><div class="cover-overlay"></div></div>
+    <div class="cheetah-spin-container"></div>
+    <div class="op-btn-outter-content"><span>定时发布</span><button class="op-schedule">+</button></div>
+    <div class="schedule-dialog" style="display:none">
+        <div class="select-wrap day-select">日期</div>
+        <div class="select-wrap hour-select">时间</div>
+        <div class="rc-virtual-list day-list" style="display:none"><div class="rc-virtual-list-holder-inner"></div></div>
+        <div class="rc-virtual-list hour-list" style="display:none"><div class="rc-virtual-list-holder-inner"></div></div>
+        <button class="confirm-schedule">定时发布</button>
+    </div>
+</div>
+<script>
+const overlay = document.querySelector('.cover-overlay');
+document.querySelector('input[type=file]').addEventListener('change', () => {
+    show(document.querySelector('#formMain'), true);
+    overlay.textContent = '上传中';
+    mockUpload(p => { overlay.textContent = '上传中 ' + Math.round(p * 100) + '%'; }).then(() => {
+        overlay.textContent = '';
+        const cover = document.createElement('img');
+        cover.src = 'data:image/gif;base64,R0lGODlhAQABAAAAACw=';
+        document.querySelector('.cheetah-spin-container').appendChild(cover);
+    });
+});
+const dayList = document.querySelector('.day-list');
+const hourList = document.querySelector('.hour-list');
+for (let offset = 0; offset < 7; offset++) {
+    const date = new Date();
+    date.setDate(date.getDate() + offset);
+    const option = document.createElement('div');
+    option.className = 'cheetah-select-item';
+    option.textContent = (date.getMonth() + 1) + '月' + pad(date.getDate()) + '日';
+    option.addEventListener('click', () => show(dayList, false));
+    dayList.firstElementChild.appendChild(option);
+}
+for (let hour = 8; hour < 16; hour++) {
+    const option = document.createElement('div');
+    option.className = 'cheetah-select-item-option';
+    option.textContent = hour + '点';
+    option.addEventListener('click', () => show(hourList, false));
+    hourList.firstElementChild.appendChild(option);
+}
+document.querySelector('.op-schedule').addEventListener('click', () => {
+    show(document.querySelector('.schedule-dialog'), true);
+});
+document.querySelector('.day-select').addEventListener('click', () => show(dayList, true));
+document.querySelector('.hour-select').addEventListener('click', () => show(hourList, true));
+document.querySelector('.confirm-schedule').addEventListener('click', () => {
+    location.href = '/builder/rc/clue';
+});
+</script>
+"""
+
+PAGES = {
+    ("creator.douyin.com", "/creator-micro/content/upload"): DOUYIN_UPLOAD,
+    ("creator.douyin.com", "/creator-micro/content/publish"): DOUYIN_PUBLISH,
+    ("creator.douyin.com", "/creator-micro/content/post/video"): DOUYIN_PUBLISH,
+    ("channels.weixin.qq.com", "/platform/post/create"): TENCENT_CREATE,
+    ("cp.kuaishou.com", "/article/publish/video"): KUAISHOU_PUBLISH,
+    ("www.tiktok.com", "/"): TIKTOK_HOME,
+    ("www.tiktok.com", "/tiktokstudio/upload"): TIKTOK_UPLOAD,
+    ("baijiahao.baidu.com", "/builder/rc/edit"): BAIJIAHAO_EDIT,
+}
+
+
+class MockSiteServer(object):
+    """
+    在 localhost 上提供模拟页面，并把浏览器 context 中平台域名的请求转发过来
+
+    Args:
+        chunks: 模拟上传的分片数
+        chunk_delay: 每个分片请求的服务端延迟（秒），chunks * chunk_delay 约等于视频上传时间
+        suggest_delay: 话题/地理位置联想接口的延迟（秒）
+    """
+
+    def __init__(self, chunks=10, chunk_delay=0.2, suggest_delay=0.05, host="127.0.0.1", port=0):
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.suggest_delay = suggest_delay
+        self.host = host
+        self.port = port
+        self.base_url = None
+        self._runner = None
+        self._session = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route("*", "/{site}/__mock__/{api:.*}", self.handle_api)
+        app.router.add_route("*", "/{site}/{path:.*}", self.handle_page)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f"http://{self.host}:{port}"
+        self._session = aiohttp.ClientSession()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_page(self, request: web.Request) -> web.Response:
+        body = PAGES.get((request.match_info["site"], "/" + request.match_info["path"]))
+        if body is None:
+            # 发布成功后跳转的作品管理页等，只要能打开就行
+            body = "<p>ok</p>"
+        return web.Response(text=PAGE_TEMPLATE % body, content_type="text/html", charset="utf-8")
+
+    async def handle_api(self, request: web.Request) -> web.Response:
+        api = request.match_info["api"]
+        if api == "common.js":
+            return web.Response(text=COMMON_JS % {"chunks": self.chunks}, content_type="application/javascript")
+        if api.startswith("upload/"):
+            await request.read()
+            await asyncio.sleep(self.chunk_delay)
+            return web.json_response({"code": 0, "index": request.query.get("index")})
+        await asyncio.sleep(self.suggest_delay)
+        return web.json_response({"code": 0, "data": [request.query.get("q", "")]})
+
+    async def route_context(self, context):
+        """browser_pool 的 context hook：平台域名转发到本地服务，其余请求一律拦截"""
+        await context.route("**/*", self._handle_route)
+
+    async def _handle_route(self, route):
+        request = route.request
+        url = urlsplit(request.url)
+        if url.hostname not in MOCK_HOSTS:
+            await route.abort()
+            return
+        local_url = f"{self.base_url}/{url.hostname}{url.path or '/'}" + (f"?{url.query}" if url.query else "")
+        try:
+            async with self._session.request(request.method, local_url, data=request.post_data_buffer) as response:
+                body = await response.read()
+                headers = {"content-type": response.headers.get("content-type", "text/html")}
+        except aiohttp.ClientError:
+            await route.abort()
+            return
+        await route.fulfill(status=response.status, headers=headers, body=body)
+
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+本地模拟的 B 站 preupload / upos 分片接口，用来验证断点续传
+
+    python -m benchmarks.mock_upos --size 50 --fail-after 20
+
+先上传到第 fail_after 个分片时让服务端返回 503 模拟断网，再重新运行同一个文件，
+第二次只会上传缺失的分片。
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+from aiohttp import web
+
+from uploader.bilibili_uploader.line_cache import line_cache
+from uploader.bilibili_uploader.resumable import ResumableUposUpload, create_session, resolve_line
+
+
+class MockUposServer(object):
+    """
+    在后台线程里运行的 aiohttp 服务，实现 preupload、申请 upload_id、PUT 分片和合并分片
+
+    Args:
+        chunk_size: preupload 返回的分片大小
+        chunk_delay: 每个分片的处理延迟（秒）
+        fail_after: 累计收到这么多个分片后，之后的分片都返回 503
+    """
+
+    def __init__(self, chunk_size=1024 * 1024, chunk_delay=0.0, fail_after=None, host="127.0.0.1"):
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+        self.fail_after = fail_after
+        self.host = host
+        self.base_url = None
+        # upload_id -> 已收到的 partNumber
+        self.parts = {}
+        self.received_chunks = 0
+        self.probes = 0
+        self._upload_ids = itertools.count(1)
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def preupload_url(self):
+        return f"{self.base_url}/preupload"
+
+    async def handle_preupload(self, request: web.Request) -> web.Response:
+        if request.query.get("r") == "probe":
+            self.probes += 1
+            return web.json_response({
+                "OK": 1,
+                "lines": [{"os": "upos", "query": "upcdn=mock&probe_version=20221109",
+                           "probe_url": f"{self.base_url}/OK"}],
+                "probe": {"get": True},
+            })
+        return web.json_response({
+            "OK": 1,
+            "chunk_size": self.chunk_size,
+            "auth": "mock-auth",
+            "endpoint": f"{self.base_url}/upos",
+            "biz_id": 1,
+            "upos_uri": f"upos://ugcfx2lf/n{next(self._upload_ids)}-{request.query.get('name', 'video')}",
+        })
+
+    async def handle_ok(self, request: web.Request) -> web.Response:
+        return web.Response(text="OK")
+
+    async def handle_post(self, request: web.Request) -> web.Response:
+        if "uploads" in request.query:
+            upload_id = f"upload-{next(self._upload_ids)}"
+            self.parts[upload_id] = set()
+            return web.json_response({"OK": 1, "upload_id": upload_id})
+        upload_id = request.query.get("uploadId")
+        if upload_id not in self.parts:
+            return web.json_response({"OK": 0, "message": "unknown uploadId"}, status=404)
+        parts = {part["partNumber"] for part in (await request.json())["parts"]}
+        if parts != self.parts[upload_id]:
+            return web.json_response({"OK": 0, "message": f"missing parts {sorted(parts - self.parts[upload_id])}"})
+        return web.json_response({"OK": 1, "location": request.path})
+
+    async def handle_put(self, request: web.Request) -> web.Response:
+        upload_id = request.query.get("uploadId")
+        if upload_id not in self.parts:
+            return web.Response(status=404, text="unknown uploadId")
+        body = await request.read()
+        if len(body) != int(request.query["size"]):
+            return web.Response(status=400, text="size mismatch")
+        if self.fail_after is not None and self.received_chunks >= self.fail_after:
+            return web.Response(status=503, text="mock network failure")
+        self.received_chunks += 1
+        await asyncio.sleep(self.chunk_delay)
+        self.parts[upload_id].add(int(request.query["partNumber"]))
+        return web.Response(text="MULTIPART_PUT_SUCCESS")
+
+    async def _start(self):
+        app = web.Application(client_max_size=self.chunk_size * 2)
+        app.router.add_get("/preupload", self.handle_preupload)
+        app.router.add_get("/OK", self.handle_ok)
+        app.router.add_post("/upos/{path:.*}", self.handle_post)
+        app.router.add_put("/upos/{path:.*}", self.handle_put)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, 0).start()
+        self.base_url = f"http://{self.host}:{self._runner.addresses[0][1]}"
+
+    def start(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result()
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resume a chunked upload against a local mock upos server")
+    parser.add_argument("--size", type=int, default=50, help="测试文件大小（MB）")
+    parser.add_argument("--fail-after", type=int, default=20, help="第一次上传在第几个分片后中断")
+    parser.add_argument("--tasks", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="upos-") as work_dir, MockUposServer(fail_after=args.fail_after) as server:
+        video_file = Path(work_dir) / "video.mp4"
+        with open(video_file, "wb") as f:
+            f.write(os.urandom(args.size * 1024 * 1024))
+        checkpoint_dir = Path(work_dir) / "checkpoints"
+        line_cache.cache_file = Path(work_dir) / "lines.json"
+        with create_session({}) as session:
+            line = resolve_line(session, "AUTO", server.preupload_url)
+            upload = ResumableUposUpload(session, video_file, "mock", line=line, tasks=args.tasks,
+                                         preupload_url=server.preupload_url, checkpoint_dir=checkpoint_dir,
+                                         chunk_retries=1)
+            try:
+                upload.run()
+            except Exception as e:
+                print(f"第一次上传中断: {e}，已完成 {len(upload.checkpoint.completed)} 个分片")
+            server.fail_after = None
+            # 第二次直接使用缓存的线路，不再探测
+            line = resolve_line(session, "AUTO", server.preupload_url)
+            upload = ResumableUposUpload(session, video_file, "mock", line=line, tasks=args.tasks,
+                                         preupload_url=server.preupload_url, checkpoint_dir=checkpoint_dir)
+            print(f"续传结果: {upload.run()}，本次上传 {upload.uploaded_chunks} 个分片，线路探测 {server.probes} 次")
+
+
+if __name__ == '__main__':
+    main()
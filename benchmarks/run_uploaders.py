@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+离线上传基准测试：用真实的上传器类驱动本地模拟的创作者中心页面
+
+    python -m benchmarks.run_uploaders
+    python -m benchmarks.run_uploaders --platforms douyin kuaishou --concurrency 1 2 4 --runs 3 --output result.json
+
+每一步的耗时来自上传器里的 trace span（utils.tracing），"upload" span 即端到端耗时；
+浏览器内存为 Playwright 驱动及所有浏览器子进程的 RSS 之和（只支持 Linux /proc）。
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from benchmarks.mock_sites import MockSiteServer
+from conf import BASE_DIR
+from uploader.baijiahao_uploader.main import BaiJiaHaoVideo
+from uploader.douyin_uploader.main import DouYinVideo
+from uploader.ks_uploader.main import KSVideo
+from uploader.tencent_uploader.main import TencentVideo
+from uploader.tk_uploader.main_chrome import TiktokVideo
+from utils import tracing
+from utils.browser_pool import browser_pool
+from utils.cookie_cache import cookie_cache
+from utils.tracing import trace_context
+
+UPLOADERS = {
+    "douyin": DouYinVideo,
+    "tencent": TencentVideo,
+    "kuaishou": KSVideo,
+    "tiktok": TiktokVideo,
+    "baijiahao": BaiJiaHaoVideo,
+}
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    values = sorted(values)
+    index = (len(values) - 1) * percent / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+
+def _process_tree_rss(root_pid) -> int:
+    """root_pid 及其所有子孙进程的 RSS（字节）"""
+    children = defaultdict(list)
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "r") as f:
+                # comm 字段可能包含空格，从最后一个 ')' 之后开始解析
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children[int(fields[1])].append(int(entry))
+    total = 0
+    stack = list(children[root_pid])
+    while stack:
+        pid = stack.pop()
+        stack.extend(children[pid])
+        try:
+            with open(f"/proc/{pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+class RssSampler(object):
+    """后台定时采样浏览器进程树的内存，记录峰值"""
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak = 0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            self.peak = max(self.peak, _process_tree_rss(os.getpid()))
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if os.path.isdir("/proc"):
+            self.peak = 0
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> int:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        return self.peak
+
+
+async def run_benchmark(platforms, levels, runs, video_file, work_dir, chunks, chunk_delay):
+    server = MockSiteServer(chunks=chunks, chunk_delay=chunk_delay)
+    await server.start()
+    browser_pool.launch_overrides = {"headless": True, "executable_path": None}
+    browser_pool.add_context_hook(server.route_context)
+    cookie_cache.cache_file = work_dir / "cookie_validity.json"
+    trace_file = work_dir / "trace.jsonl"
+    tracing.set_trace_file(trace_file)
+
+    publish_date = (datetime.now() + timedelta(days=1)).replace(hour=16, minute=0, second=0, microsecond=0)
+    scaling = defaultdict(dict)
+    sampler = RssSampler()
+    try:
+        for platform in platforms:
+            for concurrency in levels:
+                walls = []
+                peak_rss = 0
+                for run in range(runs):
+                    apps = []
+                    for index in range(concurrency):
+                        account_file = work_dir / f"{platform}_{index}.json"
+                        account_file.write_text(json.dumps({"cookies": [], "origins": []}), encoding="utf-8")
+                        apps.append(UPLOADERS[platform]("基准测试视频", video_file, ["benchmark", "mock"],
+                                                        publish_date, str(account_file)))
+
+                    async def upload(app, job_id):
+                        with trace_context(job_id=job_id, concurrency=concurrency):
+                            await app.main()
+
+                    sampler.start()
+                    started = time.perf_counter()
+                    await asyncio.gather(*(upload(app, f"{platform}-{concurrency}-{run}-{index}")
+                                           for index, app in enumerate(apps)))
+                    walls.append(time.perf_counter() - started)
+                    peak_rss = max(peak_rss, await sampler.stop())
+                scaling[platform][concurrency] = {"wall_s": statistics.median(walls), "peak_rss": peak_rss}
+                print(f"{platform} x{concurrency}: {statistics.median(walls):.2f}s, "
+                      f"peak rss {peak_rss / 1024 / 1024:.0f} MB")
+    finally:
+        browser_pool.remove_context_hook(server.route_context)
+        await browser_pool.close()
+        await server.close()
+    return summarize(tracing.load_spans(trace_file), scaling)
+
+
+def summarize(spans, scaling) -> dict:
+    durations = defaultdict(lambda: defaultdict(list))
+    for record in spans:
+        if record.get("status") != "ok" or "platform" not in record:
+            continue
+        durations[record["platform"]][record["name"]].append(record["duration_ms"])
+
+    report = {}
+    for platform, levels in scaling.items():
+        steps = {name: {"count": len(values), "p50_ms": percentile(values, 50), "p95_ms": percentile(values, 95)}
+                 for name, values in sorted(durations[platform].items())}
+        base = levels[min(levels)]
+        for concurrency, result in levels.items():
+            result["uploads_per_min"] = concurrency * 60 / result["wall_s"]
+            # 以最低并发为基准，按单个上传的吞吐计算加速比
+            result["speedup"] = result["uploads_per_min"] / (min(levels) * 60 / base["wall_s"])
+        report[platform] = {"steps": steps, "concurrency": levels}
+    return report
+
+
+def print_report(report):
+    for platform, result in report.items():
+        print(f"\n== {platform} ==")
+        print(f"{'step':<32}{'n':>5}{'p50 ms':>12}{'p95 ms':>12}")
+        for name, step in result["steps"].items():
+            print(f"{name:<32}{step['count']:>5}{step['p50_ms']:>12.1f}{step['p95_ms']:>12.1f}")
+        print(f"{'concurrency':<12}{'wall s':>10}{'uploads/min':>14}{'speedup':>10}{'peak rss MB':>14}")
+        for concurrency, level in sorted(result["concurrency"].items()):
+            print(f"{concurrency:<12}{level['wall_s']:>10.2f}{level['uploads_per_min']:>14.1f}"
+                  f"{level['speedup']:>10.2f}{level['peak_rss'] / 1024 / 1024:>14.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline uploader benchmark against local mock sites")
+    parser.add_argument("--platforms", nargs="+", choices=list(UPLOADERS), default=list(UPLOADERS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 2, 4])
+    parser.add_argument("--runs", type=int, default=3, help="每个并发级别重复的次数")
+    parser.add_argument("--video", default=str(Path(BASE_DIR / "videos" / "demo.mp4")))
+    parser.add_argument("--chunks", type=int, default=10, help="模拟上传的分片数")
+    parser.add_argument("--chunk-delay", type=float, default=0.2, help="每个分片的服务端延迟（秒）")
+    parser.add_argument("--output", help="把结果另存为 JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="uploader-bench-") as work_dir:
+        report = asyncio.run(run_benchmark(args.platforms, sorted(set(args.concurrency)), args.runs, args.video,
+                                           Path(work_dir), args.chunks, args.chunk_delay))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
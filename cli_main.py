@@ -1,18 +1,26 @@
 import argparse
 import asyncio
 from datetime import datetime
-from os.path import exists
+from os.path import exists, isdir
 from pathlib import Path
 
-from conf import BASE_DIR
+from conf import BASE_DIR, PLATFORM_CONCURRENCY
 from uploader.douyin_uploader.main import douyin_setup, DouYinVideo
 from uploader.ks_uploader.main import ks_setup, KSVideo
 from uploader.tencent_uploader.main import weixin_setup, TencentVideo
 from uploader.tk_uploader.main_chrome import tiktok_setup, TiktokVideo
 from utils.base_social_media import get_supported_social_media, get_cli_action, SOCIAL_MEDIA_DOUYIN, \
     SOCIAL_MEDIA_TENCENT, SOCIAL_MEDIA_TIKTOK, SOCIAL_MEDIA_KUAISHOU
+from utils.browser_pool import browser_pool
 from utils.constant import TencentZoneTypes
+from utils.covers import cover_pipeline
 from utils.files_times import get_title_and_hashtags
+from utils.media_probe import MediaPreflightError, preflight
+from utils.near_duplicates import near_duplicate_index
+from utils.publish_ledger import format_time, publish_ledger
+from utils.tracing import span, trace_context
+from utils.transcode import transcoder
+from utils.watcher import watch_and_upload
 
 
 def parse_schedule(schedule_raw):
@@ -23,6 +31,138 @@ def parse_schedule(schedule_raw):
     return schedule
 
 
+def parse_target(target_raw):
+    """解析 platform:account 形式的上传目标"""
+    platform, sep, account_name = target_raw.partition(":")
+    if not sep or not account_name:
+        raise argparse.ArgumentTypeError(f"Target must be in platform:account format, got {target_raw}")
+    if platform not in get_supported_social_media():
+        raise argparse.ArgumentTypeError(f"Unsupported platform {platform}, choose from {get_supported_social_media()}")
+    return platform, account_name
+
+
+def add_target_argument(action_parser):
+    action_parser.add_argument('-T', '--target', dest='targets', type=parse_target, action='append', default=[],
+                               metavar='PLATFORM:ACCOUNT',
+                               help='Also publish to this platform:account, can be repeated: -T kuaishou:xiaoB')
+
+
+def get_account_file(platform, account_name):
+    account_file = Path(BASE_DIR / "cookies" / f"{platform}_{account_name}.json")
+    account_file.parent.mkdir(exist_ok=True)
+    return account_file
+
+
+_platform_semaphores = {}
+
+
+def get_platform_semaphore(platform):
+    # 每个平台单独限制并发上传数，避免同一平台同时打开过多页面触发风控
+    if platform not in _platform_semaphores:
+        _platform_semaphores[platform] = asyncio.Semaphore(PLATFORM_CONCURRENCY.get(platform, 1))
+    return _platform_semaphores[platform]
+
+
+async def build_uploader(platform, account_file, title, video_file, tags, publish_date):
+    if platform == SOCIAL_MEDIA_DOUYIN:
+        await douyin_setup(account_file, handle=False)
+        return DouYinVideo(title, video_file, tags, publish_date, account_file)
+    elif platform == SOCIAL_MEDIA_TIKTOK:
+        await tiktok_setup(account_file, handle=True)
+        return TiktokVideo(title, video_file, tags, publish_date, account_file)
+    elif platform == SOCIAL_MEDIA_TENCENT:
+        await weixin_setup(account_file, handle=True)
+        category = TencentZoneTypes.LIFESTYLE.value  # 标记原创需要否则不需要传
+        return TencentVideo(title, video_file, tags, publish_date, account_file, category)
+    elif platform == SOCIAL_MEDIA_KUAISHOU:
+        await ks_setup(account_file, handle=True)
+        return KSVideo(title, video_file, tags, publish_date, account_file)
+    raise ValueError(f"Wrong platform {platform}, please check your input")
+
+
+async def upload_to_target(platform, account_name, video_file, title, tags, publish_date):
+    # 根 span 包含排队等待平台并发名额、cookie 检查和上传的全部时间
+    with trace_context(platform=platform, account=account_name), span("upload_target", video_file=str(video_file)):
+        with span("prepare_video"):
+            # 在进程池中按平台要求转码或重新封装，多个目标、多个视频的处理和上传互相重叠
+            video_file = await transcoder.prepare_async(video_file, platform)
+        async with get_platform_semaphore(platform):
+            account_file = get_account_file(platform, account_name)
+            app = await build_uploader(platform, account_file, title, video_file, tags, publish_date)
+            await app.main()
+
+
+class AlreadyPublished(Exception):
+    """发布记录中已经有这个视频，不再上传"""
+
+    def __init__(self, entry):
+        super().__init__(f"already published at {format_time(entry['published_at'])}")
+        self.entry = entry
+
+
+class NearDuplicate(AlreadyPublished):
+    """该账号已经发布过画面几乎相同的视频（重新编码、剪掉片头片尾等），不再上传"""
+
+    def __init__(self, entry, ratio):
+        Exception.__init__(self, f"near duplicate ({ratio:.0%}) of {entry['video_path']} "
+                                 f"published at {format_time(entry['published_at'])}")
+        self.entry = entry
+        self.ratio = ratio
+
+
+async def fan_out_upload(targets, video_file, publish_date):
+    """
+    把同一个视频并发上传到多个 platform:account 目标
+
+    Returns:
+        [((platform, account_name), None 或异常), ...]
+    """
+    # 标题和话题只解析一次，所有平台共用
+    title, tags = get_title_and_hashtags(video_file)
+    # 启动浏览器前先读取视频文件头，不满足某个平台要求的目标直接记为失败，其余目标照常上传
+    rejected = {}
+    for platform in dict.fromkeys(platform for platform, _ in targets):
+        try:
+            preflight(video_file, platform)
+        except MediaPreflightError as e:
+            rejected[platform] = e
+    results = {}
+    for platform, account_name in targets:
+        if platform in rejected:
+            results[(platform, account_name)] = rejected[platform]
+            continue
+        # 同一个视频（按内容哈希）已经发布到该账号的直接跳过
+        entry = publish_ledger.is_published(video_file, platform, account_name)
+        if entry is not None:
+            results[(platform, account_name)] = AlreadyPublished(entry)
+            continue
+        # 内容不同但画面几乎相同的视频同样会被平台当作重复内容，计算帧哈希需要解码视频，放到线程中执行
+        matches = await asyncio.to_thread(near_duplicate_index.find_published, video_file, platform, account_name)
+        if matches:
+            results[(platform, account_name)] = NearDuplicate(*matches[0])
+    accepted = [target for target in targets if target not in results]
+    outcomes = await asyncio.gather(
+        *[upload_to_target(platform, account_name, video_file, title, tags, publish_date)
+          for platform, account_name in accepted],
+        return_exceptions=True)
+    for (platform, account_name), outcome in zip(accepted, outcomes):
+        if not isinstance(outcome, BaseException):
+            publish_ledger.record(video_file, platform, account_name)
+        results[(platform, account_name)] = outcome
+    return [(target, results[target]) for target in targets]
+
+
+def print_upload_results(results):
+    print("Upload results:")
+    for (platform, account_name), outcome in results:
+        if isinstance(outcome, AlreadyPublished):
+            print(f"  [=] {platform}:{account_name} skipped: {outcome}")
+        elif isinstance(outcome, BaseException):
+            print(f"  [-] {platform}:{account_name} failed: {outcome!r}")
+        else:
+            print(f"  [+] {platform}:{account_name} success")
+
+
 async def main():
     # 主解析器
     parser = argparse.ArgumentParser(description="Upload video to multiple social-media.")
@@ -42,6 +182,18 @@ async def main():
             action_parser.add_argument("-pt", "--publish_type", type=int, choices=[0, 1],
                                        help="0 for immediate, 1 for scheduled", default=0)
             action_parser.add_argument('-t', '--schedule', help='Schedule UTC time in %Y-%m-%d %H:%M format')
+            add_target_argument(action_parser)
+        elif action == 'watch':
+            action_parser.add_argument("video_dir", help="Directory to watch for new .mp4 + .txt pairs")
+            add_target_argument(action_parser)
+            action_parser.add_argument("--workers", type=int, default=2, help="Number of videos uploaded at the same time")
+            action_parser.add_argument("--queue_size", type=int, default=10, help="Max videos waiting for upload")
+            action_parser.add_argument("--settle_seconds", type=float, default=5.0,
+                                       help="Seconds a file must stay unchanged before it is uploaded")
+            action_parser.add_argument("--poll_interval", type=float, default=10.0,
+                                       help="Directory scan interval when inotify is unavailable")
+            action_parser.add_argument("--scan_existing", action="store_true",
+                                       help="Also upload videos already in the directory")
 
     # 解析命令行参数
     args = parser.parse_args()
@@ -51,50 +203,53 @@ async def main():
             raise FileNotFoundError(f'Could not find the video file at {args["video_file"]}')
         if args.publish_type == 1 and not args.schedule:
             parser.error("The schedule must must be specified for scheduled publishing.")
+    elif args.action == 'watch':
+        if not isdir(args.video_dir):
+            parser.error(f"Could not find the video directory at {args.video_dir}")
 
-    account_file = Path(BASE_DIR / "cookies" / f"{args.platform}_{args.account_name}.json")
-    account_file.parent.mkdir(exist_ok=True)
+    account_file = get_account_file(args.platform, args.account_name)
 
-    # 根据 action 处理不同的逻辑
-    if args.action == 'login':
-        print(f"Logging in with account {args.account_name} on platform {args.platform}")
-        if args.platform == SOCIAL_MEDIA_DOUYIN:
-            await douyin_setup(str(account_file), handle=True)
-        elif args.platform == SOCIAL_MEDIA_TIKTOK:
-            await tiktok_setup(str(account_file), handle=True)
-        elif args.platform == SOCIAL_MEDIA_TENCENT:
-            await weixin_setup(str(account_file), handle=True)
-        elif args.platform == SOCIAL_MEDIA_KUAISHOU:
-            await ks_setup(str(account_file), handle=True)
-    elif args.action == 'upload':
-        title, tags = get_title_and_hashtags(args.video_file)
-        video_file = args.video_file
-
-        if args.publish_type == 0:
-            print("Uploading immediately...")
-            publish_date = 0
-        else:
-            print("Scheduling videos...")
-            publish_date = parse_schedule(args.schedule)
-
-        if args.platform == SOCIAL_MEDIA_DOUYIN:
-            await douyin_setup(account_file, handle=False)
-            app = DouYinVideo(title, video_file, tags, publish_date, account_file)
-        elif args.platform == SOCIAL_MEDIA_TIKTOK:
-            await tiktok_setup(account_file, handle=True)
-            app = TiktokVideo(title, video_file, tags, publish_date, account_file)
-        elif args.platform == SOCIAL_MEDIA_TENCENT:
-            await weixin_setup(account_file, handle=True)
-            category = TencentZoneTypes.LIFESTYLE.value  # 标记原创需要否则不需要传
-            app = TencentVideo(title, video_file, tags, publish_date, account_file, category)
-        elif args.platform == SOCIAL_MEDIA_KUAISHOU:
-            await ks_setup(account_file, handle=True)
-            app = KSVideo(title, video_file, tags, publish_date, account_file)
-        else:
-            print("Wrong platform, please check your input")
-            exit()
+    try:
+        # 根据 action 处理不同的逻辑
+        if args.action == 'login':
+            print(f"Logging in with account {args.account_name} on platform {args.platform}")
+            if args.platform == SOCIAL_MEDIA_DOUYIN:
+                await douyin_setup(str(account_file), handle=True)
+            elif args.platform == SOCIAL_MEDIA_TIKTOK:
+                await tiktok_setup(str(account_file), handle=True)
+            elif args.platform == SOCIAL_MEDIA_TENCENT:
+                await weixin_setup(str(account_file), handle=True)
+            elif args.platform == SOCIAL_MEDIA_KUAISHOU:
+                await ks_setup(str(account_file), handle=True)
+        elif args.action == 'upload':
+            if args.publish_type == 0:
+                print("Uploading immediately...")
+                publish_date = 0
+            else:
+                print("Scheduling videos...")
+                publish_date = parse_schedule(args.schedule)
+
+            # 去重并保持顺序，第一个目标来自位置参数
+            targets = list(dict.fromkeys([(args.platform, args.account_name)] + args.targets))
+            results = await fan_out_upload(targets, args.video_file, publish_date)
+            print_upload_results(results)
+        elif args.action == 'watch':
+            targets = list(dict.fromkeys([(args.platform, args.account_name)] + args.targets))
+
+            async def upload_new_video(video_file):
+                results = await fan_out_upload(targets, str(video_file), 0)
+                print_upload_results(results)
 
-        await app.main()
+            await watch_and_upload(args.video_dir, upload_new_video, workers=args.workers,
+                                   queue_size=args.queue_size, settle_seconds=args.settle_seconds,
+                                   poll_interval=args.poll_interval, scan_existing=args.scan_existing)
+    finally:
+        # 出错或 Ctrl-C 退出 watch 时也要关闭共享浏览器池和进程池，避免残留 Chromium 和 ffmpeg 进程
+        try:
+            await browser_pool.close()
+        finally:
+            transcoder.close()
+            cover_pipeline.close()
 
 
 if __name__ == "__main__":
@@ -2,4 +2,104 @@ from pathlib import Path
 
 BASE_DIR = Path(__file__).parent.resolve()
 XHS_SERVER = "http://127.0.0.1:11901"
-LOCAL_CHROME_PATH = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
\ No newline at end of file
+LOCAL_CHROME_PATH = "/Applications/Google Chrome.app/Contents/MacOS/Google Chrome"
+
+# 小红书本地签名页面池
+XHS_SIGN_POOL_SIZE = 8  # 最多常驻的签名页面数（按 a1 区分）
+XHS_SIGN_PAGE_TTL = 30 * 60  # 签名页面最长存活时间（秒），超时后重建
+
+# cookie 校验结果缓存时间（秒），缓存有效期内上传前不再打开浏览器校验 cookie
+COOKIE_CACHE_TTL = 6 * 60 * 60
+
+# 多平台同时上传时每个平台的最大并发数
+PLATFORM_CONCURRENCY = {
+    "douyin": 2,
+    "tencent": 1,
+    "tiktok": 2,
+    "kuaishou": 2,
+}
+
+# 本地 SQLite 数据（上传任务队列等）存放目录
+DB_DIR = BASE_DIR / "db"
+
+# B 站分片上传断点的有效期（秒），超过后 upos 的 upload_id 可能已失效，重新上传
+BILIBILI_CHECKPOINT_TTL = 24 * 60 * 60
+
+# B 站分片上传并发数范围，按实际吞吐在范围内自动增减（AIMD）
+BILIBILI_MIN_UPLOAD_WORKERS = 1
+BILIBILI_MAX_UPLOAD_WORKERS = 16
+
+# 本机所有上传任务共享的带宽上限（字节/秒），跨进程生效，0 表示不限制
+UPLOAD_BANDWIDTH_LIMIT = 0
+
+# B 站上传线路探测结果缓存时间（秒）；实际上传吞吐低于线路平均值的这个比例时提前重新探测
+BILIBILI_LINE_CACHE_TTL = 6 * 60 * 60
+BILIBILI_LINE_DEGRADE_RATIO = 0.5
+
+# 小红书话题缓存：有效期、查不到话题的标签（负缓存）有效期（秒），以及最多缓存的标签数
+XHS_TOPIC_CACHE_TTL = 7 * 24 * 60 * 60
+XHS_TOPIC_NEGATIVE_TTL = 24 * 60 * 60
+XHS_TOPIC_CACHE_SIZE = 5000
+
+# 小红书话题查询：同时请求的最大线程数，以及账号令牌桶允许的突发请求数
+XHS_TOPIC_CONCURRENCY = 4
+XHS_TOPIC_BURST = 3
+
+# 发布频率控制（按平台、账号）：同一账号两次上传的最小间隔（秒）、额外随机抖动（秒）、每天最多发布次数（0 不限制）
+# 查找顺序为 "平台:账号"、"平台"、"default"，例如 "xhs:account2": {"daily_cap": 5}
+RATE_GOVERNOR_POLICIES = {
+    "default": {"min_interval": 30, "jitter": 15, "daily_cap": 0},
+    "xhs": {"min_interval": 30, "jitter": 30, "daily_cap": 20},
+    "bilibili": {"min_interval": 30, "jitter": 15, "daily_cap": 50},
+}
+
+# 上传前的视频检查（只读取 MP4 文件头）：支持的视频编码、时长范围（秒）、文件大小上限（字节），按平台覆盖 default
+MEDIA_PREFLIGHT_RULES = {
+    "default": {"video_codecs": ["h264", "hevc"], "min_duration": 1, "max_duration": 60 * 60,
+                "max_size": 4 * 1024 ** 3, "require_faststart": False},
+    "tiktok": {"max_duration": 10 * 60},
+    "xhs": {"max_duration": 15 * 60},
+    "bilibili": {"video_codecs": ["h264", "hevc", "av1"], "max_size": 8 * 1024 ** 3},
+}
+
+# 上传前转码/重新封装：ffmpeg 命令、进程池大小（0 表示按 CPU 核数）、缓存目录上限（字节）
+# 各平台接受的编码、长边像素和码率上限（0 不限制），不满足时转码为 H.264/AAC；只是 moov 在末尾时仅重新封装
+TRANSCODE_FFMPEG = "ffmpeg"
+TRANSCODE_WORKERS = 0
+TRANSCODE_CACHE_MAX_BYTES = 20 * 1024 ** 3
+TRANSCODE_PROFILES = {
+    "default": {"video_codecs": ["h264", "hevc"], "audio_codecs": ["aac"], "max_long_side": 3840, "max_bitrate": 0,
+                "crf": 20, "preset": "veryfast", "audio_bitrate": "192k"},
+    # 视频号对 HEVC 和高分辨率视频处理不稳定，统一转为 H.264 1080p
+    "tencent": {"video_codecs": ["h264"], "max_long_side": 1920},
+    "tiktok": {"max_long_side": 1920},
+}
+
+# 封面生成：进程池大小（0 表示按 CPU 核数）、缓存目录上限（字节）
+# 各平台封面的宽高和文件大小上限，auto 为 True 时没有封面图的视频也会从视频中截取一帧作为封面
+COVER_WORKERS = 0
+COVER_CACHE_MAX_BYTES = 1024 ** 3
+COVER_PROFILES = {
+    # 从视频截取封面时抽取 sample_frames 个关键帧（缩小到 sample_width 宽）打分，选出最好的一帧；
+    # 打分失败时使用 frame_at 处（占时长的比例）的画面
+    "default": {"width": 1080, "height": 1440, "max_bytes": 500 * 1024, "auto": False, "frame_at": 0.1,
+                "sample_frames": 24, "sample_width": 240},
+    # 抖音网页端的封面上传暂时关闭（见 examples/upload_video_to_douyin.py），需要时把 auto 改为 True
+    "douyin": {"width": 1080, "height": 1440},
+    "tiktok": {"width": 1080, "height": 1920, "auto": True},
+    "xhs": {"width": 1080, "height": 1440, "auto": True},
+}
+
+# 自动选择封面帧时各项得分的权重（见 utils/frame_scorer.py）
+COVER_SCORE_WEIGHTS = {"sharpness": 0.5, "exposure": 0.3, "colorfulness": 0.2}
+
+# 近似重复检测：每个视频取 NEAR_DUPLICATE_SAMPLE_FRAMES 个关键帧计算感知哈希，汉明距离（0 ~ 64）不超过
+# NEAR_DUPLICATE_MAX_DISTANCE 视为同一画面；与同一账号已发布视频相同画面的比例达到 NEAR_DUPLICATE_MIN_RATIO、
+# 且相同画面至少有 NEAR_DUPLICATE_MIN_FRAMES 帧时不再上传（只有一两帧的短视频按实际帧数）
+NEAR_DUPLICATE_SAMPLE_FRAMES = 16
+NEAR_DUPLICATE_MAX_DISTANCE = 10
+NEAR_DUPLICATE_MIN_RATIO = 0.6
+NEAR_DUPLICATE_MIN_FRAMES = 3
+
+# 视频库索引（utils/library_index.py）：目录下存在这些清单文件时，清单中的标题和话题优先于同名 txt
+LIBRARY_MANIFEST_NAMES = ["manifest.jsonl", "manifest.csv"]
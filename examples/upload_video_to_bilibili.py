@@ -1,10 +1,18 @@
-import time
+import os
+import socket
 from pathlib import Path
 
-from uploader.bilibili_uploader.main import read_cookie_json_file, extract_keys_from_json, random_emoji, BilibiliUploader
+from uploader.bilibili_uploader.main import load_cookie_data, random_emoji, BilibiliBatchUploader
 from conf import BASE_DIR
 from utils.constant import VideoZoneTypes
-from utils.files_times import generate_schedule_time_next_day, get_title_and_hashtags
+from utils.files_times import generate_schedule_time_next_day
+from utils.library_index import library_index
+from utils.near_duplicates import near_duplicate_index
+from utils.publish_ledger import publish_ledger
+from utils.job_queue import JobQueue, LeaseLostError, JOB_UPLOADING
+from utils.rate_governor import DailyCapReached, rate_governor
+from utils.transcode import transcoder
+from utils.tracing import span, trace_context
 
 if __name__ == '__main__':
     filepath = Path(BASE_DIR) / "videos"
@@ -13,30 +21,83 @@ if __name__ == '__main__':
     if not account_file.exists():
         print(f"{account_file.name} 配置文件不存在")
         exit()
-    cookie_data = read_cookie_json_file(account_file)
-    cookie_data = extract_keys_from_json(cookie_data)
+    cookie_data = load_cookie_data(account_file)
 
     tid = VideoZoneTypes.SPORTS_FOOTBALL.value  # 设置分区id
     # 获取视频目录
     folder_path = Path(filepath)
-    # 获取文件夹中的所有文件
-    files = list(folder_path.glob("*.mp4"))
+    # 增量更新视频库索引：只重新读取大小或修改时间变化的视频和 txt，不再每次遍历、打开所有文件
+    library_index.update(folder_path)
+    # 查询还没有发布到这个账号的视频（按内容哈希判断，改名后也能识别），按索引中的文件头信息跳过损坏或平台不支持的视频
+    entries = library_index.unpublished("bilibili", account_file.stem, root=folder_path)
+    entries = library_index.filter_uploadable(entries, "bilibili")
+    # 跳过与这个账号已发布视频画面几乎相同的视频（重新编码、剪辑过的版本），避免被平台判为重复内容
+    files = near_duplicate_index.filter_near_duplicates([entry.path for entry in entries], "bilibili", account_file.stem)
     file_num = len(files)
     timestamps = generate_schedule_time_next_day(file_num, 1, daily_times=[16], timestamps=True)
 
+    # 任务持久化到本地队列，中途崩溃后重新运行会跳过已经发布的视频
+    job_queue = JobQueue()
     for index, file in enumerate(files):
-        title, tags = get_title_and_hashtags(str(file))
-        # just avoid error, bilibili don't allow same title of video.
-        title += random_emoji()
-        tags_str = ','.join([tag for tag in tags])
-        # 打印视频文件名、标题和 hashtag
-        print(f"视频文件名：{file}")
-        print(f"标题：{title}")
-        print(f"Hashtag：{tags}")
-        # I set desc same as title, do what u like.
-        desc = title
-        bili_uploader = BilibiliUploader(cookie_data, file, title, desc, tid, tags, timestamps[index])
-        bili_uploader.upload()
+        job_queue.enqueue("bilibili", account_file.stem, str(file), {"dtime": timestamps[index]})
+        # 提前提交转码/重新封装任务，上传前面的视频时后面的视频在进程池中处理
+        transcoder.prepare(file, "bilibili")
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
 
-        # life is beautiful don't so rush. be kind be patience
-        time.sleep(30)
+    # 整批只登录一次，复用同一个会话上传和投稿
+    with BilibiliBatchUploader(cookie_data) as batch:
+        while True:
+            # life is beautiful don't so rush. be kind be patience
+            # 发布频率由 rate_governor 按账号控制：上传前在 slot 中等到该账号允许发布，今天次数用完就停止
+            try:
+                rate_governor.check_daily_cap("bilibili", account_file.stem)
+            except DailyCapReached as e:
+                print(f"{e}，剩余任务明天再上传")
+                break
+            job = job_queue.claim(worker_id, platform="bilibili")
+            if job is None:
+                break
+            file = Path(job.video_path)
+            # 任务可能是之前运行时加入的，按路径从索引读取标题和话题
+            entry = library_index.get(file)
+            if entry is None:
+                # 视频已经被移动或删除，重试几次后进入死信列表
+                job_queue.fail(job, "视频不在视频库索引中")
+                continue
+            title, tags = entry.title, entry.tags
+            # just avoid error, bilibili don't allow same title of video.
+            title += random_emoji()
+            tags_str = ','.join([tag for tag in tags])
+            # 打印视频文件名、标题和 hashtag
+            print(f"视频文件名：{file}")
+            print(f"标题：{title}")
+            print(f"Hashtag：{tags}")
+            # I set desc same as title, do what u like.
+            desc = title
+            try:
+                # 转码、等待发布间隔和上传期间后台续租，避免租约过期后被其他 worker 重复发布
+                with job_queue.keep_alive(job):
+                    job_queue.transition(job, JOB_UPLOADING)
+                    upload_file = transcoder.prepare(file, job.platform).result()
+                    with rate_governor.slot(job.platform, job.account) as governor_slot, \
+                            trace_context(platform=job.platform, account=job.account, job_id=job.id), span("upload"):
+                        uploaded = batch.upload(upload_file, title, desc, tid, tags, job.payload["dtime"])
+                        # 投稿失败不计入当天的发布次数
+                        governor_slot.success = bool(uploaded)
+                    if uploaded:
+                        # 先写发布记录再结束任务，两步之间崩溃时下次运行不会重新投稿
+                        publish_ledger.record(file, job.platform, job.account,
+                                              batch.submitted[str(upload_file)].get('bvid'))
+                        job_queue.complete(job)
+                    else:
+                        job_queue.fail(job, "submit failed")
+            except LeaseLostError as e:
+                # 任务已经被其他 worker 接管，由对方负责
+                print(f"{e}，跳过")
+            except Exception as e:
+                job_queue.fail(job, e)
+
+    transcoder.close()
+    print(f"任务统计: {job_queue.stats()}")
+    for dead_job in job_queue.dead_letters(platform="bilibili"):
+        print(f"上传失败: {dead_job.video_path} {dead_job.last_error}")
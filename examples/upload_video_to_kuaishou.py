@@ -3,24 +3,46 @@ from pathlib import Path
 
 from conf import BASE_DIR
 from uploader.ks_uploader.main import ks_setup, KSVideo
-from utils.files_times import generate_schedule_time_next_day, get_title_and_hashtags
+from utils.browser_pool import browser_pool
+from utils.files_times import generate_schedule_time_next_day
+from utils.library_index import library_index
+from utils.near_duplicates import near_duplicate_index
+from utils.publish_ledger import publish_ledger
+from utils.transcode import transcoder
 
 
-if __name__ == '__main__':
+async def main():
     filepath = Path(BASE_DIR) / "videos"
     account_file = Path(BASE_DIR / "cookies" / "ks_uploader" / "account.json")
     # 获取视频目录
     folder_path = Path(filepath)
-    # 获取文件夹中的所有文件
-    files = list(folder_path.glob("*.mp4"))
+    # 增量更新视频库索引：只重新读取大小或修改时间变化的视频和 txt，不再每次遍历、打开所有文件
+    library_index.update(folder_path)
+    # 查询还没有发布到这个账号的视频（按内容哈希判断，改名后也能识别），按索引中的文件头信息跳过损坏或平台不支持的视频
+    entries = library_index.unpublished("kuaishou", account_file.stem, root=folder_path)
+    entries = {entry.path: entry for entry in library_index.filter_uploadable(entries, "kuaishou")}
+    # 跳过与这个账号已发布视频画面几乎相同的视频（重新编码、剪辑过的版本），避免被平台判为重复内容
+    files = near_duplicate_index.filter_near_duplicates(list(entries), "kuaishou", account_file.stem)
     file_num = len(files)
     publish_datetimes = generate_schedule_time_next_day(file_num, 1, daily_times=[16])
-    cookie_setup = asyncio.run(ks_setup(account_file, handle=False))
+    # 提前为所有视频提交转码/重新封装任务，上传前面的视频时后面的视频在进程池中处理
+    for file in files:
+        transcoder.prepare(file, "kuaishou")
+    cookie_setup = await ks_setup(account_file, handle=False)
     for index, file in enumerate(files):
-        title, tags = get_title_and_hashtags(str(file))
+        title, tags = entries[file].title, entries[file].tags
+        upload_file = await transcoder.prepare_async(file, "kuaishou")
         # 打印视频文件名、标题和 hashtag
         print(f"视频文件名：{file}")
         print(f"标题：{title}")
         print(f"Hashtag：{tags}")
-        app = KSVideo(title, file, tags, publish_datetimes[index], account_file)
-        asyncio.run(app.main(), debug=False)
+        app = KSVideo(title, upload_file, tags, publish_datetimes[index], account_file)
+        await app.main()
+        publish_ledger.record(file, "kuaishou", account_file.stem)
+    # 所有视频共用同一个浏览器，全部完成后再关闭
+    await browser_pool.close()
+    transcoder.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(), debug=False)
@@ -4,27 +4,57 @@ from pathlib import Path
 from conf import BASE_DIR
 # from tk_uploader.main import tiktok_setup, TiktokVideo
 from uploader.tk_uploader.main_chrome import tiktok_setup, TiktokVideo
-from utils.files_times import generate_schedule_time_next_day, get_title_and_hashtags
+from utils.browser_pool import browser_pool
+from utils.covers import cover_pipeline, find_sidecar
+from utils.files_times import generate_schedule_time_next_day
+from utils.library_index import library_index
+from utils.near_duplicates import near_duplicate_index
+from utils.publish_ledger import publish_ledger
+from utils.transcode import transcoder
 
 
-if __name__ == '__main__':
+async def main():
     filepath = Path(BASE_DIR) / "videos"
     account_file = Path(BASE_DIR / "cookies" / "tk_uploader" / "account.json")
     folder_path = Path(filepath)
-    # get video files from folder
-    files = list(folder_path.glob("*.mp4"))
+    # update the library index incrementally, only videos and txt files whose size or mtime changed are read again
+    library_index.update(folder_path)
+    # videos not yet published to this account (matched by content hash, survives renames),
+    # skip broken or unsupported videos using the header info stored in the index
+    entries = library_index.unpublished("tiktok", account_file.stem, root=folder_path)
+    entries = {entry.path: entry for entry in library_index.filter_uploadable(entries, "tiktok")}
+    # skip near duplicates (re-encoded or trimmed versions) of videos already published to this account
+    files = near_duplicate_index.filter_near_duplicates(list(entries), "tiktok", account_file.stem)
     file_num = len(files)
     publish_datetimes = generate_schedule_time_next_day(file_num, 1, daily_times=[16])
-    cookie_setup = asyncio.run(tiktok_setup(account_file, handle=True))
-    for index, file in enumerate(files):
-        title, tags = get_title_and_hashtags(str(file))
-        thumbnail_path = file.with_suffix('.png')
-        print(f"video_file_name：{file}")
-        print(f"video_title：{title}")
-        print(f"video_hashtag：{tags}")
-        if thumbnail_path.exists():
-            print(f"thumbnail_file_name：{thumbnail_path}")
-            app = TiktokVideo(title, file, tags, publish_datetimes[index], account_file, thumbnail_path)
-        else:
-            app = TiktokVideo(title, file, tags, publish_datetimes[index], account_file)
-        asyncio.run(app.main(), debug=False)
+    try:
+        # submit all videos for remux/transcode and cover generation up front,
+        # later ones are processed while earlier ones upload
+        for file in files:
+            transcoder.prepare(file, "tiktok")
+            cover_pipeline.prepare(file, "tiktok", find_sidecar(file))
+        cookie_setup = await tiktok_setup(account_file, handle=True)
+        for index, file in enumerate(files):
+            title, tags = entries[file].title, entries[file].tags
+            upload_file = await transcoder.prepare_async(file, "tiktok")
+            # cover resized for tiktok from the sidecar image, or a frame of the video when there is none
+            thumbnail_path = await cover_pipeline.prepare_async(file, "tiktok", find_sidecar(file))
+            print(f"video_file_name：{file}")
+            print(f"video_title：{title}")
+            print(f"video_hashtag：{tags}")
+            if thumbnail_path:
+                print(f"thumbnail_file_name：{thumbnail_path}")
+            app = TiktokVideo(title, upload_file, tags, publish_datetimes[index], account_file, thumbnail_path)
+            await app.main()
+            publish_ledger.record(file, "tiktok", account_file.stem)
+    finally:
+        # all videos share one browser, close it after the last upload or when an upload fails
+        try:
+            await browser_pool.close()
+        finally:
+            transcoder.close()
+            cover_pipeline.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(), debug=False)
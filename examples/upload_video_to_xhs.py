@@ -1,23 +1,47 @@
 import configparser
+import os
+import socket
 from pathlib import Path
-from time import sleep
 
 from xhs import XhsClient
 
 from conf import BASE_DIR
-from utils.files_times import generate_schedule_time_next_day, get_title_and_hashtags
+from utils.files_times import generate_schedule_time_next_day
 from uploader.xhs_uploader.main import sign_local, beauty_print
+from uploader.xhs_uploader.topic_cache import topic_cache
+from utils.covers import cover_pipeline, find_sidecar
+from utils.job_queue import JobQueue, LeaseLostError, JOB_UPLOADING, JOB_PUBLISHING
+from utils.library_index import library_index
+from utils.near_duplicates import near_duplicate_index
+from utils.publish_ledger import publish_ledger
+from utils.rate_governor import DailyCapReached, rate_governor
+from utils.transcode import transcoder
+from utils.tracing import span, trace_context
 
 config = configparser.RawConfigParser()
 config.read(Path(BASE_DIR / "uploader" / "xhs_uploader" / "accounts.ini"))
 
 
+def find_posted_note(xhs_client, title):
+    """在账号最近发布的笔记中按标题查找，还没到发布时间的定时笔记查不到"""
+    user_id = xhs_client.get_self_info2().get("user_id")
+    for note in xhs_client.get_user_notes(user_id).get("notes", []):
+        if note.get("display_title") == title:
+            return note
+    return None
+
+
 if __name__ == '__main__':
     filepath = Path(BASE_DIR) / "videos"
     # 获取视频目录
     folder_path = Path(filepath)
-    # 获取文件夹中的所有文件
-    files = list(folder_path.glob("*.mp4"))
+    # 增量更新视频库索引：只重新读取大小或修改时间变化的视频和 txt，不再每次遍历、打开所有文件
+    library_index.update(folder_path)
+    # 查询还没有发布到这个账号的视频（按内容哈希判断，改名后也能识别），按索引中的文件头信息跳过损坏或平台不支持的视频
+    entries = library_index.unpublished("xhs", "account1", root=folder_path)
+    entries = library_index.filter_uploadable(entries, "xhs")
+    # 跳过与这个账号已发布视频画面几乎相同的视频（重新编码、剪辑过的版本），避免被平台判为重复内容
+    files = near_duplicate_index.filter_near_duplicates([entry.path for entry in entries], "xhs", "account1")
     file_num = len(files)
 
     cookies = config['account1']['cookies']
@@ -32,8 +56,34 @@ if __name__ == '__main__':
 
     publish_datetimes = generate_schedule_time_next_day(file_num, 1, daily_times=[16])
 
+    # 任务持久化到本地队列，中途崩溃后重新运行会跳过已经发布的视频
+    job_queue = JobQueue()
     for index, file in enumerate(files):
-        title, tags = get_title_and_hashtags(str(file))
+        job_queue.enqueue("xhs", "account1", str(file),
+                          {"post_time": publish_datetimes[index].strftime("%Y-%m-%d %H:%M:%S")})
+        # 提前提交转码/重新封装和封面生成任务，上传前面的视频时后面的视频在进程池中处理
+        transcoder.prepare(file, "xhs")
+        cover_pipeline.prepare(file, "xhs", find_sidecar(file))
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+
+    while True:
+        # 发布频率由 rate_governor 按账号控制：上传前在 slot 中等到该账号允许发布，今天次数用完就停止
+        try:
+            rate_governor.check_daily_cap("xhs", "account1")
+        except DailyCapReached as e:
+            print(f"{e}，剩余任务明天再上传")
+            break
+        job = job_queue.claim(worker_id, platform="xhs")
+        if job is None:
+            break
+        file = Path(job.video_path)
+        # 任务可能是之前运行时加入的，按路径从索引读取标题和话题
+        entry = library_index.get(file)
+        if entry is None:
+            # 视频已经被移动或删除，重试几次后进入死信列表
+            job_queue.fail(job, "视频不在视频库索引中")
+            continue
+        title, tags = entry.title, entry.tags
         # 加入到标题 补充标题（xhs 可以填1000字不写白不写）
         tags_str = ' '.join(['#' + tag for tag in tags])
         hash_tags_str = ''
@@ -44,25 +94,53 @@ if __name__ == '__main__':
         print(f"标题：{title}")
         print(f"Hashtag：{tags}")
 
-        topics = []
-        # 获取hashtag
-        for i in tags[:3]:
-            topic_official = xhs_client.get_suggest_topic(i)
-            if topic_official:
-                topic_official[0]['type'] = 'topic'
-                topic_one = topic_official[0]
-                hash_tag_name = topic_one['name']
-                hash_tags.append(hash_tag_name)
-                topics.append(topic_one)
-
-        hash_tags_str = ' ' + ' '.join(['#' + tag + '[话题]#' for tag in hash_tags])
-
-        note = xhs_client.create_video_note(title=title[:20], video_path=str(file),
-                                            desc=title + tags_str + hash_tags_str,
-                                            topics=topics,
-                                            is_private=False,
-                                            post_time=publish_datetimes[index].strftime("%Y-%m-%d %H:%M:%S"))
+        try:
+            # 查询话题、转码、等待发布间隔和上传期间后台续租，避免租约过期后被其他 worker 重复发布
+            with job_queue.keep_alive(job):
+                if job.state == JOB_PUBLISHING:
+                    # 接管的任务：上一个 worker 可能已经发布了笔记才崩溃，确认没有发布过再重新发布
+                    published = publish_ledger.is_published(file, job.platform, job.account)
+                    note = dict(published) if published is not None else find_posted_note(xhs_client, title[:20])
+                    if note is not None:
+                        print(f"{file} 已经发布过，不再重复发布")
+                        if published is None:
+                            publish_ledger.record(file, job.platform, job.account, note.get("note_id"))
+                        job_queue.complete(job, note)
+                        continue
+                else:
+                    job_queue.transition(job, JOB_UPLOADING)
+
+                # 获取hashtag，常用标签直接命中本地话题缓存
+                topics, hash_tags = topic_cache.resolve_many(xhs_client, tags[:3], tag_delay=0)
+                hash_tags_str = ' ' + ' '.join(['#' + tag + '[话题]#' for tag in hash_tags])
+
+                upload_file = transcoder.prepare(file, job.platform).result()
+                cover_path = cover_pipeline.prepare(file, job.platform, find_sidecar(file)).result()
+                with rate_governor.slot(job.platform, job.account), \
+                        trace_context(platform=job.platform, account=job.account, job_id=job.id), span("upload"):
+                    # create_video_note 会在同一次调用里上传视频并发布笔记，从这里开始可能已经发布
+                    job_queue.transition(job, JOB_PUBLISHING)
+                    note = xhs_client.create_video_note(title=title[:20], video_path=upload_file,
+                                                        desc=title + tags_str + hash_tags_str,
+                                                        topics=topics,
+                                                        cover_path=cover_path,
+                                                        is_private=False,
+                                                        post_time=job.payload["post_time"])
+                # 先写发布记录再结束任务，两步之间崩溃时下次运行不会重新发布
+                publish_ledger.record(file, job.platform, job.account,
+                                      note.get("id") if isinstance(note, dict) else None)
+                job_queue.complete(job, note)
+        except LeaseLostError as e:
+            # 任务已经被其他 worker 接管，由对方负责
+            print(f"{e}，跳过")
+            continue
+        except Exception as e:
+            print(f"上传失败: {e}")
+            job_queue.fail(job, e)
+            continue
 
         beauty_print(note)
-        # 强制休眠30s，避免风控（必要）
-        sleep(30)
+
+    transcoder.close()
+    cover_pipeline.close()
+    print(f"任务统计: {job_queue.stats()}")
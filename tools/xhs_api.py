@@ -4,7 +4,7 @@ from pathlib import Path
 import re
 import json
 from datetime import datetime
-from time import sleep
+from contextlib import nullcontext
 import configparser
 
 # 添加项目根目录到Python路径
@@ -12,6 +12,10 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from conf import BASE_DIR
 from uploader.xhs_uploader.main import sign_local, beauty_print
+from uploader.xhs_uploader.topic_cache import topic_cache
+from utils.covers import cover_pipeline
+from utils.publish_ledger import format_time, publish_ledger
+from utils.rate_governor import DailyCapReached, rate_governor
 from xhs import XhsClient
 
 def _get_cookies_from_sources(
@@ -81,11 +85,12 @@ def upload_video_to_xhs(
     publish_time: str = None,
     private: bool = False,
     no_sleep: bool = False,
-    sleep_time: int = 30,
+    sleep_time: int = None,
     tag_delay: float = 1.0,
     max_tags: int = 20,
     cookies_str: str = None,
-    silent: bool = True
+    silent: bool = True,
+    force: bool = False
 ):
     """
     Uploads a video to Xiaohongshu (Little Red Book).
@@ -95,18 +100,21 @@ def upload_video_to_xhs(
         title (str, optional): Video title. Defaults to filename stem.
         tags (str, optional): Space-separated tags, e.g., "#tag1 #tag2".
         desc (str, optional): Video description. Defaults to title.
-        cover_path (str, optional): Path to the cover image file.
+        cover_path (str, optional): Path to the cover image file, cropped and compressed to the XHS size.
+            A frame of the video is used when not given (see conf.COVER_PROFILES).
         cookie_file (str, optional): Path to the cookie file.
         account (str, optional): Account name in config file. Defaults to "account1".
         config_file (str, optional): Path to the config file.
         publish_time (str, optional): Scheduled publish time "YYYY-MM-DD HH:MM:SS".
         private (bool, optional): Set to True for private upload.
-        no_sleep (bool, optional): Set to True to disable sleep after upload.
-        sleep_time (int, optional): Sleep duration in seconds after upload.
+        no_sleep (bool, optional): Set to True to bypass the per-account rate governor.
+        sleep_time (int, optional): Minimum interval in seconds between two uploads of the same account.
+            Defaults to conf.RATE_GOVERNOR_POLICIES.
         tag_delay (float, optional): Delay between topic tag lookups.
         max_tags (int, optional): Maximum number of tags to process.
         cookies_str (str, optional): Pass cookies directly as a string.
         silent (bool, optional): Suppress print outputs.
+        force (bool, optional): Upload even if the publish ledger says this video was already published.
 
     Returns:
         dict: {
@@ -134,6 +142,15 @@ def upload_video_to_xhs(
                 "message": f"Unsupported video format: {path.suffix}. Supported: .mp4, .mov, .avi, .mkv"
             }
 
+        # Skip videos already published to this account (matched by content hash, so renames are detected too)
+        published = None if force else publish_ledger.is_published(path, "xhs", account)
+        if published is not None:
+            return {
+                "status": 409,
+                "message": f"Video already published to xhs:{account} at {format_time(published['published_at'])}",
+                "data": {"post_id": published["post_id"]}
+            }
+
         # Get cookies
         _config_path_obj = Path(config_file) if config_file else None
         _cookies, cookie_error = _get_cookies_from_sources(
@@ -185,25 +202,12 @@ def upload_video_to_xhs(
             elif not parsed_tags and tags and not tags.startswith('#'):
                 parsed_tags = tags.split()
 
-        # Get official topic tags
+        # Get official topic tags (cached on disk, tag_delay only applies between real lookups)
         topics = []
         hash_tags_names = []
         if parsed_tags:
             tags_to_process = parsed_tags[:max_tags] if max_tags > 0 else parsed_tags
-            for idx, tag_name in enumerate(tags_to_process):
-                try:
-                    topic_official_list = xhs_client.get_suggest_topic(tag_name)
-                    if topic_official_list and len(topic_official_list) > 0:
-                        topic_official = topic_official_list[0]
-                        topic_official['type'] = 'topic'
-                        topics.append(topic_official)
-                        hash_tags_names.append(topic_official['name'])
-                    if idx < len(tags_to_process) - 1 and tag_delay > 0:
-                        sleep(tag_delay)
-                except Exception as e:
-                    print(f"Warning: Failed to get topic for tag '{tag_name}': {e}")
-                    if idx < len(tags_to_process) - 1 and tag_delay > 0:
-                        sleep(tag_delay * 2)
+            topics, hash_tags_names = topic_cache.resolve_many(xhs_client, tags_to_process, tag_delay)
 
         # Prepare description
         final_desc = desc if desc else final_title
@@ -225,26 +229,24 @@ def upload_video_to_xhs(
                     sys.stdout = open(os.devnull, 'w')
                 post_time_str = None
 
-        # Upload video
+        # Resize/compress the cover to the XHS variant (a video frame is used when no cover is given)
+        cover_path = cover_pipeline.prepare(path, "xhs", cover_path).result()
+
+        # Upload video. The rate governor only makes this account wait for its own previous upload
+        # (min interval + jitter + daily cap, shared across processes), other accounts are not blocked.
         try:
-            note = xhs_client.create_video_note(
-                title=final_title[:20],
-                video_path=str(path),
-                desc=final_desc,
-                topics=topics,
-                cover_path=cover_path,
-                is_private=private,
-                post_time=post_time_str
-            )
-            
-            # Sleep if not disabled
-            if not no_sleep:
-                if silent and old_stdout:
-                    sys.stdout = old_stdout
-                print(f"Sleeping for {sleep_time} seconds to avoid rate limits...")
-                if silent:
-                    sys.stdout = open(os.devnull, 'w')
-                sleep(sleep_time)
+            governor_slot = nullcontext() if no_sleep else rate_governor.slot("xhs", account, min_interval=sleep_time)
+            with governor_slot:
+                note = xhs_client.create_video_note(
+                    title=final_title[:20],
+                    video_path=str(path),
+                    desc=final_desc,
+                    topics=topics,
+                    cover_path=cover_path,
+                    is_private=private,
+                    post_time=post_time_str
+                )
+            publish_ledger.record(path, "xhs", account, note.get("id") if isinstance(note, dict) else None)
 
             return {
                 "status": 200,
@@ -252,6 +254,11 @@ def upload_video_to_xhs(
                 "data": note
             }
 
+        except DailyCapReached as e:
+            return {
+                "status": 429,
+                "message": f"Daily upload cap reached: {str(e)}"
+            }
         except Exception as e:
             return {
                 "status": 500,
@@ -13,7 +13,7 @@ import os
 import sys
 from datetime import datetime
 from pathlib import Path
-from time import sleep
+from contextlib import nullcontext
 import re
 
 # 添加项目根目录到 Python 路径
@@ -21,6 +21,10 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from conf import BASE_DIR
 from uploader.xhs_uploader.main import sign_local, beauty_print
+from uploader.xhs_uploader.topic_cache import topic_cache
+from utils.covers import cover_pipeline
+from utils.publish_ledger import format_time, publish_ledger
+from utils.rate_governor import rate_governor
 from xhs import XhsClient
 
 
@@ -35,16 +39,17 @@ def parse_args():
     parser.add_argument("--title", type=str, help="视频标题")
     parser.add_argument("--tags", type=str, help="标签，用空格分隔，例如：#标签1 #标签2 #标签3")
     parser.add_argument("--desc", type=str, help="视频描述，不提供则自动生成")
-    parser.add_argument("--cover", type=str, help="封面图片路径")
+    parser.add_argument("--cover", type=str, help="封面图片路径，会按小红书的尺寸裁剪压缩；不指定时从视频中截取一帧")
     parser.add_argument("--cookie_file", type=str, help="Cookie文件路径")
     parser.add_argument("--account", type=str, default="account1", help="账号名称，默认为account1")
     parser.add_argument("--config_file", type=str, help="配置文件路径")
     parser.add_argument("--publish_time", type=str, help="发布时间，格式为YYYY-MM-DD HH:MM:SS，不提供则立即发布")
     parser.add_argument("--private", action="store_true", help="是否私密发布，默认为公开")
-    parser.add_argument("--no_sleep", action="store_true", help="上传后不休眠（默认会休眠30秒以避免风控）")
-    parser.add_argument("--sleep_time", type=int, default=30, help="上传后休眠时间（秒），默认30秒")
+    parser.add_argument("--no_sleep", action="store_true", help="不做发布频率控制（默认同一账号两次上传之间会保持最小间隔以避免风控）")
+    parser.add_argument("--sleep_time", type=int, help="同一账号两次上传的最小间隔（秒），默认见 conf.RATE_GOVERNOR_POLICIES")
     parser.add_argument("--batch", action="store_true", help="批量模式，遇到错误继续处理")
-    parser.add_argument("--tag_delay", type=float, default=1.0, help="标签请求之间的延迟时间（秒），默认1秒")
+    parser.add_argument("--force", action="store_true", help="忽略发布记录，已经发布过的视频也重新上传")
+    parser.add_argument("--tag_delay", type=float, default=1.0, help="同一账号话题请求的平均间隔（秒），默认1秒，被限流时自动放慢")
     parser.add_argument("--max_tags", type=int, default=20, help="最大处理标签数量，默认20个")
     
     return parser.parse_args()
@@ -92,12 +97,12 @@ def validate_video_path(video_path):
 
 
 def get_topic_tags(xhs_client, tags, tag_delay=1.0, max_tags=20):
-    """获取话题标签，并添加频率控制
+    """获取话题标签，未命中缓存的标签并发查询，同一账号的请求速率由共享令牌桶控制
     
     Args:
         xhs_client: XhsClient 实例
         tags: 标签列表
-        tag_delay: 每次请求之间的延迟时间（秒）
+        tag_delay: 平均每次请求的间隔时间（秒），被限流时会自动放慢
         max_tags: 最大处理标签数量
         
     Returns:
@@ -111,34 +116,20 @@ def get_topic_tags(xhs_client, tags, tag_delay=1.0, max_tags=20):
     total_tags = len(tags_to_process)
     
     print(f"\n开始处理话题标签，共 {total_tags} 个标签")
+    results = topic_cache.resolve_all(xhs_client, tags_to_process, tag_delay=tag_delay)
     
     for idx, tag in enumerate(tags_to_process):
-        try:
-            print(f"处理标签 [{idx+1}/{total_tags}]: {tag}")
-            topic_official = xhs_client.get_suggest_topic(tag)
-            
-            if topic_official and len(topic_official) > 0:
-                topic_official[0]['type'] = 'topic'
-                topic_one = topic_official[0]
-                hash_tag_name = topic_one['name']
-                hash_tags.append(hash_tag_name)
-                topics.append(topic_one)
-                print(f"✓ 获取成功: #{hash_tag_name}[话题]#")
-            else:
-                print(f"✗ 未找到匹配话题: {tag}")
-            
-            # 请求间隔，避免风控
-            if idx < total_tags - 1 and tag_delay > 0:
-                print(f"等待 {tag_delay} 秒...")
-                sleep(tag_delay)
-                
-        except Exception as e:
-            print(f"✗ 获取话题 {tag} 失败: {e}")
-            # 发生错误后等待更长时间
-            if idx < total_tags - 1 and tag_delay > 0:
-                longer_delay = tag_delay * 2
-                print(f"发生错误，等待 {longer_delay} 秒...")
-                sleep(longer_delay)
+        topic_one, requested, error = results[tag]
+        source = '' if requested else ' (缓存)'
+        if error is not None:
+            print(f"✗ [{idx+1}/{total_tags}] 获取话题 {tag} 失败: {error}")
+        elif topic_one:
+            hash_tag_name = topic_one['name']
+            hash_tags.append(hash_tag_name)
+            topics.append(topic_one)
+            print(f"✓ [{idx+1}/{total_tags}] 获取成功: #{hash_tag_name}[话题]#{source}")
+        else:
+            print(f"✗ [{idx+1}/{total_tags}] 未找到匹配话题: {tag}{source}")
     
     print(f"\n成功处理 {len(topics)}/{total_tags} 个话题标签")
     return topics, hash_tags
@@ -146,6 +137,12 @@ def get_topic_tags(xhs_client, tags, tag_delay=1.0, max_tags=20):
 
 def upload_video(args):
     """上传视频"""
+    # 同一个视频（按内容哈希判断，改名后也能识别）已经发布到这个账号时直接跳过
+    published = None if args.force else publish_ledger.is_published(args.video_path, "xhs", args.account)
+    if published is not None:
+        print(f"视频已于 {format_time(published['published_at'])} 发布到 xhs:{args.account}，跳过（使用 --force 重新发布）")
+        return {"success": True, "skipped": True, "data": {"post_id": published["post_id"]}}
+    
     # 获取cookies
     cookies = get_cookies(args)
     if not cookies:
@@ -244,31 +241,28 @@ def upload_video(args):
         print(f"计划发布时间: {post_time}")
     print(f"发布状态: {'私密' if args.private else '公开'}")
     
-    # 上传视频
+    # 封面按小红书的尺寸裁剪压缩，没有指定封面时从视频中截取一帧
+    cover_path = cover_pipeline.prepare(video_path, "xhs", args.cover).result()
+    
+    # 上传视频，同一账号距离上次上传不足最小间隔时先等待，其他账号不受影响
     try:
-        note = xhs_client.create_video_note(
-            title=title[:20],  # 小红书标题长度限制为20字符
-            video_path=video_path,
-            desc=desc,
-            topics=topics,  # 使用处理后的话题对象列表
-            cover_path=args.cover,
-            is_private=args.private,
-            post_time=post_time
-        )
+        governor_slot = nullcontext() if args.no_sleep else rate_governor.slot(
+            "xhs", args.account, min_interval=args.sleep_time)
+        with governor_slot:
+            note = xhs_client.create_video_note(
+                title=title[:20],  # 小红书标题长度限制为20字符
+                video_path=video_path,
+                desc=desc,
+                topics=topics,  # 使用处理后的话题对象列表
+                cover_path=cover_path,
+                is_private=args.private,
+                post_time=post_time
+            )
+        publish_ledger.record(video_path, "xhs", args.account, note.get("id") if isinstance(note, dict) else None)
         
         print("\n上传成功! 笔记详情:")
         beauty_print(note)
         
-        # 上传后休眠以避免风控
-        if not args.no_sleep:
-            sleep_time = args.sleep_time
-            print(f"\n为避免风控，休眠 {sleep_time} 秒...")
-            for i in range(sleep_time, 0, -1):
-                sys.stdout.write(f"\r休眠中: {i} 秒剩余...")
-                sys.stdout.flush()
-                sleep(1)
-            print("\n休眠结束")
-        
         return {"success": True, "data": note}
     
     except Exception as e:
@@ -286,7 +280,10 @@ def main():
         return {"success": False, "error": "视频路径验证失败"}
     
     # 上传视频并返回结果
-    result = upload_video(args)
+    try:
+        result = upload_video(args)
+    finally:
+        cover_pipeline.close()
     
     # 打印结果但不退出
     if result["success"]:
@@ -1,15 +1,20 @@
 # -*- coding: utf-8 -*-
 import random
 from datetime import datetime
+from pathlib import Path
 
-from playwright.async_api import Playwright, async_playwright, Page
+from playwright.async_api import async_playwright, Page
 import os
 import asyncio
 
-from conf import LOCAL_CHROME_PATH
-from utils.base_social_media import set_init_script
+from utils.base_social_media import set_init_script, get_local_executable_path
+from utils.browser_pool import browser_pool
+from utils.cookie_cache import cookie_cache
 from utils.log import baijiahao_logger
 from utils.network import async_retry
+from utils.tracing import span, trace_context, traced
+from utils.upload_detector import UploadCompletionDetector, UPLOAD_FAILURE, js_has_text
+from utils.waits import wait_for_stable, wait_for_state
 
 
 async def baijiahao_cookie_gen(account_file):
@@ -35,15 +40,17 @@ async def baijiahao_cookie_gen(account_file):
 
 
 async def cookie_auth(account_file):
-    async with async_playwright() as playwright:
-        browser = await playwright.chromium.launch(headless=True)
-        context = await browser.new_context(storage_state=account_file)
-        context = await set_init_script(context)
+    context = await browser_pool.new_context(headless=True, storage_state=account_file)
+    try:
         # 创建一个新的页面
         page = await context.new_page()
         # 访问指定的 URL
         await page.goto("https://baijiahao.baidu.com/builder/rc/home")
-        await page.wait_for_timeout(timeout=5000)
+        # 等待页面请求结束，最多 5 秒
+        try:
+            await page.wait_for_load_state("networkidle", timeout=5000)
+        except Exception:
+            pass
 
         if await page.get_by_text('注册/登录百家号').count():
             baijiahao_logger.error("等待5秒 cookie 失效")
@@ -51,10 +58,12 @@ async def cookie_auth(account_file):
         else:
             baijiahao_logger.success("[+] cookie 有效")
             return True
+    finally:
+        await context.close()
 
 
 async def baijiahao_setup(account_file, handle=False):
-    if not os.path.exists(account_file) or not await cookie_auth(account_file):
+    if not os.path.exists(account_file) or not await cookie_cache.check(account_file, cookie_auth, ("BDUSS",)):
         if not handle:
             return False
         baijiahao_logger.error("cookie文件不存在或已失效，即将自动打开浏览器，请扫码登录，登陆后会自动生成cookie文件")
@@ -69,9 +78,10 @@ class BaiJiaHaoVideo(object):
         self.publish_date = publish_date
         self.account_file = account_file
         self.date_format = '%Y年%m月%d日 %H:%M'
-        self.local_executable_path = LOCAL_CHROME_PATH
+        self.local_executable_path = get_local_executable_path()
         self.proxy_setting = proxy_setting
 
+    @traced()
     async def set_schedule_time(self, page, publish_date):
         """
         todo 时间选择，日后在处理 百家号的时间选择不准确，目前是随机
@@ -88,9 +98,11 @@ class BaiJiaHaoVideo(object):
             except:
                 await page.locator('div.select-wrap').nth(0).click()
         # page.locator(f'div.rc-virtual-list-holder-inner >> text={publish_date_day}').click()
-        await page.wait_for_timeout(2000)
-        await page.locator(f'div.rc-virtual-list  div.cheetah-select-item >> text={publish_date_day}').click()
-        await page.wait_for_timeout(2000)
+        day_option = page.locator(f'div.rc-virtual-list  div.cheetah-select-item >> text={publish_date_day}')
+        await wait_for_stable(day_option, name="baijiahao.day_option")
+        await day_option.click()
+        await wait_for_state(page.locator('div.rc-virtual-list:visible'), state="hidden", timeout=5000,
+                             name="baijiahao.day_dropdown_close")
 
         # 改为随机点击一个 hour
         for _ in range(3):
@@ -100,14 +112,14 @@ class BaiJiaHaoVideo(object):
                 break
             except:
                 await page.locator('div.select-wrap').nth(1).click()
-        await page.wait_for_timeout(2000)
-        current_choice_hour = await page.locator('div.rc-virtual-list:visible div.cheetah-select-item-option').count()
-        await page.wait_for_timeout(2000)
-        await page.locator('div.rc-virtual-list:visible div.cheetah-select-item-option').nth(
-            random.randint(1, current_choice_hour-3)).click()
+        hour_options = page.locator('div.rc-virtual-list:visible div.cheetah-select-item-option')
+        await wait_for_stable(hour_options.first, name="baijiahao.hour_options")
+        current_choice_hour = await hour_options.count()
+        await hour_options.nth(random.randint(1, current_choice_hour-3)).click()
         # 2024.08.05 current_choice_hour的获取可能有问题，页面有7，这里获取了10，暂时硬编码至6
 
-        await page.wait_for_timeout(2000)
+        await wait_for_state(page.locator('div.rc-virtual-list:visible'), state="hidden", timeout=5000,
+                             name="baijiahao.hour_dropdown_close")
         await page.locator("button >> text=定时发布").click()
 
 
@@ -116,93 +128,94 @@ class BaiJiaHaoVideo(object):
         return
         print("视频出错了，重新上传中")
 
-    async def upload(self, playwright: Playwright) -> None:
-        # 使用 Chromium 浏览器启动一个浏览器实例
-        browser = await playwright.chromium.launch(headless=False, executable_path=self.local_executable_path, proxy=self.proxy_setting)
-        # 创建一个浏览器上下文，使用指定的 cookie 文件
-        context = await browser.new_context(storage_state=f"{self.account_file}", user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.4324.150 Safari/537.36')
-        # context = await set_init_script(context)
-        await context.grant_permissions(['geolocation'])
-
-        # 创建一个新的页面
-        page = await context.new_page()
-        # 访问指定的 URL
-        await page.goto("https://baijiahao.baidu.com/builder/rc/edit?type=videoV2", timeout=60000)
-        baijiahao_logger.info(f"正在上传-------{self.title}.mp4")
-        # 等待页面跳转到指定的 URL，没进入，则自动等待到超时
-        baijiahao_logger.info('正在打开主页...')
-        await page.wait_for_url("https://baijiahao.baidu.com/builder/rc/edit?type=videoV2", timeout=60000)
-
-        # 点击 "上传视频" 按钮
-        await page.locator("div[class^='video-main-container'] input").set_input_files(self.file_path)
-
-        # 等待页面跳转到指定的 URL
-        while True:
-            # 判断是是否进入视频发布页面，没进入，则自动等待到超时
-            try:
-                await page.wait_for_selector("div#formMain:visible")
-                break
-            except:
-                baijiahao_logger.info("正在等待进入视频发布页面...")
-                await asyncio.sleep(0.1)
-
-        # 填充标题和话题
-        # 这里为了避免页面变化，故使用相对位置定位：作品标题父级右侧第一个元素的input子元素
-        await asyncio.sleep(1)
-        baijiahao_logger.info("正在填充标题和话题...")
-        await self.add_title_tags(page)
-
-        upload_status = await self.uploading_video(page)
-        if not upload_status:
-            baijiahao_logger.error(f"发现上传出错了... 文件:{self.file_path}")
-            raise
-
-        # 判断视频封面图是否生成成功
-        while True:
-            baijiahao_logger.info("正在确认封面完成, 准备去点击定时/发布...")
-            if await page.locator("div.cheetah-spin-container img").count():
+    async def upload(self) -> None:
+        # 从共享浏览器池中创建一个浏览器上下文，使用指定的 cookie 文件
+        context = await browser_pool.new_context(headless=False, executable_path=self.local_executable_path,
+                                                 proxy=self.proxy_setting, stealth=False,
+                                                 storage_state=f"{self.account_file}", user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/127.0.4324.150 Safari/537.36')
+        try:
+            await context.grant_permissions(['geolocation'])
+
+            # 创建一个新的页面
+            page = await context.new_page()
+            with span("open_upload_page"):
+                # 访问指定的 URL
+                await page.goto("https://baijiahao.baidu.com/builder/rc/edit?type=videoV2", timeout=60000)
+                baijiahao_logger.info(f"正在上传-------{self.title}.mp4")
+                # 等待页面跳转到指定的 URL，没进入，则自动等待到超时
+                baijiahao_logger.info('正在打开主页...')
+                try:
+                    await page.wait_for_url("https://baijiahao.baidu.com/builder/rc/edit?type=videoV2", timeout=60000)
+                except Exception:
+                    # 没能进入上传页面，多半是 cookie 已失效被重定向到了登录页
+                    cookie_cache.invalidate(self.account_file)
+                    raise
+
+            with span("select_video_file"):
+                # 点击 "上传视频" 按钮
+                await page.locator("div[class^='video-main-container'] input").set_input_files(self.file_path)
+
+                # 等待页面跳转到指定的 URL
+                while True:
+                    # 判断是是否进入视频发布页面，没进入，则自动等待到超时
+                    try:
+                        await page.wait_for_selector("div#formMain:visible")
+                        break
+                    except:
+                        baijiahao_logger.info("正在等待进入视频发布页面...")
+                        await asyncio.sleep(0.1)
+
+            # 填充标题和话题
+            # 这里为了避免页面变化，故使用相对位置定位：作品标题父级右侧第一个元素的input子元素
+            baijiahao_logger.info("正在填充标题和话题...")
+            await self.add_title_tags(page)
+
+            upload_status = await self.uploading_video(page)
+            if not upload_status:
+                baijiahao_logger.error(f"发现上传出错了... 文件:{self.file_path}")
+                raise
+
+            with span("wait_cover_generated"):
+                # 判断视频封面图是否生成成功
+                baijiahao_logger.info("正在确认封面完成, 准备去点击定时/发布...")
+                await wait_for_state(page.locator("div.cheetah-spin-container img").first, state="attached", timeout=300000,
+                                     name="baijiahao.cover_generated", raise_on_timeout=True)
                 baijiahao_logger.info("封面已完成，点击定时/发布...")
-                break
-            else:
-                baijiahao_logger.info("等待封面生成...")
-                await asyncio.sleep(3)
-
-        await self.publish_video(page, self.publish_date)
-        await page.wait_for_timeout(2000)
-        if await page.locator('div.passMod_dialog-container >> text=百度安全验证:visible').count():
-            baijiahao_logger.error("出现验证，退出")
-            raise Exception("出现验证，退出")
-        await page.wait_for_url("https://baijiahao.baidu.com/builder/rc/clue**", timeout=5000)
-        baijiahao_logger.success("视频发布成功")
-
-        await context.storage_state(path=self.account_file)  # 保存cookie
-        baijiahao_logger.info('cookie更新完毕！')
-        await asyncio.sleep(2)  # 这里延迟是为了方便眼睛直观的观看
-        # 关闭浏览器上下文和浏览器实例
-        await context.close()
-        await browser.close()
 
-
-    @async_retry(timeout=300)  # 例如，最多重试3次，超时时间为180秒
+            await self.publish_video(page, self.publish_date)
+            try:
+                await page.wait_for_url("https://baijiahao.baidu.com/builder/rc/clue**", timeout=7000)
+            except Exception:
+                if await page.locator('div.passMod_dialog-container >> text=百度安全验证:visible').count():
+                    baijiahao_logger.error("出现验证，退出")
+                    raise Exception("出现验证，退出")
+                raise
+            baijiahao_logger.success("视频发布成功")
+
+            with span("save_storage_state"):
+                await context.storage_state(path=self.account_file)  # 保存cookie
+                cookie_cache.mark_valid(self.account_file)
+            baijiahao_logger.info('cookie更新完毕！')
+        finally:
+            # 关闭浏览器上下文，浏览器实例留在池中复用
+            await context.close()
+
+
+    @traced()
     async def uploading_video(self, page):
-        while True:
-            upload_failed = await page.locator('div .cover-overlay:has-text("上传失败")').count()
-            if upload_failed:
+        # 封面上既没有 '上传中' 也没有 '上传失败' 代表视频上传完毕，最多等待 300 秒
+        uploading = js_has_text('div .cover-overlay', "上传中")
+        upload_failed = js_has_text('div .cover-overlay', "上传失败")
+        async with UploadCompletionDetector(page, success_js=f"!({uploading}) && !({upload_failed})",
+                                            failure_js=upload_failed, log=baijiahao_logger) as detector:
+            if await detector.wait(timeout=300) == UPLOAD_FAILURE:
                 baijiahao_logger.error("发现上传出错了...")
                 # await self.handle_upload_error(page)  # 假设这是处理上传错误的函数
                 return False
+        baijiahao_logger.success("视频上传完毕")
+        return True
 
-            uploading = await page.locator('div .cover-overlay:has-text("上传中")').count()
-            if uploading:
-                baijiahao_logger.info("正在上传视频中...")
-                await asyncio.sleep(2)  # 等待2秒再次检查
-                continue
-
-            # 检查上传是否成功
-            if not uploading and not upload_failed:
-                baijiahao_logger.success("视频上传完毕")
-                return True
-
+    @traced()
     async def set_schedule_publish(self, page, publish_date):
         while True:
             schedule_element = page.locator("div.op-btn-outter-content >> text=定时发布").locator("..").locator(
@@ -210,7 +223,7 @@ class BaiJiaHaoVideo(object):
             try:
                 await schedule_element.click()
                 await page.wait_for_selector('div.select-wrap:visible', timeout=3000)
-                await page.wait_for_timeout(timeout=2000)
+                await wait_for_stable(page.locator('div.select-wrap').nth(0), name="baijiahao.schedule_dialog")
                 baijiahao_logger.info("开始点击发布定时...")
                 await self.set_schedule_time(page, publish_date)
                 break
@@ -219,6 +232,7 @@ class BaiJiaHaoVideo(object):
                 raise  # 重新抛出异常，让重试装饰器捕获
 
     @async_retry(timeout=300)  # 例如，最多重试3次，超时时间为180秒
+    @traced()
     async def publish_video(self, page: Page, publish_date):
         if publish_date != 0:
             # 定时发布
@@ -227,6 +241,7 @@ class BaiJiaHaoVideo(object):
             # 立即发布
             await self.direct_publish(page)
 
+    @traced()
     async def direct_publish(self, page):
         try:
             publish_button = page.locator("button >> text=发布")
@@ -236,6 +251,7 @@ class BaiJiaHaoVideo(object):
             baijiahao_logger.error(f"直接发布视频失败: {e}")
             raise  # 重新抛出异常，让重试装饰器捕获
 
+    @traced()
     async def add_title_tags(self, page):
         title_container = page.get_by_placeholder('添加标题获得更多推荐')
         if len(self.title) <= 8:
@@ -243,6 +259,6 @@ class BaiJiaHaoVideo(object):
         await title_container.fill(self.title[:30])
 
     async def main(self):
-        async with async_playwright() as playwright:
-            await self.upload(playwright)
+        with trace_context(platform="baijiahao", account=Path(self.account_file).stem), span("upload"):
+            await self.upload()
 
@@ -0,0 +1,153 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+from conf import BILIBILI_LINE_CACHE_TTL, BILIBILI_LINE_DEGRADE_RATIO, DB_DIR
+from utils.log import bilibili_logger
+
+PREUPLOAD_URL = "https://member.bilibili.com/preupload"
+LINE_CACHE_FILE = Path(DB_DIR / "cache" / "bilibili_lines.json")
+
+# 与 biliup 中的 upos 线路一致，只有 upos 线路支持按分片续传
+UPOS_LINES = {
+    "bda2": {"os": "upos", "query": "upcdn=bda2&probe_version=20221109",
+             "probe_url": "//upos-sz-upcdnbda2.bilivideo.com/OK"},
+    "cs-bda2": {"os": "upos", "query": "upcdn=bda2&probe_version=20221109",
+                "probe_url": "//upos-cs-upcdnbda2.bilivideo.com/OK"},
+    "ws": {"os": "upos", "query": "upcdn=ws&probe_version=20221109",
+           "probe_url": "//upos-sz-upcdnws.bilivideo.com/OK"},
+    "qn": {"os": "upos", "query": "upcdn=qn&probe_version=20221109",
+           "probe_url": "//upos-sz-upcdnqn.bilivideo.com/OK"},
+    "cs-qn": {"os": "upos", "query": "upcdn=qn&probe_version=20221109",
+              "probe_url": "//upos-cs-upcdnqn.bilivideo.com/OK"},
+}
+DEFAULT_LINE = "bda2"
+
+# 滚动平均中新样本的权重
+EWMA_ALPHA = 0.3
+# 上传量太小时吞吐不准，不用来更新评分
+MIN_SAMPLE_BYTES = 8 * 1024 * 1024
+
+
+def absolute_url(url):
+    # 接口返回的地址是 //host/path 形式
+    return f"https:{url}" if url.startswith("//") else url
+
+
+def _ewma(old, new):
+    return new if old is None else old * (1 - EWMA_ALPHA) + new * EWMA_ALPHA
+
+
+class LineCache(object):
+    """
+    upos 线路选择结果缓存，批量上传和多次运行之间复用同一条线路
+
+    每条线路记录探测延迟和实际上传吞吐的滚动平均，以下情况才重新探测：
+    - 距离上次探测超过 ttl 秒
+    - 最近一次上传的吞吐低于该线路平均吞吐的 degrade_ratio 倍
+    """
+
+    def __init__(self, cache_file=LINE_CACHE_FILE, ttl=BILIBILI_LINE_CACHE_TTL,
+                 degrade_ratio=BILIBILI_LINE_DEGRADE_RATIO):
+        self.cache_file = Path(cache_file)
+        self.ttl = ttl
+        self.degrade_ratio = degrade_ratio
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"probed_at": 0, "degraded": False, "lines": {}}
+
+    def _save(self, data):
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.cache_file)
+
+    @staticmethod
+    def _best(data):
+        entries = [entry for entry in data["lines"].values() if entry.get("latency") is not None]
+        if not entries:
+            return None
+        measured = [entry for entry in entries if entry.get("throughput")]
+        if measured:
+            # 有实际上传数据的线路按吞吐排序，其余按探测延迟
+            return max(measured, key=lambda entry: entry["throughput"])
+        return min(entries, key=lambda entry: entry["latency"])
+
+    def select(self, session, preupload_url=PREUPLOAD_URL):
+        """返回当前最好的线路，缓存过期或吞吐下降时才重新探测"""
+        with self._lock:
+            data = self._load()
+            best = self._best(data)
+            if best is not None and not data["degraded"] and time.time() - data["probed_at"] < self.ttl:
+                return best["line"]
+        return self.probe(session, preupload_url)
+
+    def probe(self, session, preupload_url=PREUPLOAD_URL):
+        """请求探测接口并给每条 upos 线路计时，探测失败时使用默认线路"""
+        latencies = {}
+        try:
+            ret = session.get(f"{preupload_url}?r=probe", timeout=5).json()
+            method = "get" if ret["probe"].get("get") else "post"
+            payload = None if method == "get" else bytes(int(1024 * 0.1 * 1024))
+            for line in ret["lines"]:
+                if line.get("os") != "upos":
+                    continue
+                start = time.perf_counter()
+                try:
+                    response = session.request(method, absolute_url(line["probe_url"]), data=payload, timeout=10)
+                except requests.RequestException:
+                    continue
+                if response.status_code == 200:
+                    latencies[line["probe_url"]] = (line, time.perf_counter() - start)
+        except (requests.RequestException, ValueError, KeyError) as e:
+            bilibili_logger.warning(f"线路探测失败: {e}")
+        if not latencies:
+            return UPOS_LINES[DEFAULT_LINE]
+
+        with self._lock:
+            data = self._load()
+            for key, (line, latency) in latencies.items():
+                entry = data["lines"].setdefault(key, {"line": line, "latency": None, "throughput": None})
+                entry["line"] = line
+                entry["latency"] = _ewma(entry["latency"], latency)
+                # 重新探测说明之前的吞吐数据已经不可信，由之后的上传重新积累
+                entry["throughput"] = None
+            for key in set(data["lines"]) - set(latencies):
+                data["lines"].pop(key)
+            data["probed_at"] = time.time()
+            data["degraded"] = False
+            best = self._best(data)
+            self._save(data)
+        bilibili_logger.info(f"线路选择 => {best['line']['query']}. time: {best['latency']:.3f}")
+        return best["line"]
+
+    def record_upload(self, line, size, seconds):
+        """上传完成后更新线路的吞吐评分，吞吐明显下降时标记为需要重新探测"""
+        if size < MIN_SAMPLE_BYTES or seconds <= 0:
+            return
+        throughput = size / seconds
+        with self._lock:
+            data = self._load()
+            entry = data["lines"].get(line["probe_url"])
+            if entry is None:
+                return
+            if entry["throughput"] and throughput < entry["throughput"] * self.degrade_ratio:
+                bilibili_logger.warning(f"线路 {line['query']} 吞吐下降到 {throughput / 1e6:.2f}MB/s "
+                                        f"(平均 {entry['throughput'] / 1e6:.2f}MB/s)，下次上传重新探测")
+                data["degraded"] = True
+            else:
+                entry["throughput"] = _ewma(entry["throughput"], throughput)
+            self._save(data)
+
+
+line_cache = LineCache()
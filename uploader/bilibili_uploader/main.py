@@ -1,10 +1,18 @@
 import json
+import os
 import pathlib
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from biliup.plugins.bili_webup import BiliBili, Data
 
+from uploader.bilibili_uploader.line_cache import UPOS_LINES
+from uploader.bilibili_uploader.resumable import ResumableUposUpload, create_session, resolve_line
 from utils.log import bilibili_logger
 
+_cookie_data_cache = {}
+
 
 def extract_keys_from_json(data):
     """Extract specified keys from the provided JSON data."""
@@ -39,9 +47,130 @@ def random_emoji():
     return random.choice(emoji_list)
 
 
+def load_cookie_data(account_file):
+    """读取并提取登录 cookie，按文件修改时间缓存，批量上传时不再重复解析 JSON"""
+    stat = os.stat(account_file)
+    key = (os.path.abspath(str(account_file)), stat.st_mtime_ns)
+    if key not in _cookie_data_cache:
+        _cookie_data_cache.clear()
+        _cookie_data_cache[key] = extract_keys_from_json(read_cookie_json_file(account_file))
+    return dict(_cookie_data_cache[key])
+
+
+def build_data(title, desc, tid, tags, dtime, copyright=1):
+    data = Data()
+    data.copyright = copyright
+    data.title = title
+    data.desc = desc
+    data.tid = tid
+    data.set_tag(tags)
+    data.dtime = dtime
+    return data
+
+
+class BilibiliBatchUploader(object):
+    """
+    一个账号批量上传：只登录一次，整批复用同一个 BiliBili 会话和分片上传的连接池
+
+        with BilibiliBatchUploader(cookie_data, max_files=2) as batch:
+            batch.upload(file, title, desc, tid, tags, dtime)
+            batch.upload_many([(file, title, desc, tid, tags, dtime), ...])
+
+    多个文件可以同时上传分片，投稿（submit）始终串行。
+    """
+
+    def __init__(self, cookie_data, max_files=1, lines='AUTO', upload_thread_num=3, copyright=1):
+        self.cookie_data = cookie_data
+        self.max_files = max_files
+        self.lines = lines
+        self.upload_thread_num = upload_thread_num
+        self.copyright = copyright
+        self.bili = None
+        self.session = None
+        self._line = None
+        self._submit_lock = threading.Lock()
+        # 文件路径 -> 投稿接口返回的 data（aid、bvid）
+        self.submitted = {}
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def open(self):
+        if self.bili is not None:
+            return
+        self.bili = BiliBili(Data())
+        self.bili.login_by_cookies(self.cookie_data)
+        self.bili.access_token = self.cookie_data.get('access_token')
+        self.session = create_session(self.cookie_data)
+
+    def close(self):
+        if self.bili is not None:
+            self.bili.close()
+            self.bili = None
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    def _upload_file(self, file):
+        if self.lines == 'AUTO' or self.lines in UPOS_LINES:
+            if self._line is None:
+                # 整批只选一次线路
+                self._line = resolve_line(self.session, self.lines)
+            # upos 线路按分片上传并记录断点，中断后重新运行只上传缺失的分片
+            return ResumableUposUpload(self.session, file, self.cookie_data.get('DedeUserID'), line=self._line,
+                                       tasks=self.upload_thread_num).run()
+        with self._submit_lock:
+            # kodo / cos 线路仍由 biliup 一次性上传，和投稿共用 BiliBili 会话
+            return self.bili.upload_file(str(file), lines=self.lines, tasks=self.upload_thread_num)
+
+    def upload(self, file: pathlib.Path, title, desc, tid, tags, dtime) -> bool:
+        self.open()
+        file = pathlib.Path(file)
+        data = build_data(title, desc, tid, tags, dtime, self.copyright)
+        video_part = self._upload_file(file)
+        video_part['title'] = title
+        data.append(video_part)
+        with self._submit_lock:
+            self.bili.video = data
+            ret = self.bili.submit()  # 提交视频
+        if ret.get('code') == 0:
+            bilibili_logger.success(f'[+] {file.name}上传 成功')
+            self.submitted[str(file)] = ret.get('data') or {}
+            return True
+        else:
+            bilibili_logger.error(f'[-] {file.name}上传 失败, error messge: {ret.get("message")}')
+            return False
+
+    def upload_many(self, videos) -> list:
+        """
+        Args:
+            videos: (file, title, desc, tid, tags, dtime) 列表，最多同时上传 max_files 个
+
+        Returns:
+            与 videos 顺序对应的结果，上传出错的为异常对象
+        """
+        self.open()
+
+        def upload_one(video):
+            try:
+                return self.upload(*video)
+            except Exception as e:
+                bilibili_logger.error(f'[-] {video[0]}上传 失败: {e}')
+                return e
+
+        with ThreadPoolExecutor(self.max_files) as executor:
+            return list(executor.map(upload_one, videos))
+
+
 class BilibiliUploader(object):
+    """单个视频上传，批量上传请使用 BilibiliBatchUploader"""
+
     def __init__(self, cookie_data, file: pathlib.Path, title, desc, tid, tags, dtime):
-        self.upload_thread_num = 3
+        self.upload_thread_num = 3  # 初始分片并发数，upos 线路上传时会按吞吐自动调整
         self.copyright = 1
         self.lines = 'AUTO'
         self.cookie_data = cookie_data
@@ -51,29 +180,8 @@ class BilibiliUploader(object):
         self.tid = tid
         self.tags = tags
         self.dtime = dtime
-        self._init_data()
-
-    def _init_data(self):
-        self.data = Data()
-        self.data.copyright = self.copyright
-        self.data.title = self.title
-        self.data.desc = self.desc
-        self.data.tid = self.tid
-        self.data.set_tag(self.tags)
-        self.data.dtime = self.dtime
 
     def upload(self):
-        with BiliBili(self.data) as bili:
-            bili.login_by_cookies(self.cookie_data)
-            bili.access_token = self.cookie_data.get('access_token')
-            video_part = bili.upload_file(str(self.file), lines=self.lines,
-                                          tasks=self.upload_thread_num)  # 上传视频，默认线路AUTO自动选择，线程数量3。
-            video_part['title'] = self.title
-            self.data.append(video_part)
-            ret = bili.submit()  # 提交视频
-            if ret.get('code') == 0:
-                bilibili_logger.success(f'[+] {self.file.name}上传 成功')
-                return True
-            else:
-                bilibili_logger.error(f'[-] {self.file.name}上传 失败, error messge: {ret.get("message")}')
-                return False
+        with BilibiliBatchUploader(self.cookie_data, lines=self.lines, upload_thread_num=self.upload_thread_num,
+                                   copyright=self.copyright) as batch:
+            return batch.upload(self.file, self.title, self.desc, self.tid, self.tags, self.dtime)
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+import requests
+
+from conf import (BILIBILI_CHECKPOINT_TTL, BILIBILI_MAX_UPLOAD_WORKERS, BILIBILI_MIN_UPLOAD_WORKERS, DB_DIR,
+                  UPLOAD_BANDWIDTH_LIMIT)
+from uploader.bilibili_uploader.line_cache import DEFAULT_LINE, PREUPLOAD_URL, UPOS_LINES, absolute_url, line_cache
+from utils.log import bilibili_logger
+from utils.rate_limit import AIMDController, TokenBucket
+from utils.tracing import span
+
+CHECKPOINT_DIR = Path(DB_DIR / "cache" / "bilibili_upload")
+
+# 计算指纹时读取的文件头尾大小
+FINGERPRINT_SAMPLE = 1024 * 1024
+
+
+def create_session(cookie_data) -> requests.Session:
+    session = requests.Session()
+    session.headers.update({
+        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/63.0.3239.108",
+        "Referer": "https://www.bilibili.com/", "Connection": "keep-alive"
+    })
+    # 每个分片线程都要占一个连接
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=BILIBILI_MAX_UPLOAD_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    requests.utils.add_dict_to_cookiejar(session.cookies, {k: v for k, v in cookie_data.items() if k != "access_token"})
+    return session
+
+
+def resolve_line(session, lines="AUTO", preupload_url=PREUPLOAD_URL):
+    if lines in UPOS_LINES:
+        return UPOS_LINES[lines]
+    return line_cache.select(session, preupload_url)
+
+
+def get_bandwidth_bucket():
+    """本机所有上传共享的带宽令牌桶，未配置 UPLOAD_BANDWIDTH_LIMIT 时返回 None"""
+    if not UPLOAD_BANDWIDTH_LIMIT:
+        return None
+    return TokenBucket("upload_bandwidth", UPLOAD_BANDWIDTH_LIMIT)
+
+
+def file_fingerprint(filepath) -> dict:
+    """大小 + 修改时间 + 头尾各 1MB 的哈希，文件被替换或修改后旧的断点不会被误用"""
+    stat = os.stat(filepath)
+    digest = hashlib.sha1()
+    with open(filepath, "rb") as f:
+        digest.update(f.read(FINGERPRINT_SAMPLE))
+        if stat.st_size > FINGERPRINT_SAMPLE:
+            f.seek(max(FINGERPRINT_SAMPLE, stat.st_size - FINGERPRINT_SAMPLE))
+            digest.update(f.read(FINGERPRINT_SAMPLE))
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha1": digest.hexdigest()}
+
+
+class UploadCheckpoint(object):
+    """
+    一个 (账号, 文件) 的上传进度：上传会话（upload_id 等）、文件指纹和已完成的分片序号
+
+    保存为 JSON，每完成一个分片原子地重写一次，进程被杀掉后重新运行只上传缺失的分片
+    """
+
+    def __init__(self, account, filepath, checkpoint_dir=CHECKPOINT_DIR, ttl=BILIBILI_CHECKPOINT_TTL):
+        self.filepath = os.path.abspath(str(filepath))
+        key = hashlib.sha1(f"{account}:{self.filepath}".encode("utf-8")).hexdigest()
+        self.path = Path(checkpoint_dir) / f"{key}.json"
+        self.ttl = ttl
+        self.fingerprint = None
+        self.session = None
+        self.completed = set()
+        self._lock = threading.Lock()
+
+    def load(self, fingerprint) -> bool:
+        """读取断点，指纹不一致或会话过期的断点直接丢弃"""
+        self.fingerprint = fingerprint
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get("fingerprint") != fingerprint or time.time() - data["session"]["created_at"] > self.ttl:
+            self.clear()
+            return False
+        self.session = data["session"]
+        self.completed = set(data["completed"])
+        return True
+
+    def start(self, session):
+        self.session = dict(session, created_at=time.time())
+        self.completed = set()
+        self._save()
+
+    def mark_done(self, index):
+        with self._lock:
+            self.completed.add(index)
+            self._save()
+
+    def _save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({"file": self.filepath, "fingerprint": self.fingerprint, "session": self.session,
+                       "completed": sorted(self.completed)}, f)
+        os.replace(tmp_file, self.path)
+
+    def clear(self):
+        self.session = None
+        self.completed = set()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class SessionExpiredError(Exception):
+    """upos 拒绝了断点中的 upload_id，需要重新申请上传会话"""
+
+
+class ResumableUposUpload(object):
+    """
+    按分片上传到 upos，支持断点续传，替代 biliup 的 upload_file
+
+        part = ResumableUposUpload(session, file, account=cookie_data["DedeUserID"], line=line).run()
+        data.append(part)
+
+    Returns（run）:
+        与 biliup upload_file 相同的 {"title", "filename", "desc"}，可以直接 append 到 Data
+    """
+
+    def __init__(self, session, filepath, account, line=None, tasks=3, preupload_url=PREUPLOAD_URL,
+                 checkpoint_dir=CHECKPOINT_DIR, chunk_retries=10, bandwidth=None):
+        self.session = session
+        self.filepath = Path(filepath)
+        self.account = account
+        self.line = line or UPOS_LINES[DEFAULT_LINE]
+        # tasks 是初始并发数，上传过程中按吞吐在 [MIN, MAX] 之间调整
+        self.controller = AIMDController(min(BILIBILI_MIN_UPLOAD_WORKERS, tasks), BILIBILI_MAX_UPLOAD_WORKERS, tasks)
+        self.bandwidth = bandwidth if bandwidth is not None else get_bandwidth_bucket()
+        self.preupload_url = preupload_url
+        self.chunk_retries = chunk_retries
+        self.checkpoint = UploadCheckpoint(account, filepath, checkpoint_dir)
+        self.total_size = 0
+        self.uploaded_chunks = 0
+        self.uploaded_bytes = 0
+
+    def _url(self, upos=None):
+        upos = upos or self.checkpoint.session
+        return f"{absolute_url(upos['endpoint'])}/{upos['upos_uri'].replace('upos://', '')}"
+
+    def _headers(self, upos=None):
+        return {"X-Upos-Auth": (upos or self.checkpoint.session)["auth"]}
+
+    def _preupload(self):
+        query = {
+            "r": "upos",
+            "profile": "ugcupos/bup",
+            "ssl": 0,
+            "version": "2.8.12",
+            "build": 2081200,
+            "name": self.filepath.name,
+            "size": self.total_size,
+        }
+        ret = self.session.get(f"{self.preupload_url}?{self.line['query']}", params=query, timeout=5).json()
+        upos = {k: ret[k] for k in ("chunk_size", "auth", "endpoint", "biz_id", "upos_uri")}
+        # 向上传地址申请上传，得到 upload_id 后才写断点
+        ret = self.session.post(f"{self._url(upos)}?uploads&output=json", headers=self._headers(upos),
+                                timeout=15).json()
+        self.checkpoint.start(dict(upos, upload_id=ret["upload_id"]))
+
+    def _upload_chunk(self, index, chunks):
+        chunk_size = self.checkpoint.session["chunk_size"]
+        start = index * chunk_size
+        with open(self.filepath, "rb") as f:
+            f.seek(start)
+            data = f.read(chunk_size)
+        params = {
+            "uploadId": self.checkpoint.session["upload_id"],
+            "chunks": chunks,
+            "total": self.total_size,
+            "chunk": index,
+            "size": len(data),
+            "partNumber": index + 1,
+            "start": start,
+            "end": start + len(data),
+        }
+        if self.bandwidth is not None:
+            self.bandwidth.consume(len(data))
+        for attempt in range(self.chunk_retries):
+            try:
+                response = self.session.put(self._url(), params=params, data=data, headers=self._headers(), timeout=60)
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    raise SessionExpiredError(f"chunk {index}: {response.status_code} {response.text[:200]}")
+                response.raise_for_status()
+                break
+            except requests.RequestException as e:
+                if attempt == self.chunk_retries - 1:
+                    raise
+                bilibili_logger.warning(f"retry chunk{index} >> {attempt + 1}. {e}")
+                self.controller.on_error()
+                time.sleep(min(2 ** attempt, 30))
+        self.checkpoint.mark_done(index)
+        self.uploaded_chunks += 1
+        self.uploaded_bytes += len(data)
+        self.controller.on_success(len(data))
+
+    def _upload_missing(self):
+        chunks = math.ceil(self.total_size / self.checkpoint.session["chunk_size"])
+        missing = [index for index in range(chunks) if index not in self.checkpoint.completed]
+        if self.checkpoint.completed:
+            bilibili_logger.info(f"{self.filepath.name} 断点续传: 已完成 {chunks - len(missing)}/{chunks} 个分片")
+        pending = list(reversed(missing))
+        running = set()
+        uploaded_bytes, started = self.uploaded_bytes, time.perf_counter()
+        self.controller.on_start()
+        with span("upload_chunks", chunks=chunks, missing=len(missing)) as chunks_span, \
+                ThreadPoolExecutor(self.controller.max_limit) as executor:
+            try:
+                while pending or running:
+                    # 每完成一个分片按控制器当前的并发数补充任务
+                    while pending and len(running) < self.controller.limit:
+                        running.add(executor.submit(self._upload_chunk, pending.pop(), chunks))
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+            finally:
+                # 出错时不再派发新分片，等已经在传的分片结束并写入断点
+                pending.clear()
+            chunks_span.attrs["final_workers"] = self.controller.limit
+        line_cache.record_upload(self.line, self.uploaded_bytes - uploaded_bytes, time.perf_counter() - started)
+        bilibili_logger.info(f"{self.filepath.name} 分片并发数: {self.controller.limit}")
+        return chunks
+
+    def _complete(self, chunks):
+        upos = self.checkpoint.session
+        params = {
+            "name": self.filepath.name,
+            "uploadId": upos["upload_id"],
+            "biz_id": upos["biz_id"],
+            "output": "json",
+            "profile": "ugcupos/bup",
+        }
+        parts = [{"partNumber": index + 1, "eTag": "etag"} for index in range(chunks)]
+        for attempt in range(6):
+            try:
+                ret = self.session.post(self._url(), params=params, json={"parts": parts}, headers=self._headers(),
+                                        timeout=15).json()
+                if ret.get("OK") == 1:
+                    return
+                raise IOError(ret)
+            except (IOError, ValueError) as e:
+                # 分片已经保存在断点里，这里失败下次运行会直接重新合并
+                bilibili_logger.info(f"请求合并分片时出现问题，尝试重连，次数：{attempt + 1}. {e}")
+                time.sleep(15)
+        raise IOError(f"{self.filepath.name} 合并分片失败")
+
+    def run(self) -> dict:
+        fingerprint = file_fingerprint(self.filepath)
+        self.total_size = fingerprint["size"]
+        started = time.perf_counter()
+        resumed = self.checkpoint.load(fingerprint)
+        if not resumed:
+            with span("preupload"):
+                self._preupload()
+        try:
+            chunks = self._upload_missing()
+        except SessionExpiredError as e:
+            if not resumed or self.uploaded_chunks:
+                raise
+            # 断点里的会话已经失效，重新申请后从头上传
+            bilibili_logger.warning(f"{self.filepath.name} 断点会话失效，重新上传: {e}")
+            self.checkpoint.clear()
+            self.checkpoint.fingerprint = fingerprint
+            with span("preupload"):
+                self._preupload()
+            chunks = self._upload_missing()
+        self._complete(chunks)
+        upos_uri = self.checkpoint.session["upos_uri"]
+        self.checkpoint.clear()
+        cost = time.perf_counter() - started
+        bilibili_logger.info(f"{self.filepath.name} uploaded >> {self.total_size / 1000 / 1000 / cost:.2f}MB/s, "
+                             f"本次上传 {self.uploaded_chunks}/{chunks} 个分片")
+        return {"title": self.filepath.stem, "filename": Path(upos_uri.replace("upos://", "")).stem, "desc": ""}
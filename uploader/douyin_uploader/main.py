@@ -1,20 +1,24 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
+from pathlib import Path
 
-from playwright.async_api import Playwright, async_playwright, Page
+from playwright.async_api import async_playwright, Page
 import os
 import asyncio
 
-from conf import LOCAL_CHROME_PATH
-from utils.base_social_media import set_init_script
+from utils.base_social_media import set_init_script, get_local_executable_path
+from utils.browser_pool import browser_pool
+from utils.cookie_cache import cookie_cache
+from utils.covers import cover_pipeline
 from utils.log import douyin_logger
+from utils.tracing import span, trace_context, traced
+from utils.upload_detector import UploadCompletionDetector, UPLOAD_FAILURE, js_has_text
+from utils.waits import NetworkIdle, wait_for_stable, wait_for_state
 
 
 async def cookie_auth(account_file):
-    async with async_playwright() as playwright:
-        browser = await playwright.chromium.launch(headless=True)
-        context = await browser.new_context(storage_state=account_file)
-        context = await set_init_script(context)
+    context = await browser_pool.new_context(headless=True, storage_state=account_file)
+    try:
         # 创建一个新的页面
         page = await context.new_page()
         # 访问指定的 URL
@@ -23,8 +27,6 @@ async def cookie_auth(account_file):
             await page.wait_for_url("https://creator.douyin.com/creator-micro/content/upload", timeout=5000)
         except:
             print("[+] 等待5秒 cookie 失效")
-            await context.close()
-            await browser.close()
             return False
         # 2024.06.17 抖音创作者中心改版
         if await page.get_by_text('手机号登录').count():
@@ -33,10 +35,12 @@ async def cookie_auth(account_file):
         else:
             print("[+] cookie 有效")
             return True
+    finally:
+        await context.close()
 
 
 async def douyin_setup(account_file, handle=False):
-    if not os.path.exists(account_file) or not await cookie_auth(account_file):
+    if not os.path.exists(account_file) or not await cookie_cache.check(account_file, cookie_auth, ("sessionid",)):
         if not handle:
             # Todo alert message
             return False
@@ -71,179 +75,179 @@ class DouYinVideo(object):
         self.publish_date = publish_date
         self.account_file = account_file
         self.date_format = '%Y年%m月%d日 %H:%M'
-        self.local_executable_path = LOCAL_CHROME_PATH
+        self.local_executable_path = get_local_executable_path()
         self.thumbnail_path = thumbnail_path
 
+    @traced()
     async def set_schedule_time_douyin(self, page, publish_date):
         # 选择包含特定文本内容的 label 元素
         label_element = page.locator("[class^='radio']:has-text('定时发布')")
         # 在选中的 label 元素下点击 checkbox
         await label_element.click()
-        await asyncio.sleep(1)
         publish_date_hour = publish_date.strftime("%Y-%m-%d %H:%M")
 
-        await asyncio.sleep(1)
-        await page.locator('.semi-input[placeholder="日期和时间"]').click()
+        # 等待日期输入框展开完成再输入
+        date_input = page.locator('.semi-input[placeholder="日期和时间"]')
+        await wait_for_stable(date_input, name="douyin.schedule_input")
+        await date_input.click()
         await page.keyboard.press("Control+KeyA")
         await page.keyboard.type(str(publish_date_hour))
         await page.keyboard.press("Enter")
 
-        await asyncio.sleep(1)
-
+    @traced()
     async def handle_upload_error(self, page):
         douyin_logger.info('视频出错了，重新上传中')
         await page.locator('div.progress-div [class^="upload-btn-input"]').set_input_files(self.file_path)
 
-    async def upload(self, playwright: Playwright) -> None:
-        # 使用 Chromium 浏览器启动一个浏览器实例
-        if self.local_executable_path:
-            browser = await playwright.chromium.launch(headless=False, executable_path=self.local_executable_path)
-        else:
-            browser = await playwright.chromium.launch(headless=False)
-        # 创建一个浏览器上下文，使用指定的 cookie 文件
-        context = await browser.new_context(storage_state=f"{self.account_file}")
-        context = await set_init_script(context)
-
-        # 创建一个新的页面
-        page = await context.new_page()
-        # 访问指定的 URL
-        await page.goto("https://creator.douyin.com/creator-micro/content/upload")
-        douyin_logger.info(f'[+]正在上传-------{self.title}.mp4')
-        # 等待页面跳转到指定的 URL，没进入，则自动等待到超时
-        douyin_logger.info(f'[-] 正在打开主页...')
-        await page.wait_for_url("https://creator.douyin.com/creator-micro/content/upload")
-        # 点击 "上传视频" 按钮
-        await page.locator("div[class^='container'] input").set_input_files(self.file_path)
-
-        # 等待页面跳转到指定的 URL 2025.01.08修改在原有基础上兼容两种页面
-        while True:
-            try:
-                # 尝试等待第一个 URL
-                await page.wait_for_url(
-                    "https://creator.douyin.com/creator-micro/content/publish?enter_from=publish_page", timeout=3)
-                douyin_logger.info("[+] 成功进入version_1发布页面!")
-                break  # 成功进入页面后跳出循环
-            except Exception:
+    async def upload(self) -> None:
+        # 封面在进程池中按抖音的尺寸生成，和视频上传同时进行
+        cover_future = cover_pipeline.prepare(self.file_path, "douyin", self.thumbnail_path)
+        # 从共享浏览器池中创建一个浏览器上下文，使用指定的 cookie 文件
+        context = await browser_pool.new_context(headless=False, executable_path=self.local_executable_path,
+                                                 storage_state=f"{self.account_file}")
+        try:
+            # 创建一个新的页面
+            page = await context.new_page()
+            with span("open_upload_page"):
+                # 访问指定的 URL
+                await page.goto("https://creator.douyin.com/creator-micro/content/upload")
+                douyin_logger.info(f'[+]正在上传-------{self.title}.mp4')
+                # 等待页面跳转到指定的 URL，没进入，则自动等待到超时
+                douyin_logger.info(f'[-] 正在打开主页...')
                 try:
-                    # 如果第一个 URL 超时，再尝试等待第二个 URL
-                    await page.wait_for_url(
-                        "https://creator.douyin.com/creator-micro/content/post/video?enter_from=publish_page",
-                        timeout=3)
-                    douyin_logger.info("[+] 成功进入version_2发布页面!")
-
-                    break  # 成功进入页面后跳出循环
-                except:
-                    print("  [-] 超时未进入视频发布页面，重新尝试...")
-                    await asyncio.sleep(0.5)  # 等待 0.5 秒后重新尝试
-        # 填充标题和话题
-        # 检查是否存在包含输入框的元素
-        # 这里为了避免页面变化，故使用相对位置定位：作品标题父级右侧第一个元素的input子元素
-        await asyncio.sleep(1)
-        douyin_logger.info(f'  [-] 正在填充标题和话题...')
-        title_container = page.get_by_text('作品标题').locator("..").locator("xpath=following-sibling::div[1]").locator("input")
-        if await title_container.count():
-            await title_container.fill(self.title[:30])
-        else:
-            titlecontainer = page.locator(".notranslate")
-            await titlecontainer.click()
-            await page.keyboard.press("Backspace")
-            await page.keyboard.press("Control+KeyA")
-            await page.keyboard.press("Delete")
-            await page.keyboard.type(self.title)
-            await page.keyboard.press("Enter")
-        css_selector = ".zone-container"
-        for index, tag in enumerate(self.tags, start=1):
-            await page.type(css_selector, "#" + tag)
-            await page.press(css_selector, "Space")
-        douyin_logger.info(f'总共添加{len(self.tags)}个话题')
-
-        while True:
-            # 判断重新上传按钮是否存在，如果不存在，代表视频正在上传，则等待
-            try:
-                #  新版：定位重新上传
-                number = await page.locator('[class^="long-card"] div:has-text("重新上传")').count()
-                if number > 0:
-                    douyin_logger.success("  [-]视频上传完毕")
-                    break
+                    await page.wait_for_url("https://creator.douyin.com/creator-micro/content/upload")
+                except Exception:
+                    # 没能进入上传页面，多半是 cookie 已失效被重定向到了登录页
+                    cookie_cache.invalidate(self.account_file)
+                    raise
+            with span("select_video_file"):
+                # 点击 "上传视频" 按钮
+                await page.locator("div[class^='container'] input").set_input_files(self.file_path)
+
+                # 等待页面跳转到指定的 URL 2025.01.08修改在原有基础上兼容两种页面
+                publish_pages = {
+                    "https://creator.douyin.com/creator-micro/content/publish?enter_from=publish_page": "version_1",
+                    "https://creator.douyin.com/creator-micro/content/post/video?enter_from=publish_page": "version_2",
+                }
+                # 同时等待两种发布页面，跳转后立即继续
+                while True:
+                    try:
+                        await page.wait_for_url(lambda url: url in publish_pages, timeout=30000)
+                        douyin_logger.info(f"[+] 成功进入{publish_pages[page.url]}发布页面!")
+                        break  # 成功进入页面后跳出循环
+                    except Exception:
+                        print("  [-] 超时未进入视频发布页面，重新尝试...")
+            with span("add_title_tags"):
+                # 填充标题和话题
+                # 检查是否存在包含输入框的元素
+                # 这里为了避免页面变化，故使用相对位置定位：作品标题父级右侧第一个元素的input子元素
+                await wait_for_state(page.locator(".zone-container"), name="douyin.publish_form")
+                douyin_logger.info(f'  [-] 正在填充标题和话题...')
+                title_container = page.get_by_text('作品标题').locator("..").locator("xpath=following-sibling::div[1]").locator("input")
+                if await title_container.count():
+                    await title_container.fill(self.title[:30])
                 else:
-                    douyin_logger.info("  [-] 正在上传视频中...")
-                    await asyncio.sleep(2)
-
-                    if await page.locator('div.progress-div > div:has-text("上传失败")').count():
+                    titlecontainer = page.locator(".notranslate")
+                    await titlecontainer.click()
+                    await page.keyboard.press("Backspace")
+                    await page.keyboard.press("Control+KeyA")
+                    await page.keyboard.press("Delete")
+                    await page.keyboard.type(self.title)
+                    await page.keyboard.press("Enter")
+                css_selector = ".zone-container"
+                for index, tag in enumerate(self.tags, start=1):
+                    await page.type(css_selector, "#" + tag)
+                    await page.press(css_selector, "Space")
+                douyin_logger.info(f'总共添加{len(self.tags)}个话题')
+
+            with span("detect_upload_status"):
+                # 出现重新上传按钮代表视频上传完毕，出现上传失败则重新上传
+                async with UploadCompletionDetector(
+                        page,
+                        success_js=js_has_text('[class^="long-card"] div', "重新上传"),
+                        failure_js=js_has_text('div.progress-div > div', "上传失败"),
+                        log=douyin_logger) as detector:
+                    while await detector.wait() == UPLOAD_FAILURE:
                         douyin_logger.error("  [-] 发现上传出错了... 准备重试")
                         await self.handle_upload_error(page)
-            except:
-                douyin_logger.info("  [-] 正在上传视频中...")
-                await asyncio.sleep(2)
-        
-        #上传视频封面
-        await self.set_thumbnail(page, self.thumbnail_path)
-
-        # 更换可见元素
-        await self.set_location(page, "杭州市")
-
-        # 頭條/西瓜
-        third_part_element = '[class^="info"] > [class^="first-part"] div div.semi-switch'
-        # 定位是否有第三方平台
-        if await page.locator(third_part_element).count():
-            # 检测是否是已选中状态
-            if 'semi-switch-checked' not in await page.eval_on_selector(third_part_element, 'div => div.className'):
-                await page.locator(third_part_element).locator('input.semi-switch-native-control').click()
-
-        if self.publish_date != 0:
-            await self.set_schedule_time_douyin(page, self.publish_date)
-
-        # 判断视频是否发布成功
-        while True:
-            # 判断视频是否发布成功
-            try:
-                publish_button = page.get_by_role('button', name="发布", exact=True)
-                if await publish_button.count():
-                    await publish_button.click()
-                await page.wait_for_url("https://creator.douyin.com/creator-micro/content/manage**",
-                                        timeout=3000)  # 如果自动跳转到作品页面，则代表发布成功
-                douyin_logger.success("  [-]视频发布成功")
-                break
-            except:
-                douyin_logger.info("  [-] 视频正在发布中...")
-                await page.screenshot(full_page=True)
-                await asyncio.sleep(0.5)
-
-        await context.storage_state(path=self.account_file)  # 保存cookie
-        douyin_logger.success('  [-]cookie更新完毕！')
-        await asyncio.sleep(2)  # 这里延迟是为了方便眼睛直观的观看
-        # 关闭浏览器上下文和浏览器实例
-        await context.close()
-        await browser.close()
+                douyin_logger.success("  [-]视频上传完毕")
+
+            #上传视频封面
+            await self.set_thumbnail(page, await asyncio.wrap_future(cover_future))
+
+            # 更换可见元素
+            await self.set_location(page, "杭州市")
+
+            # 頭條/西瓜
+            third_part_element = '[class^="info"] > [class^="first-part"] div div.semi-switch'
+            # 定位是否有第三方平台
+            if await page.locator(third_part_element).count():
+                # 检测是否是已选中状态
+                if 'semi-switch-checked' not in await page.eval_on_selector(third_part_element, 'div => div.className'):
+                    await page.locator(third_part_element).locator('input.semi-switch-native-control').click()
+
+            if self.publish_date != 0:
+                await self.set_schedule_time_douyin(page, self.publish_date)
+
+            with span("click_publish"):
+                # 判断视频是否发布成功
+                while True:
+                    # 判断视频是否发布成功
+                    try:
+                        publish_button = page.get_by_role('button', name="发布", exact=True)
+                        if await publish_button.count():
+                            await publish_button.click()
+                        await page.wait_for_url("https://creator.douyin.com/creator-micro/content/manage**",
+                                                timeout=3000)  # 如果自动跳转到作品页面，则代表发布成功
+                        douyin_logger.success("  [-]视频发布成功")
+                        break
+                    except:
+                        douyin_logger.info("  [-] 视频正在发布中...")
+                        await page.screenshot(full_page=True)
+                        await asyncio.sleep(0.5)
+
+            with span("save_storage_state"):
+                await context.storage_state(path=self.account_file)  # 保存cookie
+                cookie_cache.mark_valid(self.account_file)
+            douyin_logger.success('  [-]cookie更新完毕！')
+        finally:
+            # 关闭浏览器上下文，浏览器实例留在池中复用
+            await context.close()
     
+    @traced()
     async def set_thumbnail(self, page: Page, thumbnail_path: str):
         if thumbnail_path:
             await page.click('text="选择封面"')
             await page.wait_for_selector("div.semi-modal-content:visible")
             await page.click('text="设置竖封面"')
-            await page.wait_for_timeout(2000)  # 等待2秒
             # 定位到上传区域并点击
-            await page.locator("div[class^='semi-upload upload'] >> input.semi-upload-hidden-input").set_input_files(thumbnail_path)
-            await page.wait_for_timeout(2000)  # 等待2秒
-            await page.locator("div[class^='extractFooter'] button:visible:has-text('完成')").click()
+            upload_input = page.locator("div[class^='semi-upload upload'] >> input.semi-upload-hidden-input")
+            await wait_for_state(upload_input, state="attached", name="douyin.thumbnail_input")
+            async with NetworkIdle(page, r"upload|imagex", name="douyin.thumbnail_upload"):
+                await upload_input.set_input_files(thumbnail_path)
+            finish_button = page.locator("div[class^='extractFooter'] button:visible:has-text('完成')")
+            await wait_for_stable(finish_button, name="douyin.thumbnail_finish")
+            await finish_button.click()
             # finish_confirm_element = page.locator("div[class^='confirmBtn'] >> div:has-text('完成')")
             # if await finish_confirm_element.count():
             #     await finish_confirm_element.click()
             # await page.locator("div[class^='footer'] button:has-text('完成')").click()
 
+    @traced()
     async def set_location(self, page: Page, location: str = "杭州市"):
         # todo supoort location later
         # await page.get_by_text('添加标签').locator("..").locator("..").locator("xpath=following-sibling::div").locator(
         #     "div.semi-select-single").nth(0).click()
         await page.locator('div.semi-select span:has-text("输入地理位置")').click()
         await page.keyboard.press("Backspace")
-        await page.wait_for_timeout(2000)
-        await page.keyboard.type(location)
+        # 等待地理位置搜索请求返回，而不是固定等待
+        async with NetworkIdle(page, r"poi|location", name="douyin.location_search"):
+            await page.keyboard.type(location)
         await page.wait_for_selector('div[role="listbox"] [role="option"]', timeout=5000)
         await page.locator('div[role="listbox"] [role="option"]').first.click()
 
     async def main(self):
-        async with async_playwright() as playwright:
-            await self.upload(playwright)
+        with trace_context(platform="douyin", account=Path(self.account_file).stem), span("upload"):
+            await self.upload()
 
 
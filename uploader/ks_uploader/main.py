@@ -1,21 +1,24 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
+from pathlib import Path
 
-from playwright.async_api import Playwright, async_playwright
+from playwright.async_api import async_playwright
 import os
 import asyncio
 
-from conf import LOCAL_CHROME_PATH
-from utils.base_social_media import set_init_script
+from utils.base_social_media import set_init_script, get_local_executable_path
+from utils.browser_pool import browser_pool
+from utils.cookie_cache import cookie_cache
 from utils.files_times import get_absolute_path
 from utils.log import kuaishou_logger
+from utils.tracing import span, trace_context, traced
+from utils.upload_detector import UploadCompletionDetector
+from utils.waits import NetworkIdle, wait_for_stable, wait_for_state
 
 
 async def cookie_auth(account_file):
-    async with async_playwright() as playwright:
-        browser = await playwright.chromium.launch(headless=True)
-        context = await browser.new_context(storage_state=account_file)
-        context = await set_init_script(context)
+    context = await browser_pool.new_context(headless=True, storage_state=account_file)
+    try:
         # 创建一个新的页面
         page = await context.new_page()
         # 访问指定的 URL
@@ -28,11 +31,13 @@ async def cookie_auth(account_file):
         except:
             kuaishou_logger.success("[+] cookie 有效")
             return True
+    finally:
+        await context.close()
 
 
 async def ks_setup(account_file, handle=False):
     account_file = get_absolute_path(account_file, "ks_uploader")
-    if not os.path.exists(account_file) or not await cookie_auth(account_file):
+    if not os.path.exists(account_file) or not await cookie_cache.check(account_file, cookie_auth):
         if not handle:
             return False
         kuaishou_logger.info('[+] cookie文件不存在或已失效，即将自动打开浏览器，请扫码登录，登陆后会自动生成cookie文件')
@@ -69,146 +74,138 @@ class KSVideo(object):
         self.publish_date = publish_date
         self.account_file = account_file
         self.date_format = '%Y-%m-%d %H:%M'
-        self.local_executable_path = LOCAL_CHROME_PATH
+        self.local_executable_path = get_local_executable_path()
 
+    @traced()
     async def handle_upload_error(self, page):
         kuaishou_logger.error("视频出错了，重新上传中")
         await page.locator('div.progress-div [class^="upload-btn-input"]').set_input_files(self.file_path)
 
-    async def upload(self, playwright: Playwright) -> None:
-        # 使用 Chromium 浏览器启动一个浏览器实例
-        print(self.local_executable_path)
-        if self.local_executable_path:
-            browser = await playwright.chromium.launch(
-                headless=False,
-                executable_path=self.local_executable_path,
-            )
-        else:
-            browser = await playwright.chromium.launch(
-                headless=False
-            )  # 创建一个浏览器上下文，使用指定的 cookie 文件
-        context = await browser.new_context(storage_state=f"{self.account_file}")
-        context = await set_init_script(context)
-        context.on("close", lambda: context.storage_state(path=self.account_file))
-
-        # 创建一个新的页面
-        page = await context.new_page()
-        # 访问指定的 URL
-        await page.goto("https://cp.kuaishou.com/article/publish/video")
-        kuaishou_logger.info('正在上传-------{}.mp4'.format(self.title))
-        # 等待页面跳转到指定的 URL，没进入，则自动等待到超时
-        kuaishou_logger.info('正在打开主页...')
-        await page.wait_for_url("https://cp.kuaishou.com/article/publish/video")
-        # 点击 "上传视频" 按钮
-        upload_button = page.locator("button[class^='_upload-btn']")
-        await upload_button.wait_for(state='visible')  # 确保按钮可见
-
-        async with page.expect_file_chooser() as fc_info:
-            await upload_button.click()
-        file_chooser = await fc_info.value
-        await file_chooser.set_files(self.file_path)
-
-        await asyncio.sleep(2)
-
-        # if not await page.get_by_text("封面编辑").count():
-        #     raise Exception("似乎没有跳转到到编辑页面")
-
-        await asyncio.sleep(1)
-
-        # 等待按钮可交互
-        new_feature_button = page.locator('button[type="button"] span:text("我知道了")')
-        if await new_feature_button.count() > 0:
-            await new_feature_button.click()
-
-        kuaishou_logger.info("正在填充标题和话题...")
-        await page.get_by_text("描述").locator("xpath=following-sibling::div").click()
-        kuaishou_logger.info("clear existing title")
-        await page.keyboard.press("Backspace")
-        await page.keyboard.press("Control+KeyA")
-        await page.keyboard.press("Delete")
-        kuaishou_logger.info("filling new  title")
-        await page.keyboard.type(self.title)
-        await page.keyboard.press("Enter")
-
-        # 快手只能添加3个话题
-        for index, tag in enumerate(self.tags[:3], start=1):
-            kuaishou_logger.info("正在添加第%s个话题" % index)
-            await page.keyboard.type(f"#{tag} ")
-            await asyncio.sleep(2)
-
-        max_retries = 60  # 设置最大重试次数,最大等待时间为 2 分钟
-        retry_count = 0
-
-        while retry_count < max_retries:
-            try:
-                # 获取包含 '上传中' 文本的元素数量
-                number = await page.locator("text=上传中").count()
-
-                if number == 0:
-                    kuaishou_logger.success("视频上传完毕")
-                    break
-                else:
-                    if retry_count % 5 == 0:
-                        kuaishou_logger.info("正在上传视频中...")
-                    await asyncio.sleep(2)
-            except Exception as e:
-                kuaishou_logger.error(f"检查上传状态时发生错误: {e}")
-                await asyncio.sleep(2)  # 等待 2 秒后重试
-            retry_count += 1
-
-        if retry_count == max_retries:
-            kuaishou_logger.warning("超过最大重试次数，视频上传可能未完成。")
-
-        # 定时任务
-        if self.publish_date != 0:
-            await self.set_schedule_time(page, self.publish_date)
-
-        # 判断视频是否发布成功
-        while True:
-            try:
-                publish_button = page.get_by_text("发布", exact=True)
-                if await publish_button.count() > 0:
-                    await publish_button.click()
-
-                await asyncio.sleep(1)
-                confirm_button = page.get_by_text("确认发布")
-                if await confirm_button.count() > 0:
-                    await confirm_button.click()
-
-                # 等待页面跳转，确认发布成功
-                await page.wait_for_url(
-                    "https://cp.kuaishou.com/article/manage/video?status=2&from=publish",
-                    timeout=5000,
-                )
-                kuaishou_logger.success("视频发布成功")
-                break
-            except Exception as e:
-                kuaishou_logger.info(f"视频正在发布中... 错误: {e}")
-                await page.screenshot(full_page=True)
-                await asyncio.sleep(1)
-
-        await context.storage_state(path=self.account_file)  # 保存cookie
-        kuaishou_logger.info('cookie更新完毕！')
-        await asyncio.sleep(2)  # 这里延迟是为了方便眼睛直观的观看
-        # 关闭浏览器上下文和浏览器实例
-        await context.close()
-        await browser.close()
+    async def upload(self) -> None:
+        # 从共享浏览器池中创建一个浏览器上下文，使用指定的 cookie 文件
+        context = await browser_pool.new_context(headless=False, executable_path=self.local_executable_path,
+                                                 storage_state=f"{self.account_file}")
+        try:
+            context.on("close", lambda: context.storage_state(path=self.account_file))
+
+            # 创建一个新的页面
+            page = await context.new_page()
+            with span("open_upload_page"):
+                # 访问指定的 URL
+                await page.goto("https://cp.kuaishou.com/article/publish/video")
+                kuaishou_logger.info('正在上传-------{}.mp4'.format(self.title))
+                # 等待页面跳转到指定的 URL，没进入，则自动等待到超时
+                kuaishou_logger.info('正在打开主页...')
+                try:
+                    await page.wait_for_url("https://cp.kuaishou.com/article/publish/video")
+                except Exception:
+                    # 没能进入上传页面，多半是 cookie 已失效被重定向到了登录页
+                    cookie_cache.invalidate(self.account_file)
+                    raise
+            with span("select_video_file"):
+                # 点击 "上传视频" 按钮
+                upload_button = page.locator("button[class^='_upload-btn']")
+                await upload_button.wait_for(state='visible')  # 确保按钮可见
+
+                async with page.expect_file_chooser() as fc_info:
+                    await upload_button.click()
+                file_chooser = await fc_info.value
+                await file_chooser.set_files(self.file_path)
+
+                # if not await page.get_by_text("封面编辑").count():
+                #     raise Exception("似乎没有跳转到到编辑页面")
+
+                # 等待跳转到编辑页面，描述输入框出现
+                description_editor = page.get_by_text("描述").locator("xpath=following-sibling::div")
+                await wait_for_state(description_editor, timeout=30000, name="kuaishou.edit_page")
+
+            # 等待按钮可交互
+            new_feature_button = page.locator('button[type="button"] span:text("我知道了")')
+            if await new_feature_button.count() > 0:
+                await new_feature_button.click()
+
+            with span("add_title_tags"):
+                kuaishou_logger.info("正在填充标题和话题...")
+                await description_editor.click()
+                kuaishou_logger.info("clear existing title")
+                await page.keyboard.press("Backspace")
+                await page.keyboard.press("Control+KeyA")
+                await page.keyboard.press("Delete")
+                kuaishou_logger.info("filling new  title")
+                await page.keyboard.type(self.title)
+                await page.keyboard.press("Enter")
+
+                # 快手只能添加3个话题
+                for index, tag in enumerate(self.tags[:3], start=1):
+                    kuaishou_logger.info("正在添加第%s个话题" % index)
+                    # 等待话题联想请求返回
+                    async with NetworkIdle(page, r"tag|topic", name="kuaishou.tag_suggest"):
+                        await page.keyboard.type(f"#{tag} ")
+
+            with span("detect_upload_status"):
+                # 页面上不再有 '上传中' 代表视频上传完毕，最多等待 2 分钟
+                async with UploadCompletionDetector(page, success_js="!document.body.innerText.includes('上传中')",
+                                                    log=kuaishou_logger) as detector:
+                    try:
+                        await detector.wait(timeout=120)
+                        kuaishou_logger.success("视频上传完毕")
+                    except asyncio.TimeoutError:
+                        kuaishou_logger.warning("超过最大等待时间，视频上传可能未完成。")
+
+            # 定时任务
+            if self.publish_date != 0:
+                await self.set_schedule_time(page, self.publish_date)
+
+            with span("click_publish"):
+                # 判断视频是否发布成功
+                while True:
+                    try:
+                        publish_button = page.get_by_text("发布", exact=True)
+                        if await publish_button.count() > 0:
+                            await publish_button.click()
+
+                        confirm_button = page.get_by_text("确认发布")
+                        if await wait_for_state(confirm_button, timeout=3000, name="kuaishou.confirm_publish"):
+                            await confirm_button.click()
+
+                        # 等待页面跳转，确认发布成功
+                        await page.wait_for_url(
+                            "https://cp.kuaishou.com/article/manage/video?status=2&from=publish",
+                            timeout=5000,
+                        )
+                        kuaishou_logger.success("视频发布成功")
+                        break
+                    except Exception as e:
+                        kuaishou_logger.info(f"视频正在发布中... 错误: {e}")
+                        await page.screenshot(full_page=True)
+                        await asyncio.sleep(1)
+
+            with span("save_storage_state"):
+                await context.storage_state(path=self.account_file)  # 保存cookie
+                cookie_cache.mark_valid(self.account_file)
+            kuaishou_logger.info('cookie更新完毕！')
+        finally:
+            # 关闭浏览器上下文，浏览器实例留在池中复用
+            await context.close()
 
     async def main(self):
-        async with async_playwright() as playwright:
-            await self.upload(playwright)
+        with trace_context(platform="kuaishou", account=Path(self.account_file).stem), span("upload"):
+            await self.upload()
 
+    @traced()
     async def set_schedule_time(self, page, publish_date):
         kuaishou_logger.info("click schedule")
         publish_date_hour = publish_date.strftime("%Y-%m-%d %H:%M:%S")
         await page.locator("label:text('发布时间')").locator('xpath=following-sibling::div').locator(
             '.ant-radio-input').nth(1).click()
-        await asyncio.sleep(1)
 
-        await page.locator('div.ant-picker-input input[placeholder="选择日期时间"]').click()
-        await asyncio.sleep(1)
+        date_input = page.locator('div.ant-picker-input input[placeholder="选择日期时间"]')
+        await wait_for_stable(date_input, name="kuaishou.schedule_input")
+        await date_input.click()
+        await wait_for_state(page.locator("div.ant-picker-dropdown:visible"), name="kuaishou.schedule_picker")
 
         await page.keyboard.press("Control+KeyA")
         await page.keyboard.type(str(publish_date_hour))
         await page.keyboard.press("Enter")
-        await asyncio.sleep(1)
+        await wait_for_state(page.locator("div.ant-picker-dropdown:visible"), state="hidden",
+                             name="kuaishou.schedule_picker_close")
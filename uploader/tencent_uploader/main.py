@@ -1,14 +1,19 @@
 # -*- coding: utf-8 -*-
 from datetime import datetime
+from pathlib import Path
 
-from playwright.async_api import Playwright, async_playwright
+from playwright.async_api import async_playwright
 import os
 import asyncio
 
-from conf import LOCAL_CHROME_PATH
-from utils.base_social_media import set_init_script
+from utils.base_social_media import set_init_script, get_local_executable_path
+from utils.browser_pool import browser_pool
+from utils.cookie_cache import cookie_cache
 from utils.files_times import get_absolute_path
 from utils.log import tencent_logger
+from utils.tracing import span, trace_context, traced
+from utils.upload_detector import UploadCompletionDetector, UPLOAD_FAILURE, js_exists, js_has_text
+from utils.waits import wait_for_state
 
 
 def format_str_for_short_title(origin_title: str) -> str:
@@ -32,10 +37,8 @@ def format_str_for_short_title(origin_title: str) -> str:
 
 
 async def cookie_auth(account_file):
-    async with async_playwright() as playwright:
-        browser = await playwright.chromium.launch(headless=True)
-        context = await browser.new_context(storage_state=account_file)
-        context = await set_init_script(context)
+    context = await browser_pool.new_context(headless=True, storage_state=account_file)
+    try:
         # 创建一个新的页面
         page = await context.new_page()
         # 访问指定的 URL
@@ -47,6 +50,8 @@ async def cookie_auth(account_file):
         except:
             tencent_logger.success("[+] cookie 有效")
             return True
+    finally:
+        await context.close()
 
 
 async def get_tencent_cookie(account_file):
@@ -72,7 +77,7 @@ async def get_tencent_cookie(account_file):
 
 async def weixin_setup(account_file, handle=False):
     account_file = get_absolute_path(account_file, "tencent_uploader")
-    if not os.path.exists(account_file) or not await cookie_auth(account_file):
+    if not os.path.exists(account_file) or not await cookie_cache.check(account_file, cookie_auth):
         if not handle:
             # Todo alert message
             return False
@@ -89,8 +94,9 @@ class TencentVideo(object):
         self.publish_date = publish_date
         self.account_file = account_file
         self.category = category
-        self.local_executable_path = LOCAL_CHROME_PATH
+        self.local_executable_path = get_local_executable_path()
 
+    @traced()
     async def set_schedule_time_tencent(self, page, publish_date):
         label_element = page.locator("label").filter(has_text="定时").nth(1)
         await label_element.click()
@@ -126,6 +132,7 @@ class TencentVideo(object):
         # 选择标题栏（令定时时间生效）
         await page.locator("div.input-editor").click()
 
+    @traced()
     async def handle_upload_error(self, page):
         tencent_logger.info("视频出错了，重新上传中")
         await page.locator('div.media-status-content div.tag-inner:has-text("删除")').click()
@@ -133,47 +140,54 @@ class TencentVideo(object):
         file_input = page.locator('input[type="file"]')
         await file_input.set_input_files(self.file_path)
 
-    async def upload(self, playwright: Playwright) -> None:
-        # 使用 Chromium (这里使用系统内浏览器，用chromium 会造成h264错误
-        browser = await playwright.chromium.launch(headless=False, executable_path=self.local_executable_path)
-        # 创建一个浏览器上下文，使用指定的 cookie 文件
-        context = await browser.new_context(storage_state=f"{self.account_file}")
-        context = await set_init_script(context)
-
-        # 创建一个新的页面
-        page = await context.new_page()
-        # 访问指定的 URL
-        await page.goto("https://channels.weixin.qq.com/platform/post/create")
-        tencent_logger.info(f'[+]正在上传-------{self.title}.mp4')
-        # 等待页面跳转到指定的 URL，没进入，则自动等待到超时
-        await page.wait_for_url("https://channels.weixin.qq.com/platform/post/create")
-        # await page.wait_for_selector('input[type="file"]', timeout=10000)
-        file_input = page.locator('input[type="file"]')
-        await file_input.set_input_files(self.file_path)
-        # 填充标题和话题
-        await self.add_title_tags(page)
-        # 添加商品
-        # await self.add_product(page)
-        # 合集功能
-        await self.add_collection(page)
-        # 原创选择
-        await self.add_original(page)
-        # 检测上传状态
-        await self.detect_upload_status(page)
-        if self.publish_date != 0:
-            await self.set_schedule_time_tencent(page, self.publish_date)
-        # 添加短标题
-        await self.add_short_title(page)
-
-        await self.click_publish(page)
-
-        await context.storage_state(path=f"{self.account_file}")  # 保存cookie
-        tencent_logger.success('  [-]cookie更新完毕！')
-        await asyncio.sleep(2)  # 这里延迟是为了方便眼睛直观的观看
-        # 关闭浏览器上下文和浏览器实例
-        await context.close()
-        await browser.close()
-
+    async def upload(self) -> None:
+        # 优先使用系统内 Chrome（自带的 chromium 预览 h264 会出错），没有安装时退回自带的 Chromium
+        # 从共享浏览器池中创建一个浏览器上下文，使用指定的 cookie 文件
+        context = await browser_pool.new_context(headless=False, executable_path=self.local_executable_path,
+                                                 storage_state=f"{self.account_file}")
+        try:
+            # 创建一个新的页面
+            page = await context.new_page()
+            with span("open_upload_page"):
+                # 访问指定的 URL
+                await page.goto("https://channels.weixin.qq.com/platform/post/create")
+                tencent_logger.info(f'[+]正在上传-------{self.title}.mp4')
+                # 等待页面跳转到指定的 URL，没进入，则自动等待到超时
+                try:
+                    await page.wait_for_url("https://channels.weixin.qq.com/platform/post/create")
+                except Exception:
+                    # 没能进入上传页面，多半是 cookie 已失效被重定向到了登录页
+                    cookie_cache.invalidate(self.account_file)
+                    raise
+            # await page.wait_for_selector('input[type="file"]', timeout=10000)
+            file_input = page.locator('input[type="file"]')
+            await file_input.set_input_files(self.file_path)
+            # 填充标题和话题
+            await self.add_title_tags(page)
+            # 添加商品
+            # await self.add_product(page)
+            # 合集功能
+            await self.add_collection(page)
+            # 原创选择
+            await self.add_original(page)
+            # 检测上传状态
+            await self.detect_upload_status(page)
+            if self.publish_date != 0:
+                await self.set_schedule_time_tencent(page, self.publish_date)
+            # 添加短标题
+            await self.add_short_title(page)
+
+            await self.click_publish(page)
+
+            with span("save_storage_state"):
+                await context.storage_state(path=f"{self.account_file}")  # 保存cookie
+                cookie_cache.mark_valid(self.account_file)
+            tencent_logger.success('  [-]cookie更新完毕！')
+        finally:
+            # 关闭浏览器上下文，浏览器实例留在池中复用
+            await context.close()
+
+    @traced()
     async def add_short_title(self, page):
         short_title_element = page.get_by_text("短标题", exact=True).locator("..").locator(
             "xpath=following-sibling::div").locator(
@@ -182,6 +196,7 @@ class TencentVideo(object):
             short_title = format_str_for_short_title(self.title)
             await short_title_element.fill(short_title)
 
+    @traced()
     async def click_publish(self, page):
         while True:
             try:
@@ -201,27 +216,21 @@ class TencentVideo(object):
                     tencent_logger.info("  [-] 视频正在发布中...")
                     await asyncio.sleep(0.5)
 
+    @traced()
     async def detect_upload_status(self, page):
-        while True:
-            # 匹配删除按钮，代表视频上传完毕，如果不存在，代表视频正在上传，则等待
-            try:
-                # 匹配删除按钮，代表视频上传完毕
-                if "weui-desktop-btn_disabled" not in await page.get_by_role("button", name="发表").get_attribute(
-                        'class'):
-                    tencent_logger.info("  [-]视频上传完毕")
-                    break
-                else:
-                    tencent_logger.info("  [-] 正在上传视频中...")
-                    await asyncio.sleep(2)
-                    # 出错了视频出错
-                    if await page.locator('div.status-msg.error').count() and await page.locator(
-                            'div.media-status-content div.tag-inner:has-text("删除")').count():
-                        tencent_logger.error("  [-] 发现上传出错了...准备重试")
-                        await self.handle_upload_error(page)
-            except:
-                tencent_logger.info("  [-] 正在上传视频中...")
-                await asyncio.sleep(2)
-
+        # 发表按钮可用代表视频上传完毕；出现错误提示和删除按钮代表上传出错，删除后重新上传
+        publish_enabled = ("Array.from(document.querySelectorAll('button')).some(button => "
+                           "button.textContent.trim() === '发表' && !button.className.includes('weui-desktop-btn_disabled'))")
+        upload_error = (js_exists('div.status-msg.error') + " && "
+                        + js_has_text('div.media-status-content div.tag-inner', "删除"))
+        async with UploadCompletionDetector(page, success_js=publish_enabled, failure_js=upload_error,
+                                            log=tencent_logger) as detector:
+            while await detector.wait() == UPLOAD_FAILURE:
+                tencent_logger.error("  [-] 发现上传出错了...准备重试")
+                await self.handle_upload_error(page)
+        tencent_logger.info("  [-]视频上传完毕")
+
+    @traced()
     async def add_title_tags(self, page):
         await page.locator("div.input-editor").click()
         await page.keyboard.type(self.title)
@@ -231,6 +240,7 @@ class TencentVideo(object):
             await page.keyboard.press("Space")
         tencent_logger.info(f"成功添加hashtag: {len(self.tags)}")
 
+    @traced()
     async def add_collection(self, page):
         collection_elements = page.get_by_text("添加到合集").locator("xpath=following-sibling::div").locator(
             '.option-list-wrap > div')
@@ -238,6 +248,7 @@ class TencentVideo(object):
             await page.get_by_text("添加到合集").locator("xpath=following-sibling::div").click()
             await collection_elements.first.click()
 
+    @traced()
     async def add_original(self, page):
         if await page.get_by_label("视频为原创").count():
             await page.get_by_label("视频为原创").check()
@@ -258,10 +269,12 @@ class TencentVideo(object):
                 await page.locator('div.form-content:visible').click()  # 下拉菜单
                 await page.locator(
                     f'div.form-content:visible ul.weui-desktop-dropdown__list li.weui-desktop-dropdown__list-ele:has-text("{self.category}")').first.click()
-                await page.wait_for_timeout(1000)
+                # 等待下拉菜单收起
+                await wait_for_state(page.locator('div.form-content:visible ul.weui-desktop-dropdown__list:visible'),
+                                     state="hidden", timeout=3000, name="tencent.original_type_dropdown")
             if await page.locator('button:has-text("声明原创"):visible').count():
                 await page.locator('button:has-text("声明原创"):visible').click()
 
     async def main(self):
-        async with async_playwright() as playwright:
-            await self.upload(playwright)
+        with trace_context(platform="tencent", account=Path(self.account_file).stem), span("upload"):
+            await self.upload()
@@ -1,23 +1,27 @@
 # -*- coding: utf-8 -*-
 import re
 from datetime import datetime
+from pathlib import Path
 
-from playwright.async_api import Playwright, async_playwright
+from playwright.async_api import async_playwright
 import os
 import asyncio
 
-from conf import LOCAL_CHROME_PATH
 from uploader.tk_uploader.tk_config import Tk_Locator
-from utils.base_social_media import set_init_script
+from utils.base_social_media import set_init_script, get_local_executable_path
+from utils.browser_pool import browser_pool
+from utils.cookie_cache import cookie_cache
+from utils.covers import cover_pipeline
 from utils.files_times import get_absolute_path
 from utils.log import tiktok_logger
+from utils.tracing import span, trace_context, traced
+from utils.upload_detector import UploadCompletionDetector, UPLOAD_FAILURE, js_exists
+from utils.waits import NetworkIdle, wait_for_stable, wait_for_state
 
 
 async def cookie_auth(account_file):
-    async with async_playwright() as playwright:
-        browser = await playwright.chromium.launch(headless=True)
-        context = await browser.new_context(storage_state=account_file)
-        context = await set_init_script(context)
+    context = await browser_pool.new_context(headless=True, storage_state=account_file)
+    try:
         # 创建一个新的页面
         page = await context.new_page()
         # 访问指定的 URL
@@ -37,11 +41,13 @@ async def cookie_auth(account_file):
         except:
             tiktok_logger.success("[+] cookie valid")
             return True
+    finally:
+        await context.close()
 
 
 async def tiktok_setup(account_file, handle=False):
     account_file = get_absolute_path(account_file, "tk_uploader")
-    if not os.path.exists(account_file) or not await cookie_auth(account_file):
+    if not os.path.exists(account_file) or not await cookie_cache.check(account_file, cookie_auth, ("sessionid",)):
         if not handle:
             return False
         tiktok_logger.info('[+] cookie file is not existed or expired. Now open the browser auto. Please login with your way(gmail phone, whatever, the cookie file will generated after login')
@@ -78,9 +84,10 @@ class TiktokVideo(object):
         self.publish_date = publish_date
         self.thumbnail_path = thumbnail_path
         self.account_file = account_file
-        self.local_executable_path = LOCAL_CHROME_PATH
+        self.local_executable_path = get_local_executable_path()
         self.locator_base = None
 
+    @traced()
     async def set_schedule_time(self, page, publish_date):
         schedule_input_element = self.locator_base.get_by_label('Schedule')
         await schedule_input_element.wait_for(state='visible')  # 确保按钮可见
@@ -126,21 +133,25 @@ class TiktokVideo(object):
         hour_selector = f"span.tiktok-timepicker-left:has-text('{hour_str}')"
         minute_selector = f"span.tiktok-timepicker-right:has-text('{minute_str}')"
 
-        # pick hour first
-        await page.wait_for_timeout(500)  # 等待500毫秒
-        await self.locator_base.locator(hour_selector).click()
+        # pick hour first, once the time picker has finished opening
+        hour_option = self.locator_base.locator(hour_selector)
+        await wait_for_stable(hour_option, name="tiktok.hour_option")
+        await hour_option.click()
         # click time button again
-        await page.wait_for_timeout(500)  # 等待500毫秒
-        await scheduled_picker.locator('div.TUXInputBox').nth(0).click()
-        await page.wait_for_timeout(500)  # 等待500毫秒
-        # pick minutes after
-        await scheduled_picker.locator('div.TUXInputBox').nth(0).click()
-        await page.wait_for_timeout(500)  # 等待500毫秒
-        await self.locator_base.locator(minute_selector).click()
+        time_input = scheduled_picker.locator('div.TUXInputBox').nth(0)
+        await wait_for_stable(time_input, name="tiktok.time_input")
+        await time_input.click()
+        # pick minutes after; the click above may only close the picker, reopen it if the minutes are not shown
+        minute_option = self.locator_base.locator(minute_selector)
+        if not await wait_for_stable(minute_option, timeout=1500, name="tiktok.minute_option"):
+            await time_input.click()
+            await wait_for_stable(minute_option, name="tiktok.minute_option")
+        await minute_option.click()
 
         # click title to remove the focus.
         # await self.locator_base.locator("h1:has-text('Upload video')").click()
 
+    @traced()
     async def handle_upload_error(self, page):
         tiktok_logger.info("video upload error retrying.")
         select_file_button = self.locator_base.locator('button[aria-label="Select file"]')
@@ -149,55 +160,67 @@ class TiktokVideo(object):
         file_chooser = await fc_info.value
         await file_chooser.set_files(self.file_path)
 
-    async def upload(self, playwright: Playwright) -> None:
-        browser = await playwright.chromium.launch(headless=False, executable_path=self.local_executable_path)
-        context = await browser.new_context(storage_state=f"{self.account_file}")
-        context = await set_init_script(context)
-        page = await context.new_page()
-
-        # change language to eng first
-        await self.change_language(page)
-        await page.goto("https://www.tiktok.com/tiktokstudio/upload")
-        tiktok_logger.info(f'[+]Uploading-------{self.title}.mp4')
-
-        await page.wait_for_url("https://www.tiktok.com/tiktokstudio/upload", timeout=10000)
-
+    async def upload(self) -> None:
+        # generate the tiktok cover variant in the worker pool while the video uploads
+        cover_future = cover_pipeline.prepare(self.file_path, "tiktok", self.thumbnail_path)
+        context = await browser_pool.new_context(headless=False, executable_path=self.local_executable_path,
+                                                 storage_state=f"{self.account_file}")
         try:
-            await page.wait_for_selector('iframe[data-tt="Upload_index_iframe"], div.upload-container', timeout=10000)
-            tiktok_logger.info("Either iframe or div appeared.")
-        except Exception as e:
-            tiktok_logger.error("Neither iframe nor div appeared within the timeout.")
-
-        await self.choose_base_locator(page)
-
-        upload_button = self.locator_base.locator(
-            'button:has-text("Select video"):visible')
-        await upload_button.wait_for(state='visible')  # 确保按钮可见
-
-        async with page.expect_file_chooser() as fc_info:
-            await upload_button.click()
-        file_chooser = await fc_info.value
-        await file_chooser.set_files(self.file_path)
-
-        await self.add_title_tags(page)
-        # detect upload status
-        await self.detect_upload_status(page)
-        if self.thumbnail_path:
-            tiktok_logger.info(f'[+] Uploading thumbnail file {self.title}.png')
-            await self.upload_thumbnails(page)
-
-        if self.publish_date != 0:
-            await self.set_schedule_time(page, self.publish_date)
-
-        await self.click_publish(page)
-
-        await context.storage_state(path=f"{self.account_file}")  # save cookie
-        tiktok_logger.info('  [-] update cookie！')
-        await asyncio.sleep(2)  # close delay for look the video status
-        # close all
-        await context.close()
-        await browser.close()
-
+            page = await context.new_page()
+
+            with span("open_upload_page"):
+                # change language to eng first
+                await self.change_language(page)
+                await page.goto("https://www.tiktok.com/tiktokstudio/upload")
+                tiktok_logger.info(f'[+]Uploading-------{self.title}.mp4')
+
+                try:
+                    await page.wait_for_url("https://www.tiktok.com/tiktokstudio/upload", timeout=10000)
+                except Exception:
+                    # could not reach the upload page, most likely redirected to a login wall
+                    cookie_cache.invalidate(self.account_file)
+                    raise
+
+                try:
+                    await page.wait_for_selector('iframe[data-tt="Upload_index_iframe"], div.upload-container', timeout=10000)
+                    tiktok_logger.info("Either iframe or div appeared.")
+                except Exception as e:
+                    tiktok_logger.error("Neither iframe nor div appeared within the timeout.")
+
+            await self.choose_base_locator(page)
+
+            with span("select_video_file"):
+                upload_button = self.locator_base.locator(
+                    'button:has-text("Select video"):visible')
+                await upload_button.wait_for(state='visible')  # 确保按钮可见
+
+                async with page.expect_file_chooser() as fc_info:
+                    await upload_button.click()
+                file_chooser = await fc_info.value
+                await file_chooser.set_files(self.file_path)
+
+            await self.add_title_tags(page)
+            # detect upload status
+            await self.detect_upload_status(page)
+            self.thumbnail_path = await asyncio.wrap_future(cover_future)
+            if self.thumbnail_path:
+                tiktok_logger.info(f'[+] Uploading thumbnail file {self.thumbnail_path}')
+                await self.upload_thumbnails(page)
+
+            if self.publish_date != 0:
+                await self.set_schedule_time(page, self.publish_date)
+
+            await self.click_publish(page)
+
+            with span("save_storage_state"):
+                await context.storage_state(path=f"{self.account_file}")  # save cookie
+                cookie_cache.mark_valid(self.account_file)
+            tiktok_logger.info('  [-] update cookie！')
+        finally:
+            # close the context, the browser stays in the shared pool
+            await context.close()
+
+    @traced()
     async def add_title_tags(self, page):
 
         editor_locator = self.locator_base.locator('div.public-DraftEditor-content')
@@ -211,10 +234,7 @@ class TiktokVideo(object):
 
         await page.keyboard.press("End")
 
-        await page.wait_for_timeout(1000)  # 等待1秒
-
         await page.keyboard.insert_text(self.title)
-        await page.wait_for_timeout(1000)  # 等待1秒
         await page.keyboard.press("End")
 
         await page.keyboard.press("Enter")
@@ -223,14 +243,15 @@ class TiktokVideo(object):
         for index, tag in enumerate(self.tags, start=1):
             tiktok_logger.info("Setting the %s tag" % index)
             await page.keyboard.press("End")
-            await page.wait_for_timeout(1000)  # 等待1秒
-            await page.keyboard.insert_text("#" + tag + " ")
-            await page.keyboard.press("Space")
-            await page.wait_for_timeout(1000)  # 等待1秒
+            # wait for the hashtag suggestion request instead of a fixed delay
+            async with NetworkIdle(page, r"hashtag|challenge|search/sug", name="tiktok.hashtag_suggest"):
+                await page.keyboard.insert_text("#" + tag + " ")
+                await page.keyboard.press("Space")
 
             await page.keyboard.press("Backspace")
             await page.keyboard.press("End")
 
+    @traced()
     async def upload_thumbnails(self, page):
         await self.locator_base.locator(".cover-container").click()
         await self.locator_base.locator(".cover-edit-container >> text=Upload cover").click()
@@ -238,10 +259,12 @@ class TiktokVideo(object):
             await self.locator_base.locator(".upload-image-upload-area").click()
             file_chooser = await fc_info.value
             await file_chooser.set_files(self.thumbnail_path)
-        await self.locator_base.locator('div.cover-edit-panel:not(.hide-panel)').get_by_role(
-            "button", name="Confirm").click()
-        await page.wait_for_timeout(3000)  # wait 3s, fix it later
+        cover_panel = self.locator_base.locator('div.cover-edit-panel:not(.hide-panel)')
+        await cover_panel.get_by_role("button", name="Confirm").click()
+        # wait for the cover editor to close instead of a fixed 3s delay
+        await wait_for_state(cover_panel, state="hidden", name="tiktok.cover_panel_close")
 
+    @traced()
     async def change_language(self, page):
         # set the language to english
         await page.goto("https://www.tiktok.com")
@@ -252,6 +275,7 @@ class TiktokVideo(object):
         await page.locator('[data-e2e="language-select"]').click()
         await page.locator('#lang-setting-popup-list >> text=English').click()
 
+    @traced()
     async def click_publish(self, page):
         success_flag_div = 'div.common-modal-confirm-modal'
         while True:
@@ -273,24 +297,27 @@ class TiktokVideo(object):
                     await page.screenshot(full_page=True)
                     await asyncio.sleep(0.5)
 
+    @traced()
     async def detect_upload_status(self, page):
-        while True:
-            try:
-                # if await self.locator_base.locator('div.btn-post > button').get_attribute("disabled") is None:
-                if await self.locator_base.locator(
-                        'div.button-group > button >> text=Post').get_attribute("disabled") is None:
-                    tiktok_logger.info("  [-]video uploaded.")
-                    break
-                else:
-                    tiktok_logger.info("  [-] video uploading...")
-                    await asyncio.sleep(2)
-                    if await self.locator_base.locator(
-                            'button[aria-label="Select file"]').count():
-                        tiktok_logger.info("  [-] found some error while uploading now retry...")
-                        await self.handle_upload_error(page)
-            except:
-                tiktok_logger.info("  [-] video uploading...")
-                await asyncio.sleep(2)
+        # the post button becomes enabled once the video is uploaded,
+        # the "Select file" button shows up again when the upload failed
+        post_enabled = ("Array.from(document.querySelectorAll('div.button-group > button')).some(button => "
+                      "button.textContent.includes('Post') && !button.hasAttribute('disabled'))")
+        async with UploadCompletionDetector(page, success_js=post_enabled,
+                                            failure_js=js_exists('button[aria-label="Select file"]'),
+                                            frame=await self.get_upload_frame(page),
+                                            log=tiktok_logger) as detector:
+            while await detector.wait() == UPLOAD_FAILURE:
+                tiktok_logger.info("  [-] found some error while uploading now retry...")
+                await self.handle_upload_error(page)
+        tiktok_logger.info("  [-]video uploaded.")
+
+    async def get_upload_frame(self, page):
+        # the upload form may live in an iframe, the DOM observer has to run inside it
+        iframe = await page.query_selector(Tk_Locator.tk_iframe)
+        if iframe:
+            return await iframe.content_frame()
+        return page.main_frame
 
     async def choose_base_locator(self, page):
         # await page.wait_for_selector('div.upload-container')
@@ -300,5 +327,5 @@ class TiktokVideo(object):
             self.locator_base = page.locator(Tk_Locator.default) 
 
     async def main(self):
-        async with async_playwright() as playwright:
-            await self.upload(playwright)
+        with trace_context(platform="tiktok", account=Path(self.account_file).stem), span("upload"):
+            await self.upload()
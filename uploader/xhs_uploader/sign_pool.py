@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""
+小红书签名页面池
+
+每个 a1 对应一个已经加载好 xiaohongshu.com 的常驻页面，签名时直接在页面里调用
+window._webmsxyw，不再为每次请求启动/关闭一次 Chromium。
+"""
+import asyncio
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from playwright.async_api import async_playwright
+
+from conf import XHS_SIGN_POOL_SIZE, XHS_SIGN_PAGE_TTL
+from utils.base_social_media import get_stealth_script
+from utils.log import xhs_logger
+
+XHS_HOME_URL = "https://www.xiaohongshu.com"
+SIGN_USER_AGENT = 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Docker 环境兼容的浏览器启动参数
+DOCKER_LAUNCH_ARGS = [
+    '--no-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--disable-web-security',
+    '--disable-features=VizDisplayCompositor',
+    '--disable-extensions',
+    '--disable-plugins',
+    '--disable-images',
+    '--disable-javascript-harmony-shipping',
+    '--disable-ipc-flooding-protection',
+    '--disable-background-timer-throttling',
+    '--disable-renderer-backgrounding',
+    '--disable-backgrounding-occluded-windows',
+    '--disable-client-side-phishing-detection',
+    '--disable-sync',
+    '--disable-translate',
+    '--disable-default-apps',
+    '--no-first-run',
+    '--no-default-browser-check',
+    '--memory-pressure-off',
+    '--max_old_space_size=4096',
+    '--single-process'
+]
+
+
+def is_docker_env() -> bool:
+    return os.path.exists('/.dockerenv') or os.environ.get('DOCKER_ENV') == '1'
+
+
+def get_launch_args():
+    return DOCKER_LAUNCH_ARGS if is_docker_env() else ['--no-sandbox', '--disable-dev-shm-usage']
+
+
+class SignPage(object):
+    def __init__(self, a1, context, page):
+        self.a1 = a1
+        self.context = context
+        self.page = page
+        self.created_at = time.monotonic()
+        self.last_checked = self.created_at
+
+
+class SignPagePool(object):
+    """
+    以 a1 为 key 的预热签名页面池（asyncio 版本）
+
+    - 页面超过 page_ttl 秒或健康检查失败（window._webmsxyw 不存在）会被淘汰并重建
+    - 页面数量超过 max_pages 时按 LRU 淘汰
+    - 同一个 a1 的并发请求只会创建一个页面
+    """
+
+    def __init__(self, max_pages=XHS_SIGN_POOL_SIZE, page_ttl=XHS_SIGN_PAGE_TTL, headless=True,
+                 max_retries=10, health_check_interval=30):
+        self.max_pages = max_pages
+        self.page_ttl = page_ttl
+        self.headless = headless
+        self.max_retries = max_retries
+        self.health_check_interval = health_check_interval
+        self._pages = OrderedDict()
+        self._pending = {}
+        self._playwright = None
+        self._browser = None
+        self._start_lock = None
+
+    async def start(self):
+        if self._browser is not None and self._browser.is_connected():
+            return
+        if self._start_lock is None:
+            self._start_lock = asyncio.Lock()
+        async with self._start_lock:
+            if self._browser is not None and self._browser.is_connected():
+                return
+            # 浏览器崩溃后旧页面全部失效
+            self._pages.clear()
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            self._browser = await self._playwright.chromium.launch(headless=self.headless, args=get_launch_args())
+            xhs_logger.info(f"[+] 签名浏览器已启动, docker: {is_docker_env()}")
+
+    async def close(self):
+        for sign_page in list(self._pages.values()):
+            await self._close_page(sign_page)
+        self._pages.clear()
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def sign(self, uri, data=None, a1="", web_session=""):
+        last_error = None
+        for retry_count in range(self.max_retries):
+            sign_page = None
+            try:
+                # 创建页面、等待 _webmsxyw 失败（超时、浏览器崩溃）同样重试
+                sign_page = await self._acquire(a1)
+                encrypt_params = await sign_page.page.evaluate("([url, data]) => window._webmsxyw(url, data)",
+                                                               [uri, data])
+                return {
+                    "x-s": encrypt_params["X-s"],
+                    "x-t": str(encrypt_params["X-t"])
+                }
+            except Exception as e:
+                # 这儿有时会出现 window._webmsxyw is not a function 或未知跳转错误，淘汰页面后重试
+                last_error = e
+                xhs_logger.warning(f"Sign attempt {retry_count + 1} failed: {e}")
+                if sign_page is not None:
+                    await self._evict(a1, sign_page)
+                if retry_count < self.max_retries - 1:
+                    # 递增等待，避免页面持续出错时连续重建页面
+                    await asyncio.sleep(1 + retry_count * 0.5)
+        raise Exception(f"重试了这么多次还是无法签名成功，寄寄寄: {last_error}")
+
+    async def _acquire(self, a1):
+        sign_page = self._pages.get(a1)
+        if sign_page is not None:
+            if not self._is_stale(sign_page) and await self._is_healthy(sign_page):
+                self._pages.move_to_end(a1)
+                return sign_page
+            await self._evict(a1, sign_page)
+
+        task = self._pending.get(a1)
+        if task is None:
+            task = asyncio.ensure_future(self._create_page(a1))
+            self._pending[a1] = task
+            task.add_done_callback(lambda _: self._pending.pop(a1, None))
+        return await asyncio.shield(task)
+
+    def _is_stale(self, sign_page):
+        return time.monotonic() - sign_page.created_at > self.page_ttl or sign_page.page.is_closed()
+
+    async def _is_healthy(self, sign_page):
+        now = time.monotonic()
+        if now - sign_page.last_checked < self.health_check_interval:
+            return True
+        try:
+            healthy = await sign_page.page.evaluate("typeof window._webmsxyw === 'function'")
+        except Exception:
+            healthy = False
+        sign_page.last_checked = now
+        return healthy
+
+    async def _create_page(self, a1):
+        await self.start()
+        context = await self._browser.new_context(user_agent=SIGN_USER_AGENT)
+        try:
+            # 检查 stealth.min.js 文件是否存在
+            try:
+                await context.add_init_script(script=get_stealth_script())
+            except FileNotFoundError as e:
+                xhs_logger.warning(f"stealth.min.js not found: {e}")
+
+            page = await context.new_page()
+            page.set_default_timeout(30000)  # 30秒超时
+            try:
+                await page.goto(XHS_HOME_URL, wait_until='networkidle')
+            except Exception as e:
+                xhs_logger.warning(f"Page load warning: {e}")
+                await page.goto(XHS_HOME_URL)
+
+            await context.add_cookies([
+                {'name': 'a1', 'value': a1, 'domain': ".xiaohongshu.com", 'path': "/"}]
+            )
+            await page.reload(wait_until='networkidle')
+            # 等待签名函数就绪，而不是固定 sleep
+            await page.wait_for_function("typeof window._webmsxyw === 'function'", timeout=15000)
+        except Exception:
+            await context.close()
+            raise
+
+        sign_page = SignPage(a1, context, page)
+        self._pages[a1] = sign_page
+        while len(self._pages) > self.max_pages:
+            _, oldest = self._pages.popitem(last=False)
+            await self._close_page(oldest)
+        xhs_logger.info(f"[+] 签名页面已就绪, 当前页面数: {len(self._pages)}")
+        return sign_page
+
+    async def _evict(self, a1, sign_page):
+        if self._pages.get(a1) is sign_page:
+            del self._pages[a1]
+        await self._close_page(sign_page)
+
+    @staticmethod
+    async def _close_page(sign_page):
+        try:
+            await sign_page.context.close()
+        except Exception:
+            pass
+
+
+_background_loop = None
+_background_pool = None
+_background_lock = threading.Lock()
+
+
+def _shutdown_background_pool():
+    if _background_loop is None:
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(_background_pool.close(), _background_loop).result(10)
+    except Exception:
+        pass
+    _background_loop.call_soon_threadsafe(_background_loop.stop)
+
+
+def get_background_sign_pool():
+    """
+    返回运行在后台线程事件循环中的进程级签名池，供同步的 XhsClient sign 回调使用
+    """
+    global _background_loop, _background_pool
+    with _background_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name="xhs-sign-pool", daemon=True)
+            thread.start()
+            _background_loop = loop
+            _background_pool = SignPagePool()
+            atexit.register(_shutdown_background_pool)
+    return _background_loop, _background_pool
+
+
+def sign_with_pool(uri, data=None, a1="", web_session="", timeout=90):
+    loop, pool = get_background_sign_pool()
+    future = asyncio.run_coroutine_threadsafe(pool.sign(uri, data, a1, web_session), loop)
+    return future.result(timeout)
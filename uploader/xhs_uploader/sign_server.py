@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+小红书签名服务，供 uploader.xhs_uploader.main.sign 使用
+
+启动方式（在项目根目录）：
+    python -m uploader.xhs_uploader.sign_server --port 11901
+
+接口：
+    POST /sign        {"uri": "...", "data": {...}, "a1": "...", "web_session": "..."}
+    POST /sign/batch  {"items": [{"uri": ..., "data": ..., "a1": ...}, ...]}
+    GET  /health
+"""
+import argparse
+import asyncio
+from urllib.parse import urlparse
+
+from aiohttp import web
+
+from conf import XHS_SERVER
+from uploader.xhs_uploader.sign_pool import SignPagePool
+from utils.log import xhs_logger
+
+SIGN_POOL_KEY = "sign_pool"
+MAX_BATCH_SIZE = 100
+
+
+async def _sign_item(pool: SignPagePool, item: dict) -> dict:
+    return await pool.sign(item["uri"], item.get("data"), item.get("a1", ""), item.get("web_session", ""))
+
+
+async def handle_sign(request: web.Request) -> web.Response:
+    try:
+        item = await request.json()
+    except ValueError:
+        return web.json_response({"error": "invalid json"}, status=400)
+    if not item.get("uri"):
+        return web.json_response({"error": "uri is required"}, status=400)
+    try:
+        return web.json_response(await _sign_item(request.app[SIGN_POOL_KEY], item))
+    except Exception as e:
+        xhs_logger.error(f"[-] 签名失败: {e}")
+        return web.json_response({"error": str(e)}, status=500)
+
+
+async def handle_sign_batch(request: web.Request) -> web.Response:
+    try:
+        body = await request.json()
+    except ValueError:
+        return web.json_response({"error": "invalid json"}, status=400)
+    items = body.get("items") if isinstance(body, dict) else body
+    if not isinstance(items, list):
+        return web.json_response({"error": "items must be a list"}, status=400)
+    if len(items) > MAX_BATCH_SIZE:
+        return web.json_response({"error": f"batch size exceeds {MAX_BATCH_SIZE}"}, status=400)
+
+    pool = request.app[SIGN_POOL_KEY]
+    outcomes = await asyncio.gather(*[_sign_item(pool, item) for item in items], return_exceptions=True)
+    results = []
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            results.append({"error": str(outcome)})
+        else:
+            results.append(outcome)
+    return web.json_response({"results": results})
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok"})
+
+
+def create_app(pool: SignPagePool = None) -> web.Application:
+    app = web.Application()
+    app[SIGN_POOL_KEY] = pool or SignPagePool()
+
+    async def on_startup(app):
+        # 提前启动浏览器，第一个签名请求不用再等待
+        await app[SIGN_POOL_KEY].start()
+
+    async def on_cleanup(app):
+        await app[SIGN_POOL_KEY].close()
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    app.router.add_post("/sign", handle_sign)
+    app.router.add_post("/sign/batch", handle_sign_batch)
+    app.router.add_get("/health", handle_health)
+    return app
+
+
+def main():
+    default = urlparse(XHS_SERVER)
+    parser = argparse.ArgumentParser(description="小红书签名服务")
+    parser.add_argument("--host", default=default.hostname or "127.0.0.1")
+    parser.add_argument("--port", type=int, default=default.port or 11901)
+    parser.add_argument("--max_pages", type=int, default=None, help="最多常驻的签名页面数")
+    args = parser.parse_args()
+
+    pool = SignPagePool(max_pages=args.max_pages) if args.max_pages else SignPagePool()
+    web.run_app(create_app(pool), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+小红书话题缓存：标签 -> get_suggest_topic 返回的第一个话题对象
+
+常用的标签就那么几百个，缓存命中时不再请求接口，也不用在两次请求之间 sleep。
+查不到话题的标签也会缓存（负缓存），有效期更短。
+
+预热整个视频目录的标签：
+    python -m uploader.xhs_uploader.topic_cache prewarm videos --account account1
+"""
+import argparse
+import configparser
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+
+from xhs import XhsClient
+from xhs.exception import IPBlockError, NeedVerifyError
+
+from conf import (BASE_DIR, DB_DIR, XHS_TOPIC_BURST, XHS_TOPIC_CACHE_SIZE, XHS_TOPIC_CACHE_TTL, XHS_TOPIC_CONCURRENCY,
+                  XHS_TOPIC_NEGATIVE_TTL)
+from utils.library_index import library_index
+from utils.log import xhs_logger
+from utils.rate_limit import TokenBucket
+from utils.sqlite_db import open_db
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS topics (
+    tag TEXT PRIMARY KEY,
+    topic TEXT,
+    fetched_at REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_topics_last_used ON topics (last_used);
+"""
+
+# lookup 未命中时的返回值，和"缓存了查不到话题"（None）区分开
+MISS = object()
+
+# 被限流后最多重试的次数
+RATE_LIMIT_RETRIES = 3
+
+
+def is_rate_limited(error) -> bool:
+    if isinstance(error, (IPBlockError, NeedVerifyError)):
+        return True
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) in (429, 461, 471)
+
+
+def get_topic_bucket(xhs_client, tag_delay):
+    """
+    同一账号（按 cookie 中的 a1 区分）的话题查询共用一个令牌桶，多个进程同时上传也一起限速
+
+    平均每 tag_delay 秒一次请求，允许 XHS_TOPIC_BURST 次突发；tag_delay <= 0 时不限速
+    """
+    if tag_delay <= 0:
+        return None
+    cookie_dict = getattr(xhs_client, "cookie_dict", {}) or {}
+    return TokenBucket(f"xhs_topic:{cookie_dict.get('a1', '')}", rate=1 / tag_delay, capacity=XHS_TOPIC_BURST)
+
+
+class TopicCache(object):
+    """
+    标签到话题的缓存，保存在 db/xhs_topics.db 中，同时运行的上传进程共享查询结果
+
+    - 命中的条目超过 ttl 秒后重新请求；查不到话题的条目超过 negative_ttl 秒后重新请求
+    - 条目数超过 max_entries 时按最近使用时间淘汰（LRU）
+    - 请求出错不缓存，下次继续请求
+    """
+
+    def __init__(self, db_path=None, ttl=XHS_TOPIC_CACHE_TTL, negative_ttl=XHS_TOPIC_NEGATIVE_TTL,
+                 max_entries=XHS_TOPIC_CACHE_SIZE):
+        self.db_path = Path(db_path or DB_DIR / "xhs_topics.db")
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+
+    def _connect(self):
+        return open_db(self.db_path, SCHEMA)
+
+    @staticmethod
+    def _as_topic(topic_json):
+        if topic_json is None:
+            return None
+        topic = json.loads(topic_json)
+        topic['type'] = 'topic'
+        return topic
+
+    def lookup(self, tag):
+        """返回缓存的话题对象；缓存了"没有话题"时返回 None；未命中或已过期返回 MISS"""
+        now = time.time()
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT topic, fetched_at FROM topics WHERE tag = ?", (tag,)).fetchone()
+            if row is None:
+                return MISS
+            topic_json, fetched_at = row
+            if now - fetched_at > (self.ttl if topic_json is not None else self.negative_ttl):
+                return MISS
+            conn.execute("UPDATE topics SET last_used = ? WHERE tag = ?", (now, tag))
+        return self._as_topic(topic_json)
+
+    def store(self, tag, topic):
+        now = time.time()
+        topic_json = json.dumps(topic, ensure_ascii=False) if topic is not None else None
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT OR REPLACE INTO topics (tag, topic, fetched_at, last_used) VALUES (?, ?, ?, ?)",
+                         (tag, topic_json, now, now))
+            conn.execute("DELETE FROM topics WHERE tag IN (SELECT tag FROM topics ORDER BY last_used DESC "
+                         "LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def fetch(self, xhs_client, tag):
+        """请求接口并写入缓存，接口异常直接抛出"""
+        topic_official = xhs_client.get_suggest_topic(tag)
+        topic = topic_official[0] if topic_official else None
+        self.store(tag, topic)
+        return dict(topic, type='topic') if topic is not None else None
+
+    def fetch_limited(self, xhs_client, tag, bucket=None):
+        """按令牌桶限速请求接口，被限流时降低整个账号的速率并重试"""
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            if bucket is not None:
+                bucket.consume(1)
+            try:
+                topic = self.fetch(xhs_client, tag)
+            except Exception as e:
+                if bucket is None or not is_rate_limited(e) or attempt == RATE_LIMIT_RETRIES:
+                    raise
+                xhs_logger.warning(f"获取话题 {tag} 被限流，降低请求速率后重试: {e}")
+                bucket.penalize()
+                continue
+            if bucket is not None:
+                bucket.recover()
+            return topic
+
+    def resolve_all(self, xhs_client, tags, tag_delay=1.0, concurrency=XHS_TOPIC_CONCURRENCY):
+        """
+        解析多个标签，未命中缓存的标签并发请求，速率由账号共享的令牌桶控制
+
+        Returns:
+            {tag: (话题对象或 None, 是否请求了接口, 异常或 None)}
+        """
+        results = {}
+        missing = []
+        for tag in dict.fromkeys(tags):
+            topic = self.lookup(tag)
+            if topic is MISS:
+                missing.append(tag)
+            else:
+                results[tag] = (topic, False, None)
+        if not missing:
+            return results
+
+        bucket = get_topic_bucket(xhs_client, tag_delay)
+
+        def fetch_one(tag):
+            try:
+                return tag, (self.fetch_limited(xhs_client, tag, bucket), True, None)
+            except Exception as e:
+                return tag, (None, True, e)
+
+        with ThreadPoolExecutor(max(1, min(concurrency, len(missing)))) as executor:
+            results.update(executor.map(fetch_one, missing))
+        return results
+
+    def resolve_many(self, xhs_client, tags, tag_delay=1.0, concurrency=XHS_TOPIC_CONCURRENCY):
+        """
+        Returns:
+            (话题对象列表, 话题名称列表)，顺序与 tags 一致，查询失败的标签会被跳过
+        """
+        results = self.resolve_all(xhs_client, tags, tag_delay, concurrency)
+        topics = []
+        for tag in dict.fromkeys(tags):
+            topic, _, error = results[tag]
+            if error is not None:
+                xhs_logger.warning(f"获取话题 {tag} 失败: {error}")
+            if topic is not None:
+                topics.append(topic)
+        return topics, [topic['name'] for topic in topics]
+
+    def stats(self):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            total, negative = conn.execute("SELECT COUNT(*), COUNT(*) - COUNT(topic) FROM topics").fetchone()
+            expired = conn.execute(
+                "SELECT COUNT(*) FROM topics WHERE (topic IS NOT NULL AND fetched_at < ?) "
+                "OR (topic IS NULL AND fetched_at < ?)", (now - self.ttl, now - self.negative_ttl)).fetchone()[0]
+        return {"total": total, "negative": negative, "expired": expired}
+
+
+def collect_library_tags(folder):
+    """从视频库索引读取目录下每个视频的 hashtag（来自同名 txt 或清单文件）"""
+    library_index.update(folder)
+    tags = []
+    for entry in library_index.entries(folder):
+        tags.extend(tag for tag in entry.tags if tag)
+    # 去重并保持顺序
+    return list(dict.fromkeys(tags))
+
+
+def prewarm(xhs_client, tags, tag_delay=1.0, cache=None):
+    """提前解析所有未缓存（或已过期）的标签，返回实际请求接口的次数"""
+    cache = cache or topic_cache
+    results = cache.resolve_all(xhs_client, tags, tag_delay)
+    requested = 0
+    for tag, (topic, fetched, error) in results.items():
+        if not fetched:
+            continue
+        requested += 1
+        if error is not None:
+            xhs_logger.warning(f"获取话题 {tag} 失败: {error}")
+        else:
+            xhs_logger.info(f"{tag} -> {topic['name'] if topic else '无匹配话题'}")
+    xhs_logger.info(f"共 {len(results)} 个标签，请求了 {requested} 个")
+    return requested
+
+
+topic_cache = TopicCache()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="小红书话题缓存")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    prewarm_parser = subparsers.add_parser("prewarm", help="预先解析视频目录中所有视频的标签")
+    prewarm_parser.add_argument("folder", nargs="?", default=str(Path(BASE_DIR / "videos")))
+    prewarm_parser.add_argument("--account", default="account1", help="accounts.ini 中的账号名")
+    prewarm_parser.add_argument("--tag_delay", type=float, default=1.0, help="两次请求之间的间隔（秒）")
+    subparsers.add_parser("stats", help="查看缓存条目数")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        print(topic_cache.stats())
+        return
+
+    from uploader.xhs_uploader.main import sign_local
+    config = configparser.RawConfigParser()
+    config.read(Path(BASE_DIR / "uploader" / "xhs_uploader" / "accounts.ini"))
+    xhs_client = XhsClient(config[args.account]['cookies'], sign=sign_local, timeout=60)
+    prewarm(xhs_client, collect_library_tags(args.folder), args.tag_delay)
+    print(topic_cache.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
+import os
+from functools import lru_cache
 from pathlib import Path
 from typing import List
 
-from conf import BASE_DIR
+from conf import BASE_DIR, LOCAL_CHROME_PATH
 
 SOCIAL_MEDIA_DOUYIN = "douyin"
 SOCIAL_MEDIA_TENCENT = "tencent"
@@ -18,7 +20,21 @@ def get_cli_action() -> List[str]:
     return ["upload", "login", "watch"]
 
 
-async def set_init_script(context):
+def get_local_executable_path():
+    # 本机装有 conf.LOCAL_CHROME_PATH 指定的 Chrome 时使用它，否则使用 playwright 自带的 Chromium
+    if LOCAL_CHROME_PATH and os.path.exists(LOCAL_CHROME_PATH):
+        return LOCAL_CHROME_PATH
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_stealth_script() -> str:
+    # stealth.min.js 只读取一次，之后每个 context 直接注入内存中的内容
     stealth_js_path = Path(BASE_DIR / "utils/stealth.min.js")
-    await context.add_init_script(path=stealth_js_path)
+    return stealth_js_path.read_text(encoding="utf-8")
+
+
+async def set_init_script(context):
+    await context.add_init_script(script=get_stealth_script())
     return context
+
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import threading
+
+from loguru import logger
+from playwright.async_api import async_playwright
+
+from utils.base_social_media import set_init_script
+
+
+class BrowserPool(object):
+    """
+    进程级共享的 Playwright 驱动和浏览器池
+
+    所有上传器和 cookie_auth 都从这里获取浏览器，按启动参数（浏览器类型、是否无头、
+    可执行文件路径、代理、启动参数）复用同一个浏览器进程，每个任务使用独立的 context 互相隔离。
+    """
+
+    def __init__(self):
+        self._playwright = None
+        self._browsers = {}
+        self._loop = None
+        self._lock = None
+        # 统一覆盖启动参数，例如基准测试时强制 {"headless": True, "executable_path": None}
+        self.launch_overrides = {}
+        # 每个新 context 创建后都会调用 await hook(context)，例如把请求路由到本地的模拟站点
+        self._context_hooks = []
+        # 切换事件循环时没能关闭的 (驱动, 浏览器列表)
+        self._orphaned = []
+
+    def add_context_hook(self, hook):
+        self._context_hooks.append(hook)
+
+    def remove_context_hook(self, hook):
+        if hook in self._context_hooks:
+            self._context_hooks.remove(hook)
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 事件循环变了（例如多次调用 asyncio.run），旧循环里的驱动和浏览器已无法使用
+            if self._playwright is not None or self._browsers:
+                self._release_old_loop()
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._playwright = None
+            self._browsers = {}
+
+    def _release_old_loop(self):
+        """关闭旧事件循环里的浏览器和驱动；旧循环已经关闭时无法再关闭，记录下来并提示调用方"""
+        old_loop, playwright, browsers = self._loop, self._playwright, list(self._browsers.values())
+        if old_loop is not None and not old_loop.is_closed() and not old_loop.is_running():
+            # 旧循环还能运行，在另一个线程里用它关闭（当前线程的循环正在运行）
+            thread = threading.Thread(target=old_loop.run_until_complete,
+                                      args=(self._close_all(playwright, browsers),), daemon=True)
+            thread.start()
+            thread.join(timeout=30)
+            if not thread.is_alive():
+                return
+        self._orphaned.append((playwright, browsers))
+        logger.warning(f"事件循环已切换，旧循环中的 {len(browsers)} 个浏览器和 Playwright 驱动无法关闭，"
+                       f"请在 asyncio.run 结束前调用 browser_pool.close()（累计 {len(self._orphaned)} 组）")
+
+    @staticmethod
+    async def _close_all(playwright, browsers):
+        for browser in browsers:
+            try:
+                await browser.close()
+            except Exception:
+                pass
+        if playwright is not None:
+            await playwright.stop()
+
+    async def get_browser(self, browser_type="chromium", headless=True, executable_path=None, proxy=None, args=None):
+        self._bind_loop()
+        headless = self.launch_overrides.get("headless", headless)
+        executable_path = self.launch_overrides.get("executable_path", executable_path)
+        key = (browser_type, headless, executable_path, json.dumps(proxy, sort_keys=True), tuple(args or ()))
+        async with self._lock:
+            if self._playwright is None:
+                self._playwright = await async_playwright().start()
+            browser = self._browsers.get(key)
+            if browser is None or not browser.is_connected():
+                options = {'headless': headless}
+                if executable_path:
+                    options['executable_path'] = executable_path
+                if proxy:
+                    options['proxy'] = proxy
+                if args:
+                    options['args'] = list(args)
+                browser = await getattr(self._playwright, browser_type).launch(**options)
+                self._browsers[key] = browser
+        return browser
+
+    async def new_context(self, browser_type="chromium", headless=True, executable_path=None, proxy=None, args=None,
+                          stealth=True, **context_options):
+        """
+        从共享浏览器创建一个新的 context，context_options 会原样传给 browser.new_context
+        使用完后调用方需要自行 context.close()，浏览器本身保持常驻
+        """
+        browser = await self.get_browser(browser_type, headless, executable_path, proxy, args)
+        context = await browser.new_context(**context_options)
+        if stealth:
+            context = await set_init_script(context)
+        for hook in self._context_hooks:
+            await hook(context)
+        return context
+
+    async def close(self):
+        if self._lock is None:
+            return
+        self._bind_loop()
+        async with self._lock:
+            await self._close_all(self._playwright, list(self._browsers.values()))
+            self._browsers = {}
+            self._playwright = None
+
+
+browser_pool = BrowserPool()
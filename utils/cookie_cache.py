@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from conf import BASE_DIR, COOKIE_CACHE_TTL
+
+COOKIE_CACHE_FILE = Path(BASE_DIR / "cookies" / "cookie_validity.json")
+
+
+def get_cookie_expiry(account_file, cookie_names=None):
+    """
+    读取 storage_state JSON 中 cookie 的最早过期时间
+
+    Args:
+        account_file: playwright storage_state 文件
+        cookie_names: 只统计这些登录态 cookie，为空或都不存在时统计所有持久 cookie
+
+    Returns:
+        最早的过期时间戳（秒），只有会话 cookie 时返回 None
+    """
+    with open(account_file, "r", encoding="utf-8") as f:
+        cookies = json.load(f).get("cookies", [])
+    # expires 为 -1 的是会话 cookie，不参与计算
+    persistent = [c for c in cookies if c.get("expires", -1) > 0]
+    if cookie_names:
+        named = [c for c in persistent if c["name"] in cookie_names]
+        persistent = named or persistent
+    if not persistent:
+        return None
+    return min(c["expires"] for c in persistent)
+
+
+class CookieValidityCache(object):
+    """
+    按 account_file 缓存 cookie 校验结果，避免每次上传前都打开无头浏览器检查登录态
+
+    缓存在以下情况下失效：
+    - 距离上次校验超过 ttl 秒
+    - storage_state 中的登录 cookie 已经过期
+    - 上传时遇到登录墙，调用 invalidate
+    """
+
+    def __init__(self, cache_file=COOKIE_CACHE_FILE, ttl=COOKIE_CACHE_TTL):
+        self.cache_file = Path(cache_file)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(account_file):
+        return os.path.abspath(str(account_file))
+
+    def _load(self):
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, entries):
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.cache_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, self.cache_file)
+
+    def is_valid(self, account_file, cookie_names=None) -> bool:
+        if not os.path.exists(account_file):
+            return False
+        with self._lock:
+            entry = self._load().get(self._key(account_file))
+        if not entry:
+            return False
+        now = time.time()
+        if now - entry["validated_at"] > self.ttl:
+            return False
+        try:
+            expiry = get_cookie_expiry(account_file, cookie_names)
+        except (OSError, ValueError, KeyError):
+            return False
+        return expiry is None or expiry > now
+
+    def mark_valid(self, account_file):
+        with self._lock:
+            entries = self._load()
+            entries[self._key(account_file)] = {"validated_at": time.time()}
+            self._save(entries)
+
+    def invalidate(self, account_file):
+        with self._lock:
+            entries = self._load()
+            if entries.pop(self._key(account_file), None) is not None:
+                self._save(entries)
+
+    async def check(self, account_file, auth_func, cookie_names=None) -> bool:
+        """
+        先查缓存，缓存未命中时再调用 auth_func(account_file) 用浏览器校验，并记录结果
+        """
+        if self.is_valid(account_file, cookie_names):
+            return True
+        if await auth_func(account_file):
+            self.mark_valid(account_file)
+            return True
+        self.invalidate(account_file)
+        return False
+
+
+cookie_cache = CookieValidityCache()
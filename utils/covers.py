@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""
+封面生成：把封面图（或视频中的一帧）裁剪、缩放成各平台要求的比例和尺寸，并压缩到大小上限以内
+
+- 视频旁边有同名 .png/.jpg 时用它作为封面原图，否则按 conf.COVER_PROFILES 中的 auto 决定是否从视频截取一帧，
+  截取哪一帧由 utils/frame_scorer.py 打分选出，同一个视频只解码一次，为所有平台的封面宽高比一起打分
+- 在进程池中用 ffmpeg 处理，结果按 (原图或视频的内容哈希, 平台配置) 保存在 db/cache/covers 中
+- 批量上传时先为所有视频提交任务，上传器拿到的就是处理好的封面：
+
+    cover_pipeline.prepare(file, "tiktok", find_sidecar(file))
+    ...
+    cover = await cover_pipeline.prepare_async(file, "tiktok", find_sidecar(file))
+
+没有安装 ffmpeg 时直接使用原图（没有原图时不设置封面）。
+"""
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+from loguru import logger
+
+from conf import COVER_CACHE_MAX_BYTES, COVER_PROFILES, COVER_WORKERS, DB_DIR, TRANSCODE_FFMPEG
+from utils.frame_scorer import best_frame_times
+from utils.media_probe import MediaProbeError, parse_mp4
+from utils.publish_ledger import publish_ledger
+from utils.transcode import prune_cache_dir
+
+COVER_CACHE_DIR = Path(DB_DIR / "cache" / "covers")
+SIDECAR_SUFFIXES = (".png", ".jpg", ".jpeg", ".webp")
+
+# 保留打分结果的视频数
+FRAME_TIMES_MEMO_SIZE = 64
+
+# JPEG 质量（ffmpeg -q:v，越大压缩越多），依次尝试直到文件不超过大小上限
+JPEG_QUALITIES = (2, 4, 6, 9, 12, 16, 20, 25, 31)
+
+
+def get_profile(platform=None) -> dict:
+    profile = dict(COVER_PROFILES.get("default", {}))
+    profile.update(COVER_PROFILES.get(platform, {}))
+    return profile
+
+
+def find_sidecar(video_file):
+    """视频旁边的同名封面图，没有时返回 None"""
+    for suffix in SIDECAR_SUFFIXES:
+        sidecar = Path(video_file).with_suffix(suffix)
+        if sidecar.exists():
+            return sidecar
+    return None
+
+
+def frame_aspects() -> list:
+    """所有平台封面的宽高比"""
+    profiles = [get_profile(platform) for platform in COVER_PROFILES]
+    return sorted({profile["width"] / profile["height"] for profile in profiles})
+
+
+def pick_frame_times(video_file, count, width, ffmpeg=TRANSCODE_FFMPEG) -> dict:
+    """
+    一次解码，为所有平台的封面宽高比选出得分最高的帧
+
+    Returns:
+        {宽高比: 时间（秒）}，打分失败时返回空字典
+    """
+    try:
+        return best_frame_times(video_file, frame_aspects(), count, width, ffmpeg)
+    except (MediaProbeError, subprocess.CalledProcessError) as e:
+        logger.warning(f"{video_file} 封面帧打分失败，使用固定位置: {e}")
+        return {}
+
+
+def pick_frame_time(video_file, profile, frame_times=None) -> float:
+    """从视频截取封面时使用的时间点（秒）：按封面宽高比打分选出的帧，没有打分结果时使用 frame_at 处"""
+    aspect = profile["width"] / profile["height"]
+    if frame_times and aspect in frame_times:
+        return frame_times[aspect]
+    try:
+        duration = parse_mp4(video_file).duration or 0
+    except MediaProbeError:
+        duration = 0
+    return duration * profile.get("frame_at", 0.1)
+
+
+def _stat_key(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _run(command):
+    subprocess.run(command, check=True, stdin=subprocess.DEVNULL, capture_output=True)
+
+
+def cover_output(video_file, source, profile, cache_dir) -> Path:
+    """封面在缓存目录中的路径"""
+    profile_key = hashlib.sha1(json.dumps(profile, sort_keys=True).encode()).hexdigest()[:8]
+    content_hash = publish_ledger.content_hash(source or video_file)
+    return Path(cache_dir) / f"{content_hash}-{'image' if source else 'frame'}-{profile_key}.jpg"
+
+
+def make_cover(video_file, source, profile, cache_dir, ffmpeg, frame_times=None) -> str:
+    """
+    在进程池中执行：生成封面并返回缓存中的路径
+
+    frame_times 为 pick_frame_times 的结果，从视频截取封面时使用。
+
+    Raises:
+        subprocess.CalledProcessError: ffmpeg 处理失败
+    """
+    width, height = profile["width"], profile["height"]
+    origin = source or video_file
+    output = cover_output(video_file, source, profile, cache_dir)
+    if output.exists():
+        os.utime(output)
+        return str(output)
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    frame_file = output.with_suffix(f".{os.getpid()}.tmp.png")
+    tmp_file = output.with_suffix(f".{os.getpid()}.tmp.jpg")
+    # 先放大到能覆盖目标尺寸，再居中裁剪成目标比例
+    scale_crop = f"scale={width}:{height}:force_original_aspect_ratio=increase,crop={width}:{height}"
+    try:
+        command = [ffmpeg, "-y", "-v", "error"]
+        if source is None:
+            command += ["-ss", f"{pick_frame_time(video_file, profile, frame_times):.3f}"]
+        _run(command + ["-i", str(origin), "-frames:v", "1", "-vf", scale_crop, str(frame_file)])
+        for quality in JPEG_QUALITIES:
+            _run([ffmpeg, "-y", "-v", "error", "-i", str(frame_file), "-q:v", str(quality), str(tmp_file)])
+            if tmp_file.stat().st_size <= profile["max_bytes"]:
+                break
+        os.replace(tmp_file, output)
+    finally:
+        for file in (frame_file, tmp_file):
+            if file.exists():
+                file.unlink()
+    return str(output)
+
+
+class CoverPipeline(object):
+    """
+    在进程池中生成各平台的封面，同一个 (视频, 平台, 原图) 生成完成之前只提交一次
+
+    生成失败时记录日志并回退为原图。
+    """
+
+    def __init__(self, cache_dir=COVER_CACHE_DIR, workers=COVER_WORKERS, ffmpeg=TRANSCODE_FFMPEG,
+                 cache_max_bytes=COVER_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.workers = workers or os.cpu_count() or 1
+        self.ffmpeg = ffmpeg
+        self.cache_max_bytes = cache_max_bytes
+        self._executor = None
+        # 从视频截取封面时在线程中等待打分结果，再把生成任务交给进程池
+        self._threads = None
+        self._futures = {}
+        self._frame_times = {}
+        # 任务已经完成时 _resolve 会在 prepare 持有锁的线程中直接调用
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _done(result):
+        future = Future()
+        future.set_result(result)
+        return future
+
+    def prepare(self, video_file, platform, source=None) -> Future:
+        """
+        提交封面生成任务
+
+        Returns:
+            结果为封面路径的 Future，不需要封面时结果为 None
+        """
+        source = str(source) if source else None
+        if source is not None and Path(source).resolve().parent == self.cache_dir.resolve():
+            # 已经是处理好的封面
+            return self._done(source)
+        profile = get_profile(platform)
+        if source is None and not profile.get("auto"):
+            return self._done(None)
+        if shutil.which(self.ffmpeg) is None:
+            return self._done(source)
+        path = os.path.abspath(str(video_file))
+        try:
+            # 视频或原图被替换后大小或修改时间会变化，不会拿到旧的封面
+            key = (path, platform, source) + _stat_key(path) + (_stat_key(source) if source else ())
+        except OSError:
+            return self._done(source)
+        with self._lock:
+            if key in self._futures:
+                return self._futures[key]
+            if self._executor is None:
+                # 线程中也会向进程池提交任务，fork 出的子进程可能继承其他线程持有的锁而卡住，所以用 spawn 启动
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+                self._threads = ThreadPoolExecutor(self.workers)
+            if source is None:
+                inner = self._threads.submit(self._make_frame_cover, self._executor, path, key[3:5], profile)
+            else:
+                inner = self._executor.submit(make_cover, path, source, profile, str(self.cache_dir), self.ffmpeg)
+            future = Future()
+            self._futures[key] = future
+            inner.add_done_callback(lambda done: self._resolve(key, future, done, video_file, platform, source))
+            return future
+
+    def _score_frames(self, executor, path, stat_key, profile) -> Future:
+        """
+        同一个视频只解码、打分一次，结果包含所有平台的封面宽高比
+
+        为多个平台生成封面的任务在不同的进程中执行，所以在这里合并，而不是在各个进程中缓存解码结果。
+        """
+        count, width = profile.get("sample_frames", 24), profile.get("sample_width", 240)
+        key = (path,) + stat_key + (count, width)
+        with self._lock:
+            future = self._frame_times.get(key)
+            if future is None:
+                future = executor.submit(pick_frame_times, path, count, width, self.ffmpeg)
+                self._frame_times[key] = future
+                # 结果只是几个时间点，保留最近的视频即可
+                while len(self._frame_times) > FRAME_TIMES_MEMO_SIZE:
+                    del self._frame_times[next(iter(self._frame_times))]
+            return future
+
+    def _make_frame_cover(self, executor, path, stat_key, profile) -> str:
+        frame_times = None
+        if not cover_output(path, None, profile, self.cache_dir).exists():
+            frame_times = self._score_frames(executor, path, stat_key, profile).result()
+        return executor.submit(make_cover, path, None, profile, str(self.cache_dir), self.ffmpeg,
+                               frame_times).result()
+
+    def _resolve(self, key, future, done, video_file, platform, source):
+        # 完成后移除，之后再 prepare 同一个封面时直接命中缓存目录
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+        try:
+            future.set_result(done.result())
+        except Exception as e:
+            stderr = getattr(e, "stderr", b"") or b""
+            logger.warning(f"{video_file} 生成 {platform} 封面失败，{'使用原图' if source else '不设置封面'}: {e} "
+                           f"{stderr.decode(errors='replace').strip()[-500:]}")
+            future.set_result(source)
+
+    async def prepare_async(self, video_file, platform, source=None):
+        return await asyncio.wrap_future(self.prepare(video_file, platform, source))
+
+    def close(self):
+        with self._lock:
+            threads, executor = self._threads, self._executor
+            self._threads = self._executor = None
+        # 线程中的任务还会向进程池提交，先等线程结束
+        if threads is not None:
+            threads.shutdown(wait=True)
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self._lock:
+            self._futures.clear()
+            self._frame_times.clear()
+        prune_cache_dir(self.cache_dir, self.cache_max_bytes)
+
+
+cover_pipeline = CoverPipeline()
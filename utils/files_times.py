@@ -30,14 +30,23 @@ def get_title_and_hashtags(filename):
     with open(txt_filename, "r", encoding="utf-8") as f:
         content = f.read()
 
+    return parse_title_and_hashtags(content)
+
+
+def parse_title_and_hashtags(content):
+    """txt 内容第一行为标题，第二行为空格分隔的 hashtag"""
     # 获取标题和 hashtag
     splite_str = content.strip().split("\n")
     title = splite_str[0]
-    hashtags = splite_str[1].replace("#", "").split(" ")
+    hashtags = parse_hashtags(splite_str[1])
 
     return title, hashtags
 
 
+def parse_hashtags(line):
+    return line.replace("#", "").split(" ")
+
+
 def generate_schedule_time_next_day(total_videos, videos_per_day, daily_times=None, timestamps=False, start_days=0):
     """
     Generate a schedule for video uploads, starting from the next day.
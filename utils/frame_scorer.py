@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+自动选择封面帧：没有封面图时，从视频中挑一帧清晰、曝光正常、色彩丰富的画面作为封面
+
+- ffmpeg 只解码关键帧（-skip_frame nokey），按间隔抽取最多 sample_frames 帧，缩小到 sample_width 宽，
+  以 rawvideo 一次性读入一个 (帧数, 高, 宽, 3) 的 NumPy 数组
+- 所有帧一起打分：清晰度（拉普拉斯方差）、曝光（平均亮度接近中间值、过暗过亮的像素少）、色彩丰富度（Hasler-Süsstrunk）
+- 按各平台封面的宽高比居中裁剪后分别打分，每个宽高比选出得分最高的帧
+
+    python -m utils.frame_scorer videos/demo.mp4 --aspect 3:4 --aspect 9:16
+"""
+import argparse
+import functools
+import re
+import subprocess
+
+import numpy as np
+
+from conf import COVER_SCORE_WEIGHTS, TRANSCODE_FFMPEG
+from utils.media_probe import MediaProbeError, parse_mp4
+
+# 片头片尾常是黑屏或字幕，只在这个区间内取帧
+SAMPLE_RANGE = (0.05, 0.95)
+
+PTS_TIME_RE = re.compile(r"pts_time:\s*(-?[\d.]+)")
+FFMPEG_VERSION_RE = re.compile(r"ffmpeg version n?(\d+)\.(\d+)")
+
+
+@functools.lru_cache(maxsize=None)
+def ffmpeg_version(ffmpeg=TRANSCODE_FFMPEG):
+    """返回 (主版本, 次版本)；git 快照等无法识别版本号的构建返回 None"""
+    try:
+        result = subprocess.run([ffmpeg, "-version"], stdin=subprocess.DEVNULL, capture_output=True)
+    except OSError:
+        return None
+    match = FFMPEG_VERSION_RE.search(result.stdout.decode(errors="replace"))
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def passthrough_args(ffmpeg=TRANSCODE_FFMPEG) -> list:
+    """按时间戳原样输出选中的帧，不补帧也不丢帧；-fps_mode 从 ffmpeg 5.1 开始才有，之前的版本使用 -vsync 0"""
+    version = ffmpeg_version(ffmpeg)
+    if version is not None and version < (5, 1):
+        return ["-vsync", "0"]
+    return ["-fps_mode", "passthrough"]
+
+
+def read_keyframes(video_file, count, width, height=None, pix_fmt="rgb24", ffmpeg=TRANSCODE_FFMPEG):
+    """
+    只解码关键帧，在 SAMPLE_RANGE 区间内按间隔抽取最多 count 帧，缩放到 width x height
+
+    height 为 None 时按视频显示宽高比计算；pix_fmt 为 rgb24 或 gray。
+
+    Returns:
+        (frames, times)：uint8 数组 (帧数, 高, 宽, 通道数) 和每帧在视频中的时间（秒）
+    """
+    info = parse_mp4(video_file)
+    display_width, display_height = info.display_size
+    if not info.duration or not display_width or not display_height:
+        raise MediaProbeError(f"{video_file} 缺少时长或分辨率")
+    if height is None:
+        height = max(2, round(width * display_height / display_width / 2) * 2)
+    channels = {"rgb24": 3, "gray": 1}[pix_fmt]
+    start = info.duration * SAMPLE_RANGE[0]
+    span = info.duration * (SAMPLE_RANGE[1] - SAMPLE_RANGE[0])
+    interval = span / count
+    # select 在缩放之前，只有被选中的关键帧才会缩放；showinfo 把每帧的时间打印到 stderr
+    select = f"select='isnan(prev_selected_t)+gte(t-prev_selected_t\\,{interval:.3f})'"
+    command = [ffmpeg, "-hide_banner", "-nostats", "-v", "info", "-skip_frame", "nokey",
+               "-ss", f"{start:.3f}", "-t", f"{span:.3f}", "-i", str(video_file),
+               "-an", "-sn", "-vf", f"{select},scale={width}:{height}:flags=area,showinfo", *passthrough_args(ffmpeg),
+               "-frames:v", str(count), "-f", "rawvideo", "-pix_fmt", pix_fmt, "pipe:"]
+    result = subprocess.run(command, check=True, stdin=subprocess.DEVNULL, capture_output=True)
+    times = [float(t) for t in PTS_TIME_RE.findall(result.stderr.decode(errors="replace"))]
+    frame_bytes = width * height * channels
+    n = min(len(result.stdout) // frame_bytes, len(times))
+    frames = np.frombuffer(result.stdout, dtype=np.uint8, count=n * frame_bytes).reshape(n, height, width, channels)
+    # -ss 放在输入前时输出时间从 0 开始，加回起始时间
+    return frames, np.asarray(times[:n]) + start
+
+
+def decode_frames(video_file, count=24, width=240, ffmpeg=TRANSCODE_FFMPEG):
+    """
+    抽取缩小后的关键帧
+
+    Returns:
+        (frames, times)：uint8 数组 (帧数, 高, 宽, 3) 和每帧在视频中的时间（秒）
+
+    Raises:
+        MediaProbeError: 无法读取视频时长或分辨率
+        subprocess.CalledProcessError: ffmpeg 解码失败
+    """
+    return read_keyframes(video_file, count, width, ffmpeg=ffmpeg)
+
+
+def crop_to_aspect(frames, aspect):
+    """按宽高比（宽 / 高）居中裁剪，与封面生成时的裁剪方式一致"""
+    height, width = frames.shape[1:3]
+    if width / height > aspect:
+        crop = max(1, round(height * aspect))
+        left = (width - crop) // 2
+        return frames[:, :, left:left + crop]
+    crop = max(1, round(width / aspect))
+    top = (height - crop) // 2
+    return frames[:, top:top + crop]
+
+
+def score_frames(frames, weights=None) -> np.ndarray:
+    """为每一帧打分，返回 shape 为 (帧数,) 的数组，分数越高越适合做封面"""
+    weights = weights or COVER_SCORE_WEIGHTS
+    rgb = frames.astype(np.float32)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    gray = 0.299 * r + 0.587 * g + 0.114 * b
+
+    # 4 邻域拉普拉斯算子，方差越大边缘越多、越清晰
+    laplacian = (gray[:, 1:-1, :-2] + gray[:, 1:-1, 2:] + gray[:, :-2, 1:-1] + gray[:, 2:, 1:-1]
+                 - 4 * gray[:, 1:-1, 1:-1])
+    sharpness = laplacian.reshape(len(frames), -1).var(axis=1)
+
+    flat = gray.reshape(len(frames), -1)
+    clipped = ((flat < 16) | (flat > 239)).mean(axis=1)
+    exposure = (1 - np.abs(flat.mean(axis=1) - 128) / 128) * (1 - clipped)
+
+    rg = (r - g).reshape(len(frames), -1)
+    yb = (0.5 * (r + g) - b).reshape(len(frames), -1)
+    colorfulness = (np.sqrt(rg.var(axis=1) + yb.var(axis=1))
+                    + 0.3 * np.sqrt(rg.mean(axis=1) ** 2 + yb.mean(axis=1) ** 2))
+
+    def normalize(values):
+        peak = values.max()
+        return values / peak if peak > 0 else values
+
+    # 清晰度和色彩没有固定范围，按本视频中的最大值归一化；曝光本身在 0 ~ 1 之间
+    return (weights.get("sharpness", 0) * normalize(sharpness)
+            + weights.get("exposure", 0) * exposure
+            + weights.get("colorfulness", 0) * normalize(colorfulness))
+
+
+def best_frame_times(video_file, aspects, count=24, width=240, ffmpeg=TRANSCODE_FFMPEG) -> dict:
+    """
+    为每个宽高比选出得分最高的帧，视频只解码一次，需要多个宽高比时一起传入
+
+    Returns:
+        {宽高比: 时间（秒）}，没有解码出任何帧时返回空字典
+    """
+    frames, times = decode_frames(video_file, count, width, ffmpeg)
+    if not len(frames):
+        return {}
+    return {aspect: float(times[int(np.argmax(score_frames(crop_to_aspect(frames, aspect))))])
+            for aspect in aspects}
+
+
+def parse_aspect(value) -> float:
+    if ":" in value:
+        width, height = value.split(":", 1)
+        return float(width) / float(height)
+    return float(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="为视频打分并选出封面帧")
+    parser.add_argument("video_file")
+    parser.add_argument("--aspect", action="append", default=[], help="封面宽高比，如 3:4、9:16，可以指定多次")
+    parser.add_argument("--frames", type=int, default=24)
+    parser.add_argument("--width", type=int, default=240)
+    args = parser.parse_args()
+
+    frames, times = decode_frames(args.video_file, args.frames, args.width)
+    for value in args.aspect or ["3:4"]:
+        scores = score_frames(crop_to_aspect(frames, parse_aspect(value)))
+        print(f"{value}:")
+        for index in np.argsort(-scores):
+            print(f"  {times[index]:8.2f}s {scores[index]:.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+from loguru import logger
+
+from conf import DB_DIR
+from utils.sqlite_db import open_db
+
+JOB_QUEUED = "queued"
+JOB_PREFLIGHT = "preflight"
+JOB_UPLOADING = "uploading"
+JOB_PUBLISHING = "publishing"
+JOB_DONE = "done"
+JOB_FAILED = "failed"  # 超过最大重试次数，进入死信列表
+
+ACTIVE_STATES = (JOB_PREFLIGHT, JOB_UPLOADING, JOB_PUBLISHING)
+ALLOWED_TRANSITIONS = {
+    JOB_QUEUED: (JOB_PREFLIGHT,),
+    JOB_PREFLIGHT: (JOB_UPLOADING, JOB_DONE, JOB_QUEUED, JOB_FAILED),
+    JOB_UPLOADING: (JOB_PUBLISHING, JOB_DONE, JOB_QUEUED, JOB_FAILED),
+    JOB_PUBLISHING: (JOB_DONE, JOB_QUEUED, JOB_FAILED),
+    JOB_DONE: (),
+    JOB_FAILED: (JOB_QUEUED,),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    platform TEXT NOT NULL,
+    account TEXT NOT NULL,
+    video_path TEXT NOT NULL,
+    payload TEXT NOT NULL DEFAULT '{}',
+    state TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    available_at REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    UNIQUE (platform, account, video_path)
+);
+CREATE INDEX IF NOT EXISTS idx_upload_jobs_state ON upload_jobs (state, available_at);
+"""
+
+
+class JobStateError(Exception):
+    """状态转换不合法"""
+
+
+class LeaseLostError(JobStateError):
+    """任务租约已经过期并被其他 worker 接管，或者任务已经结束"""
+
+
+class UploadJob(object):
+    def __init__(self, row: sqlite3.Row):
+        self.id = row["id"]
+        self.platform = row["platform"]
+        self.account = row["account"]
+        self.video_path = row["video_path"]
+        self.payload = json.loads(row["payload"])
+        self.state = row["state"]
+        self.attempts = row["attempts"]
+        self.max_attempts = row["max_attempts"]
+        self.lease_owner = row["lease_owner"]
+        self.last_error = row["last_error"]
+
+    def __repr__(self):
+        return f"UploadJob(id={self.id}, {self.platform}:{self.account}, {self.video_path}, state={self.state})"
+
+
+class JobQueue(object):
+    """
+    持久化的上传任务队列，多个 worker 进程可以同时领取任务
+
+    任务状态：queued -> preflight -> uploading -> publishing -> done / failed
+    - worker 通过 claim 领取任务并获得租约，租约过期的任务可以被其他 worker 接管，从中断的状态继续
+    - fail 会按指数退避重新排队，超过 max_attempts 后进入 failed（死信列表）
+    - 同一个 (platform, account, video_path) 只会有一个任务，重复 enqueue 不会重复上传
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = Path(db_path or DB_DIR / "upload_jobs.db")
+
+    def _connect(self):
+        return open_db(self.db_path, SCHEMA, sqlite3.Row)
+
+    def enqueue(self, platform, account, video_path, payload=None, max_attempts=3) -> int:
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO upload_jobs (platform, account, video_path, payload, max_attempts, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (platform, account, str(video_path), json.dumps(payload or {}, ensure_ascii=False), max_attempts,
+                 now, now))
+            row = conn.execute("SELECT id FROM upload_jobs WHERE platform = ? AND account = ? AND video_path = ?",
+                               (platform, account, str(video_path))).fetchone()
+        return row["id"]
+
+    def claim(self, worker_id, lease_seconds=600, platform=None):
+        """
+        原子地领取一个任务：优先排队中的任务，其次租约已过期的进行中任务
+
+        Returns:
+            UploadJob，没有可领取的任务时返回 None
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            query = ("SELECT * FROM upload_jobs WHERE ((state = ? AND available_at <= ?) "
+                     "OR (state IN (?, ?, ?) AND lease_expires < ?))")
+            params = [JOB_QUEUED, now, *ACTIVE_STATES, now]
+            if platform:
+                query += " AND platform = ?"
+                params.append(platform)
+            row = conn.execute(query + " ORDER BY id LIMIT 1", params).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+
+            # 排队中的任务进入 preflight，租约过期的任务保持原状态，由 worker 从中断处继续
+            state = JOB_PREFLIGHT if row["state"] == JOB_QUEUED else row["state"]
+            attempts = row["attempts"] + 1
+            if attempts > row["max_attempts"]:
+                conn.execute("UPDATE upload_jobs SET state = ?, lease_owner = NULL, lease_expires = NULL, "
+                             "updated_at = ? WHERE id = ?", (JOB_FAILED, now, row["id"]))
+                conn.execute("COMMIT")
+                return self.claim(worker_id, lease_seconds, platform)
+            conn.execute("UPDATE upload_jobs SET state = ?, attempts = ?, lease_owner = ?, lease_expires = ?, "
+                         "updated_at = ? WHERE id = ?",
+                         (state, attempts, worker_id, now + lease_seconds, now, row["id"]))
+            row = conn.execute("SELECT * FROM upload_jobs WHERE id = ?", (row["id"],)).fetchone()
+            conn.execute("COMMIT")
+            return UploadJob(row)
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _update_owned(self, job: UploadJob, to_state, **fields):
+        if to_state not in ALLOWED_TRANSITIONS[job.state]:
+            raise JobStateError(f"Job {job.id} can not move from {job.state} to {to_state}")
+        assignments = ["state = ?", "updated_at = ?"] + [f"{name} = ?" for name in fields]
+        params = [to_state, time.time()] + list(fields.values()) + [job.id, job.state, job.lease_owner]
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                f"UPDATE upload_jobs SET {', '.join(assignments)} WHERE id = ? AND state = ? AND lease_owner IS ?",
+                params)
+        if cursor.rowcount != 1:
+            raise LeaseLostError(f"Job {job.id} is no longer owned by {job.lease_owner} in state {job.state}")
+        job.state = to_state
+        if "lease_owner" in fields:
+            job.lease_owner = fields["lease_owner"]
+
+    def transition(self, job: UploadJob, to_state):
+        # 接管的任务可能已经处于目标状态
+        if job.state == to_state:
+            return
+        self._update_owned(job, to_state)
+
+    def heartbeat(self, job: UploadJob, lease_seconds=600):
+        with closing(self._connect()) as conn:
+            cursor = conn.execute("UPDATE upload_jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ?",
+                                  (time.time() + lease_seconds, job.id, job.lease_owner))
+        if cursor.rowcount != 1:
+            raise LeaseLostError(f"Job {job.id} is no longer owned by {job.lease_owner}")
+
+    def keep_alive(self, job: UploadJob, lease_seconds=600, interval=None):
+        """
+        在后台线程里定期续租，包住转码、等待发布间隔和上传这些耗时步骤，避免租约中途过期被其他 worker 接管
+
+            with job_queue.keep_alive(job):
+                upload(...)
+                job_queue.complete(job)
+        """
+        return _LeaseKeeper(self, job, lease_seconds, interval or lease_seconds / 3)
+
+    def complete(self, job: UploadJob, result=None):
+        self._update_owned(job, JOB_DONE, result=json.dumps(result, ensure_ascii=False, default=str),
+                           lease_owner=None, lease_expires=None, last_error=None)
+
+    def fail(self, job: UploadJob, error, retry_delay=60):
+        """失败后按指数退避重新排队，重试次数用完则进入死信列表"""
+        if job.attempts >= job.max_attempts:
+            self._update_owned(job, JOB_FAILED, last_error=str(error), lease_owner=None, lease_expires=None)
+        else:
+            available_at = time.time() + retry_delay * 2 ** (job.attempts - 1)
+            self._update_owned(job, JOB_QUEUED, last_error=str(error), available_at=available_at,
+                               lease_owner=None, lease_expires=None)
+
+    def dead_letters(self, platform=None):
+        query = "SELECT * FROM upload_jobs WHERE state = ?"
+        params = [JOB_FAILED]
+        if platform:
+            query += " AND platform = ?"
+            params.append(platform)
+        with closing(self._connect()) as conn:
+            return [UploadJob(row) for row in conn.execute(query + " ORDER BY id", params)]
+
+    def requeue(self, job_id, reset_attempts=True):
+        """把死信任务重新放回队列"""
+        with closing(self._connect()) as conn:
+            conn.execute("UPDATE upload_jobs SET state = ?, available_at = 0, updated_at = ?"
+                         + (", attempts = 0" if reset_attempts else "") + " WHERE id = ? AND state = ?",
+                         (JOB_QUEUED, time.time(), job_id, JOB_FAILED))
+
+    def stats(self):
+        with closing(self._connect()) as conn:
+            return {row["state"]: row["total"] for row in
+                    conn.execute("SELECT state, COUNT(*) AS total FROM upload_jobs GROUP BY state")}
+
+
+class _LeaseKeeper(object):
+    def __init__(self, queue, job, lease_seconds, interval):
+        self.queue = queue
+        self.job = job
+        self.lease_seconds = lease_seconds
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            # complete / fail 之后任务已经不属于这个 worker，不再续租
+            if self.job.lease_owner is None:
+                return
+            try:
+                self.queue.heartbeat(self.job, self.lease_seconds)
+            except LeaseLostError as e:
+                logger.warning(f"{e}，停止续租")
+                return
+            except sqlite3.Error as e:
+                logger.warning(f"Job {self.job.id} 续租失败，稍后重试: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
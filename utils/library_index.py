@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+视频库索引：把视频目录的文件列表、标题、话题、文件头信息和内容哈希保存在 SQLite 中
+
+- update 用 os.scandir 遍历目录，只重新处理大小或修改时间变化的视频和 txt，未变化的文件不会被打开
+- 标题和话题来自同名 txt，或者目录下的清单文件（manifest.jsonl / manifest.csv，见 conf.LIBRARY_MANIFEST_NAMES），
+  清单中列出的视频优先使用清单
+- unpublished 结合发布记录（utils/publish_ledger.py）直接在 SQLite 中查询还没有发布到某个平台账号的视频
+
+    library_index.update("videos")
+    for entry in library_index.unpublished("douyin", "account", root="videos"):
+        entry.path, entry.title, entry.tags, entry.info
+
+清单文件每行（或每个 CSV 行）一个视频，file 为相对清单所在目录的路径，tags 为列表或空格分隔的字符串：
+
+    {"file": "demo.mp4", "title": "标题", "tags": ["话题1", "话题2"]}
+
+    python -m utils.library_index scan videos --recursive
+    python -m utils.library_index list videos --unpublished douyin --account account
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+
+from loguru import logger
+
+from conf import DB_DIR, LIBRARY_MANIFEST_NAMES
+from utils.files_times import parse_hashtags, parse_title_and_hashtags
+from utils.media_probe import MediaInfo, MediaProbeError, check_media, parse_mp4
+from utils.publish_ledger import publish_ledger
+from utils.sqlite_db import open_db
+
+VIDEO_SUFFIX = ".mp4"
+SIDECAR_SUFFIX = ".txt"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    meta_key TEXT NOT NULL,
+    title TEXT,
+    tags TEXT NOT NULL DEFAULT '[]',
+    media TEXT,
+    probe_error TEXT,
+    content_hash TEXT,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS videos_directory ON videos (directory);
+CREATE INDEX IF NOT EXISTS videos_content_hash ON videos (content_hash);
+"""
+
+
+class LibraryEntry(object):
+    def __init__(self, row):
+        self.path = Path(row["path"])
+        self.title = row["title"]
+        self.tags = json.loads(row["tags"])
+        self.content_hash = row["content_hash"]
+        self.probe_error = row["probe_error"]
+        self.info = MediaInfo(**json.loads(row["media"])) if row["media"] else None
+
+    def __repr__(self):
+        return f"<LibraryEntry {self.path} {self.title!r} {self.tags}>"
+
+
+def _split_tags(tags):
+    if isinstance(tags, str):
+        return parse_hashtags(tags)
+    return [str(tag).lstrip("#") for tag in tags or []]
+
+
+def read_manifest(manifest_file) -> dict:
+    """读取 JSONL 或 CSV 清单，返回 {视频绝对路径: (标题, 话题列表)}"""
+    manifest_file = Path(manifest_file)
+    with open(manifest_file, "r", encoding="utf-8", newline="") as f:
+        if manifest_file.suffix == ".csv":
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    manifest = {}
+    for row in rows:
+        path = os.path.abspath(os.path.join(manifest_file.parent, row["file"]))
+        manifest[path] = (row.get("title") or Path(path).stem, _split_tags(row.get("tags")))
+    return manifest
+
+
+class LibraryIndex(object):
+    """
+    每个视频一行：路径、大小、修改时间、内容哈希、标题话题和文件头信息
+
+    meta_key 记录标题和话题的来源（txt 或清单文件）及其修改时间，视频本身没有变化、只改了 txt 时不会重新计算哈希。
+    """
+
+    def __init__(self, db_path=None, manifest_names=LIBRARY_MANIFEST_NAMES):
+        self.db_path = Path(db_path or DB_DIR / "library_index.db")
+        self.manifest_names = manifest_names
+
+    def _connect(self):
+        return open_db(self.db_path, SCHEMA, sqlite3.Row)
+
+    def _find_manifest(self, root, manifest=None):
+        if manifest is not None:
+            return Path(manifest).resolve()
+        for name in self.manifest_names:
+            if (root / name).is_file():
+                return root / name
+        return None
+
+    @staticmethod
+    def _scan(root, recursive):
+        """遍历目录，返回 {视频路径: (目录, 视频 stat, 同名 txt 的 stat 或 None)}"""
+        found = {}
+        stack = [str(root)]
+        while stack:
+            directory = stack.pop()
+            with os.scandir(directory) as it:
+                entries = {entry.name: entry for entry in it}
+            for name, entry in entries.items():
+                if recursive and entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif name.endswith(VIDEO_SUFFIX) and entry.is_file():
+                    sidecar = entries.get(name[:-len(VIDEO_SUFFIX)] + SIDECAR_SUFFIX)
+                    found[entry.path] = (directory, entry.stat(), sidecar.stat() if sidecar is not None else None)
+        return found
+
+    @staticmethod
+    def _scope(root, recursive):
+        """root 目录（recursive 时包括子目录）下视频的查询条件"""
+        if recursive:
+            # 按主键范围查询路径前缀，比 LIKE 快，也不用处理路径中的通配符
+            return "(path > ? AND path < ?)", [root + os.sep, root + chr(ord(os.sep) + 1)]
+        return "directory = ?", [root]
+
+    def update(self, root, recursive=False, manifest=None) -> dict:
+        """
+        增量更新 root 目录的索引
+
+        Returns:
+            {"added": 新增数, "updated": 更新数, "removed": 删除数, "unchanged": 未变化数}
+        """
+        root = Path(root).resolve()
+        start = time.perf_counter()
+        manifest_file = self._find_manifest(root, manifest)
+        manifest_entries = {}
+        manifest_key = ""
+        if manifest_file is not None:
+            manifest_entries = read_manifest(manifest_file)
+            manifest_key = f"manifest:{manifest_file}:{manifest_file.stat().st_mtime_ns}"
+
+        where, params = self._scope(str(root), recursive)
+        with closing(self._connect()) as conn:
+            known = {row["path"]: row for row in
+                     conn.execute(f"SELECT path, size, mtime_ns, meta_key, media, probe_error, content_hash "
+                                  f"FROM videos WHERE {where}", params)}
+
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
+        rows = []
+        found = self._scan(root, recursive)
+        for path, (directory, stat, sidecar_stat) in found.items():
+            if path in manifest_entries:
+                meta_key = manifest_key
+            elif sidecar_stat is not None:
+                meta_key = f"txt:{sidecar_stat.st_size}:{sidecar_stat.st_mtime_ns}"
+            else:
+                meta_key = ""
+            old = known.get(path)
+            media_changed = old is None or old["size"] != stat.st_size or old["mtime_ns"] != stat.st_mtime_ns
+            if not media_changed and old["meta_key"] == meta_key:
+                stats["unchanged"] += 1
+                continue
+            stats["added" if old is None else "updated"] += 1
+
+            title, tags = self._read_meta(path, meta_key, manifest_entries)
+            if media_changed:
+                media, probe_error, content_hash = self._read_media(path)
+            else:
+                media, probe_error, content_hash = old["media"], old["probe_error"], old["content_hash"]
+            rows.append((path, directory, stat.st_size, stat.st_mtime_ns, meta_key, title,
+                         json.dumps(tags, ensure_ascii=False), media, probe_error, content_hash, time.time()))
+
+        removed = [path for path in known if path not in found]
+        stats["removed"] = len(removed)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT OR REPLACE INTO videos (path, directory, size, mtime_ns, meta_key, title, tags, "
+                             "media, probe_error, content_hash, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             rows)
+            conn.executemany("DELETE FROM videos WHERE path = ?", [(path,) for path in removed])
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        logger.info(f"视频库索引 {root}: 新增 {stats['added']}，更新 {stats['updated']}，删除 {stats['removed']}，"
+                    f"未变化 {stats['unchanged']}，耗时 {time.perf_counter() - start:.2f}s")
+        return stats
+
+    @staticmethod
+    def _read_meta(path, meta_key, manifest_entries):
+        if meta_key.startswith("manifest:"):
+            return manifest_entries[path]
+        if meta_key:
+            try:
+                with open(path[:-len(VIDEO_SUFFIX)] + SIDECAR_SUFFIX, "r", encoding="utf-8") as f:
+                    return parse_title_and_hashtags(f.read())
+            except (OSError, IndexError) as e:
+                logger.warning(f"{path} 的 txt 无法读取标题和话题: {e}")
+        # 没有 txt 也不在清单中时用文件名作为标题
+        return Path(path).stem, []
+
+    @staticmethod
+    def _read_media(path):
+        """返回 (文件头信息 JSON, 解析错误, 内容哈希)"""
+        try:
+            media, probe_error = json.dumps(parse_mp4(path).as_dict()), None
+        except (OSError, MediaProbeError) as e:
+            media, probe_error = None, str(e)
+        try:
+            content_hash = publish_ledger.content_hash(path)
+        except OSError as e:
+            logger.warning(f"{path} 计算内容哈希失败: {e}")
+            content_hash = None
+        return media, probe_error, content_hash
+
+    def get(self, video_file):
+        """按路径读取一条索引，没有时返回 None"""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM videos WHERE path = ?", (os.path.abspath(str(video_file)),)).fetchone()
+        return None if row is None else LibraryEntry(row)
+
+    def entries(self, root, recursive=False) -> list:
+        where, params = self._scope(str(Path(root).resolve()), recursive)
+        with closing(self._connect()) as conn:
+            return [LibraryEntry(row) for row in
+                    conn.execute(f"SELECT * FROM videos WHERE {where} ORDER BY path", params)]
+
+    def unpublished(self, platform, account=None, root=None, recursive=False) -> list:
+        """
+        还没有发布到该平台的视频（指定 account 时只看这个账号），按路径排序
+
+        root 为 None 时查询整个索引。
+        """
+        sql = ("SELECT * FROM videos v WHERE NOT EXISTS (SELECT 1 FROM ledger.published p "
+               "WHERE p.content_hash = v.content_hash AND p.platform = ?")
+        params = [platform]
+        if account:
+            sql += " AND p.account = ?"
+            params.append(account)
+        sql += ")"
+        if root is not None:
+            where, scope_params = self._scope(str(Path(root).resolve()), recursive)
+            sql += f" AND {where}"
+            params += scope_params
+        # 确保发布记录的数据库和表已经创建
+        publish_ledger._connect().close()
+        with closing(self._connect()) as conn:
+            conn.execute("ATTACH DATABASE ? AS ledger", (str(publish_ledger.db_path),))
+            return [LibraryEntry(row) for row in conn.execute(sql + " ORDER BY path", params)]
+
+    @staticmethod
+    def filter_uploadable(entries, platform=None) -> list:
+        """按索引中的文件头信息过滤掉不满足平台要求的视频，并打印原因（不再读取视频文件）"""
+        uploadable = []
+        for entry in entries:
+            if entry.info is None:
+                print(f"跳过：{entry.path}: {entry.probe_error}")
+                continue
+            problems = check_media(entry.info, platform)
+            if problems:
+                print(f"跳过：{entry.path}: {'；'.join(problems)}")
+                continue
+            uploadable.append(entry)
+        return uploadable
+
+
+library_index = LibraryIndex()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="视频库索引")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    scan_parser = subparsers.add_parser("scan", help="增量更新目录的索引")
+    list_parser = subparsers.add_parser("list", help="列出目录中的视频")
+    for sub_parser in (scan_parser, list_parser):
+        sub_parser.add_argument("root")
+        sub_parser.add_argument("--recursive", action="store_true", help="包括子目录")
+    scan_parser.add_argument("--manifest", help="JSONL/CSV 清单文件，默认使用目录下的 manifest.jsonl / manifest.csv")
+    list_parser.add_argument("--unpublished", metavar="PLATFORM", help="只列出还没有发布到该平台的视频")
+    list_parser.add_argument("--account")
+    args = parser.parse_args()
+
+    if args.command == "scan":
+        print(library_index.update(args.root, args.recursive, args.manifest))
+    elif args.command == "list":
+        if args.unpublished:
+            entries = library_index.unpublished(args.unpublished, args.account, args.root, args.recursive)
+        else:
+            entries = library_index.entries(args.root, args.recursive)
+        for entry in entries:
+            print(f"{entry.path} {entry.info!r} {entry.title} {' '.join(f'#{tag}' for tag in entry.tags)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+上传前的视频检查：通过 mmap 只读取 MP4/MOV 的 box 头和 moov，不读整个文件，也不启动 ffprobe
+
+    info = media_probe.probe("videos/demo.mp4")
+    info.duration, info.width, info.height, info.video_codec, info.bitrate, info.faststart
+
+    python -m utils.media_probe videos/*.mp4 --platform douyin
+"""
+import argparse
+import json
+import math
+import mmap
+import os
+import struct
+from contextlib import closing
+from pathlib import Path
+
+from loguru import logger
+
+from conf import DB_DIR, MEDIA_PREFLIGHT_RULES
+from utils.sqlite_db import open_db
+
+MEDIA_PROBE_DB = Path(DB_DIR / "media_probe.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media_probe (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    info TEXT,
+    error TEXT
+);
+"""
+
+CODEC_NAMES = {
+    "avc1": "h264", "avc3": "h264",
+    "hvc1": "hevc", "hev1": "hevc",
+    "av01": "av1", "vp09": "vp9", "mp4v": "mpeg4",
+    "mp4a": "aac", "Opus": "opus", "ac-3": "ac3", "ec-3": "eac3", ".mp3": "mp3",
+}
+
+# 文件开头可能出现的 box，老的 QuickTime 文件没有 ftyp
+TOP_LEVEL_BOXES = {b"ftyp", b"moov", b"mdat", b"free", b"skip", b"wide", b"pnot"}
+
+
+class MediaProbeError(Exception):
+    """文件不是有效的 MP4/MOV，或者文件不完整"""
+
+
+class MediaPreflightError(Exception):
+    """视频不满足目标平台的上传要求"""
+
+
+class MediaInfo(object):
+    def __init__(self, size, duration=None, width=None, height=None, rotation=0, video_codec=None,
+                 audio_codec=None, bitrate=None, faststart=False, brand=None):
+        self.size = size
+        self.duration = duration
+        self.width = width
+        self.height = height
+        self.rotation = rotation
+        self.video_codec = video_codec
+        self.audio_codec = audio_codec
+        self.bitrate = bitrate
+        self.faststart = faststart
+        self.brand = brand
+
+    @property
+    def display_size(self):
+        """考虑旋转后的实际显示宽高（手机竖拍的视频常以横向编码 + 90 度旋转保存）"""
+        if self.rotation in (90, 270):
+            return self.height, self.width
+        return self.width, self.height
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        width, height = self.display_size
+        return (f"<MediaInfo {width}x{height} {self.video_codec}/{self.audio_codec} "
+                f"{self.duration or 0:.1f}s {(self.bitrate or 0) / 1e6:.2f}Mbps faststart={self.faststart}>")
+
+
+def _iter_boxes(buf, start, end):
+    """遍历 [start, end) 内的同级 box，返回 (类型, 内容起点, 终点)"""
+    offset = start
+    while offset + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", buf, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise MediaProbeError(f"box {box_type!r} 头部不完整")
+            size = struct.unpack_from(">Q", buf, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            # 最后一个 box 延伸到文件结尾
+            size = end - offset
+        if size < header or offset + size > end:
+            raise MediaProbeError(f"box {box_type!r} 超出文件范围，文件可能没有下载/导出完整")
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def _find(buf, start, end, *path):
+    """按路径查找子 box，例如 _find(buf, s, e, b"mdia", b"minf", b"stbl")"""
+    for box_type, box_start, box_end in _iter_boxes(buf, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return box_start, box_end
+            return _find(buf, box_start, box_end, *path[1:])
+    return None
+
+
+def _unpack(fmt, buf, offset, end):
+    """在 box 范围内读取字段，超出 box 时说明文件损坏或被截断"""
+    if offset + struct.calcsize(fmt) > end:
+        raise MediaProbeError("box 内容不完整，文件可能没有下载/导出完整")
+    return struct.unpack_from(fmt, buf, offset)
+
+
+def _parse_trak(buf, start, end, info):
+    hdlr = _find(buf, start, end, b"mdia", b"hdlr")
+    stsd = _find(buf, start, end, b"mdia", b"minf", b"stbl", b"stsd")
+    if hdlr is None or stsd is None or stsd[1] - stsd[0] < 16:
+        return
+    handler = _unpack("4s", buf, hdlr[0] + 8, hdlr[1])[0]
+    # stsd: version/flags(4) entry_count(4)，第一个 sample entry 的 size(4) format(4)
+    codec = bytes(buf[stsd[0] + 12:stsd[0] + 16]).decode("latin-1")
+    if handler == b"vide" and info.video_codec is None:
+        info.video_codec = CODEC_NAMES.get(codec, codec)
+        if stsd[1] - stsd[0] >= 44:
+            info.width, info.height = struct.unpack_from(">HH", buf, stsd[0] + 40)
+        tkhd = _find(buf, start, end, b"tkhd")
+        if tkhd is not None:
+            # 跳过 version/flags 和时间字段，后面依次是 reserved(8) layer alternate_group volume reserved(8) 和矩阵
+            version = _unpack("B", buf, tkhd[0], tkhd[1])[0]
+            matrix_offset = tkhd[0] + (36 if version == 1 else 24) + 16
+            if matrix_offset + 36 <= tkhd[1]:
+                a, b = struct.unpack_from(">ii", buf, matrix_offset)
+                info.rotation = round(math.degrees(math.atan2(b, a))) % 360
+    elif handler == b"soun" and info.audio_codec is None:
+        info.audio_codec = CODEC_NAMES.get(codec, codec)
+
+
+def _mvhd_timescale(buf, start, end):
+    """返回 mvhd 的 (timescale, duration)"""
+    if _unpack("B", buf, start, end)[0] == 1:
+        return _unpack(">IQ", buf, start + 20, end)
+    return _unpack(">II", buf, start + 12, end)
+
+
+def _parse_moov(buf, start, end, info):
+    for box_type, box_start, box_end in _iter_boxes(buf, start, end):
+        if box_type == b"mvhd":
+            timescale, duration = _mvhd_timescale(buf, box_start, box_end)
+            if timescale and duration:
+                info.duration = duration / timescale
+        elif box_type == b"mvex" and not info.duration:
+            # 分片 MP4 的 mvhd 时长通常是 0，总时长在 mehd 中（使用 mvhd 的 timescale）
+            mehd = _find(buf, box_start, box_end, b"mehd")
+            mvhd = _find(buf, start, end, b"mvhd")
+            if mehd is not None and mvhd is not None:
+                timescale, _ = _mvhd_timescale(buf, *mvhd)
+                fmt = ">Q" if _unpack("B", buf, mehd[0], mehd[1])[0] == 1 else ">I"
+                if timescale:
+                    info.duration = _unpack(fmt, buf, mehd[0] + 4, mehd[1])[0] / timescale
+        elif box_type == b"trak":
+            _parse_trak(buf, box_start, box_end, info)
+
+
+def parse_mp4(path) -> MediaInfo:
+    """解析 MP4/MOV 文件头，只有 box 头和 moov 所在的页会被读入内存"""
+    size = os.path.getsize(path)
+    if size < 8:
+        raise MediaProbeError("文件为空或过小")
+    info = MediaInfo(size)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        if bytes(buf[4:8]) not in TOP_LEVEL_BOXES:
+            raise MediaProbeError("不是 MP4/MOV 文件")
+        moov_offset = mdat_offset = None
+        try:
+            for box_type, box_start, box_end in _iter_boxes(buf, 0, size):
+                if box_type == b"ftyp":
+                    info.brand = bytes(buf[box_start:box_start + 4]).decode("latin-1").strip()
+                elif box_type == b"moov" and moov_offset is None:
+                    moov_offset = box_start
+                    _parse_moov(buf, box_start, box_end, info)
+                elif box_type == b"mdat" and mdat_offset is None:
+                    mdat_offset = box_start
+        except (struct.error, IndexError) as e:
+            # 兜底：损坏的文件不能让调用方（批量上传、视频库索引）崩溃
+            raise MediaProbeError(f"文件头损坏: {e}") from e
+    if moov_offset is None:
+        raise MediaProbeError("缺少 moov，文件可能没有导出完整")
+    # moov 在 mdat 之前，平台可以边上传边解析
+    info.faststart = mdat_offset is None or moov_offset < mdat_offset
+    if info.duration:
+        info.bitrate = int(size * 8 / info.duration)
+    return info
+
+
+class MediaProbeCache(object):
+    """
+    按 (路径, 文件大小, 修改时间) 缓存解析结果，解析失败的结果也会缓存，文件变化后重新解析
+
+    每个文件一行，未命中时只写入这一行，扫描几万个文件的视频库时不会反复重写整个缓存。
+    """
+
+    def __init__(self, db_path=MEDIA_PROBE_DB):
+        self.db_path = Path(db_path)
+
+    def _connect(self):
+        return open_db(self.db_path, SCHEMA)
+
+    def probe(self, path) -> MediaInfo:
+        """
+        Raises:
+            MediaProbeError: 文件无法解析
+            OSError: 文件不存在或无法读取
+        """
+        key = os.path.abspath(str(path))
+        stat = os.stat(key)
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT info, error FROM media_probe WHERE path = ? AND size = ? AND mtime_ns = ?",
+                               (key, stat.st_size, stat.st_mtime_ns)).fetchone()
+        if row is None:
+            info = error = None
+            try:
+                info = json.dumps(parse_mp4(key).as_dict(), ensure_ascii=False)
+            except MediaProbeError as e:
+                error = str(e)
+            with closing(self._connect()) as conn:
+                conn.execute("INSERT OR REPLACE INTO media_probe (path, size, mtime_ns, info, error) "
+                             "VALUES (?, ?, ?, ?, ?)", (key, stat.st_size, stat.st_mtime_ns, info, error))
+            row = (info, error)
+        if row[1] is not None:
+            raise MediaProbeError(row[1])
+        return MediaInfo(**json.loads(row[0]))
+
+
+def get_rules(platform=None) -> dict:
+    rules = dict(MEDIA_PREFLIGHT_RULES.get("default", {}))
+    rules.update(MEDIA_PREFLIGHT_RULES.get(platform, {}))
+    return rules
+
+
+def check_media(info: MediaInfo, platform=None) -> list:
+    """返回视频不满足平台要求的原因，空列表表示可以上传"""
+    rules = get_rules(platform)
+    problems = []
+    if not info.duration:
+        problems.append("无法读取视频时长")
+    if info.video_codec is None:
+        problems.append("没有视频轨")
+    elif rules.get("video_codecs") and info.video_codec not in rules["video_codecs"]:
+        problems.append(f"不支持的视频编码 {info.video_codec}")
+    if rules.get("max_duration") and info.duration and info.duration > rules["max_duration"]:
+        problems.append(f"时长 {info.duration:.0f}s 超过 {rules['max_duration']}s")
+    if rules.get("min_duration") and info.duration and info.duration < rules["min_duration"]:
+        problems.append(f"时长 {info.duration:.1f}s 短于 {rules['min_duration']}s")
+    if rules.get("max_size") and info.size > rules["max_size"]:
+        problems.append(f"文件大小 {info.size / 1024 ** 2:.0f}MB 超过 {rules['max_size'] / 1024 ** 2:.0f}MB")
+    if rules.get("require_faststart") and not info.faststart:
+        problems.append("moov 不在文件开头（非 faststart）")
+    return problems
+
+
+def preflight(video_file, platform=None) -> MediaInfo:
+    """
+    上传前检查视频，在启动浏览器之前就发现坏文件或平台不支持的视频
+
+    Raises:
+        MediaPreflightError: 文件无法解析或不满足平台要求
+    """
+    try:
+        info = media_probe.probe(video_file)
+    except (OSError, MediaProbeError) as e:
+        raise MediaPreflightError(f"{video_file}: {e}") from e
+    problems = check_media(info, platform)
+    if problems:
+        raise MediaPreflightError(f"{video_file}: {'；'.join(problems)}")
+    if not info.faststart:
+        logger.warning(f"{video_file} 的 moov 在文件末尾，平台需要等上传完成才能开始处理")
+    return info
+
+
+def filter_uploadable(files, platform=None) -> list:
+    """过滤掉预检不通过的视频，并打印原因"""
+    uploadable = []
+    for file in files:
+        try:
+            preflight(file, platform)
+        except MediaPreflightError as e:
+            print(f"跳过：{e}")
+            continue
+        uploadable.append(file)
+    return uploadable
+
+
+media_probe = MediaProbeCache()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="读取 MP4 文件头，检查视频是否可以上传")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--platform", help="按该平台的要求检查，见 conf.MEDIA_PREFLIGHT_RULES")
+    args = parser.parse_args()
+    for file in args.files:
+        try:
+            info = media_probe.probe(file)
+        except (OSError, MediaProbeError) as e:
+            print(f"[-] {file}: {e}")
+            continue
+        problems = check_media(info, args.platform)
+        print(f"[{'-' if problems else '+'}] {file}: {info!r} {'；'.join(problems)}")
+
+
+if __name__ == '__main__':
+    main()
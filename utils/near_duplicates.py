@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+近似重复检测：同一个视频重新编码、裁掉片头片尾后内容哈希会变，但画面几乎不变，平台会把它当作重复内容限流
+
+- 每个视频取若干关键帧，缩小到 32x32 灰度图后计算感知哈希（DCT 低频 8x8 与中位数比较，得到 64 位整数）
+- 所有视频的帧哈希拼成一个 uint64 数组，查询时用异或 + 位计数一次算出与全部帧的汉明距离，不逐个视频循环
+- 纯色、黑屏这类几乎没有内容的帧哈希不稳定，而且不同视频之间也会相同，计算哈希前去掉
+- 与某个已发布视频相同画面的帧数占比达到 min_ratio、且至少有 min_frames 帧相同时视为近似重复
+
+帧哈希按内容哈希保存在 SQLite 中，每个视频只解码一次；没有安装 ffmpeg 时不做检查。
+
+    python -m utils.near_duplicates videos/demo.mp4 --platform douyin --account account
+"""
+import argparse
+import shutil
+import subprocess
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+from loguru import logger
+
+from conf import DB_DIR, NEAR_DUPLICATE_MAX_DISTANCE, NEAR_DUPLICATE_MIN_FRAMES, NEAR_DUPLICATE_MIN_RATIO, \
+    NEAR_DUPLICATE_SAMPLE_FRAMES, TRANSCODE_FFMPEG
+from utils.frame_scorer import read_keyframes
+from utils.media_probe import MediaProbeError
+from utils.publish_ledger import format_time, publish_ledger
+from utils.sqlite_db import open_db
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS frame_hashes (
+    content_hash TEXT PRIMARY KEY,
+    video_path TEXT,
+    hashes BLOB NOT NULL,
+    indexed_at REAL NOT NULL
+);
+"""
+
+HASH_SIZE = 32
+LOW_FREQ_SIZE = 8
+# 灰度标准差低于这个值的帧视为纯色画面（0 ~ 255）
+MIN_FRAME_STD = 8
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+DCT_MATRIX = _dct_matrix(HASH_SIZE)
+
+if hasattr(np, "bitwise_count"):
+    def popcount(values):
+        return np.bitwise_count(values)
+else:
+    # numpy < 2.0 没有 bitwise_count，按字节查表
+    _BYTE_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(values):
+        return _BYTE_BITS[values.view(np.uint8).reshape(len(values), 8)].sum(axis=1)
+
+
+def phash(frames) -> np.ndarray:
+    """frames 为 (帧数, 32, 32) 的灰度图，返回每帧的 64 位感知哈希（uint64 数组）"""
+    coefficients = DCT_MATRIX @ frames.astype(np.float64) @ DCT_MATRIX.T
+    low = coefficients[:, :LOW_FREQ_SIZE, :LOW_FREQ_SIZE].reshape(len(frames), -1)
+    bits = low > np.median(low[:, 1:], axis=1, keepdims=True)
+    return np.packbits(bits, axis=1).view(">u8").astype(np.uint64).ravel()
+
+
+def video_phashes(video_file, count=NEAR_DUPLICATE_SAMPLE_FRAMES, ffmpeg=TRANSCODE_FFMPEG) -> np.ndarray:
+    """
+    Raises:
+        MediaProbeError: 无法读取视频时长或分辨率
+        subprocess.CalledProcessError: ffmpeg 解码失败
+    """
+    frames, _ = read_keyframes(video_file, count, HASH_SIZE, HASH_SIZE, pix_fmt="gray", ffmpeg=ffmpeg)
+    frames = frames[..., 0]
+    frames = frames[frames.reshape(len(frames), -1).std(axis=1) >= MIN_FRAME_STD]
+    return phash(frames)
+
+
+class NearDuplicateIndex(object):
+    """
+    帧哈希索引，SQLite 持久化，查询时在内存中的 NumPy 数组上计算
+
+    - _hashes: 所有视频的帧哈希拼接成的 uint64 数组
+    - _owners: 每个帧哈希属于第几个视频
+    新增的视频按 rowid 增量加载，其他进程写入的记录下次查询时也会加载。
+    """
+
+    def __init__(self, db_path=None, ffmpeg=TRANSCODE_FFMPEG, sample_frames=NEAR_DUPLICATE_SAMPLE_FRAMES):
+        self.db_path = Path(db_path or DB_DIR / "near_duplicates.db")
+        self.ffmpeg = ffmpeg
+        self.sample_frames = sample_frames
+        self._lock = threading.Lock()
+        self._last_rowid = 0
+        self._hashes = np.zeros(0, dtype=np.uint64)
+        self._owners = np.zeros(0, dtype=np.int32)
+        self._content_hashes = []
+        self._video_paths = []
+        self._frame_counts = np.zeros(0, dtype=np.int32)
+        self._positions = {}
+
+    def _connect(self):
+        return open_db(self.db_path, SCHEMA)
+
+    def _load(self):
+        """把上次加载之后新增的记录追加到内存数组中"""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("SELECT rowid, content_hash, video_path, hashes FROM frame_hashes WHERE rowid > ? "
+                                "ORDER BY rowid", (self._last_rowid,)).fetchall()
+        hashes, owners, counts = [], [], []
+        for rowid, content_hash, video_path, blob in rows:
+            self._last_rowid = rowid
+            if content_hash in self._positions:
+                continue
+            frame_hashes = np.frombuffer(blob, dtype="<u8")
+            position = len(self._content_hashes)
+            self._positions[content_hash] = position
+            self._content_hashes.append(content_hash)
+            self._video_paths.append(video_path)
+            hashes.append(frame_hashes)
+            owners.append(np.full(len(frame_hashes), position, dtype=np.int32))
+            counts.append(len(frame_hashes))
+        if hashes:
+            self._hashes = np.concatenate([self._hashes] + hashes).astype(np.uint64)
+            self._owners = np.concatenate([self._owners] + owners)
+            self._frame_counts = np.concatenate([self._frame_counts, np.asarray(counts, dtype=np.int32)])
+
+    def frame_hashes(self, video_file):
+        """
+        返回视频的帧哈希，已经索引过的直接读取，否则解码后写入索引
+
+        Returns:
+            uint64 数组；没有 ffmpeg 或无法解码时返回 None
+        """
+        content_hash = publish_ledger.content_hash(video_file)
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT hashes FROM frame_hashes WHERE content_hash = ?", (content_hash,)).fetchone()
+        if row is not None:
+            return np.frombuffer(row[0], dtype="<u8").astype(np.uint64)
+        if shutil.which(self.ffmpeg) is None:
+            return None
+        try:
+            hashes = video_phashes(video_file, self.sample_frames, self.ffmpeg)
+        except (MediaProbeError, subprocess.CalledProcessError) as e:
+            logger.warning(f"{video_file} 计算帧哈希失败，跳过近似重复检查: {e}")
+            return None
+        if not len(hashes):
+            return None
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT OR IGNORE INTO frame_hashes (content_hash, video_path, hashes, indexed_at) "
+                         "VALUES (?, ?, ?, ?)",
+                         (content_hash, str(Path(video_file).resolve()), hashes.astype("<u8").tobytes(), time.time()))
+        return hashes
+
+    def query(self, hashes, max_distance=NEAR_DUPLICATE_MAX_DISTANCE, min_ratio=NEAR_DUPLICATE_MIN_RATIO,
+              min_frames=NEAR_DUPLICATE_MIN_FRAMES, exclude=None) -> list:
+        """
+        查找与这组帧哈希近似的视频
+
+        比例按两个视频中帧数较少的一方计算，截取的片段与完整视频也能匹配；
+        同时要求至少 min_frames 帧相同，避免只有一两帧有效画面的视频靠一帧巧合被判为重复。
+
+        Returns:
+            [(内容哈希, 视频路径, 相同画面比例), ...]，按比例从高到低排序
+        """
+        with self._lock:
+            self._load()
+            if not len(self._hashes):
+                return []
+            hashes = np.unique(hashes)
+            hits = np.zeros(len(self._content_hashes), dtype=np.int32)
+            # 循环次数只与查询视频的帧数有关，与索引大小无关
+            for frame_hash in hashes:
+                matched = self._owners[popcount(self._hashes ^ frame_hash) <= max_distance]
+                hits[np.unique(matched)] += 1
+            counts = np.maximum(np.minimum(self._frame_counts, len(hashes)), 1)
+            ratios = np.minimum(hits / counts, 1.0)
+            candidates = np.flatnonzero((ratios >= min_ratio) & (hits >= np.minimum(min_frames, counts)))
+            results = [(self._content_hashes[i], self._video_paths[i], float(ratios[i])) for i in candidates
+                       if self._content_hashes[i] != exclude]
+        return sorted(results, key=lambda result: -result[2])
+
+    def find_published(self, video_file, platform, account) -> list:
+        """
+        查找已经发布到该平台账号的近似重复视频（不包括内容完全相同的视频，那部分由发布记录判断）
+
+        Returns:
+            [(发布记录, 相同画面比例), ...]
+        """
+        hashes = self.frame_hashes(video_file)
+        if hashes is None:
+            return []
+        matches = self.query(hashes, exclude=publish_ledger.content_hash(video_file))
+        entries = publish_ledger.lookup([content_hash for content_hash, _, _ in matches], platform, account)
+        return [(entries[content_hash], ratio) for content_hash, _, ratio in matches if content_hash in entries]
+
+    def filter_near_duplicates(self, files, platform, account) -> list:
+        """过滤掉与该平台账号已发布视频近似重复的视频，并打印原因"""
+        unique = []
+        for file in files:
+            matches = self.find_published(file, platform, account)
+            if matches:
+                entry, ratio = matches[0]
+                print(f"跳过：{file} 与 {format_time(entry['published_at'])} 发布到 {platform}:{account} 的 "
+                      f"{entry['video_path']} 近似重复（{ratio:.0%} 画面相同）")
+                continue
+            unique.append(file)
+        return unique
+
+
+near_duplicate_index = NearDuplicateIndex()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查找近似重复的视频")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--platform", help="只显示已经发布到该平台的视频，需要同时指定 --account")
+    parser.add_argument("--account")
+    args = parser.parse_args()
+
+    for file in args.files:
+        if args.platform and args.account:
+            matches = [(entry["video_path"], ratio)
+                       for entry, ratio in near_duplicate_index.find_published(file, args.platform, args.account)]
+        else:
+            hashes = near_duplicate_index.frame_hashes(file)
+            matches = [] if hashes is None else [
+                (video_path, ratio) for _, video_path, ratio in
+                near_duplicate_index.query(hashes, exclude=publish_ledger.content_hash(file))]
+        print(f"[{'-' if matches else '+'}] {file}")
+        for video_path, ratio in matches:
+            print(f"    {ratio:.0%} {video_path}")
+
+
+if __name__ == '__main__':
+    main()
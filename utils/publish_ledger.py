@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+发布记录：按视频内容哈希 + 平台 + 账号记录已经发布过的视频，避免同一个文件被重复上传
+
+文件改名或移动后内容哈希不变，仍然会被识别为已发布；哈希按 (路径, 文件大小, 修改时间) 缓存，
+未修改的文件不会重复读取。
+
+    python -m utils.publish_ledger list --platform douyin
+    python -m utils.publish_ledger forget videos/demo.mp4 douyin account
+"""
+import argparse
+import hashlib
+import mmap
+import os
+import sqlite3
+import time
+from contextlib import closing
+from pathlib import Path
+
+from conf import DB_DIR
+from utils.sqlite_db import open_db
+
+# 每次交给哈希函数的数据量
+HASH_CHUNK_SIZE = 16 * 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS published (
+    content_hash TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    account TEXT NOT NULL,
+    post_id TEXT,
+    video_path TEXT,
+    published_at REAL NOT NULL,
+    PRIMARY KEY (content_hash, platform, account)
+);
+"""
+
+
+def hash_file(path) -> str:
+    """按大块读取（mmap）计算文件的 blake2b 哈希，不会把整个文件读进内存"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return digest.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf, memoryview(buf) as view:
+            for offset in range(0, len(view), HASH_CHUNK_SIZE):
+                digest.update(view[offset:offset + HASH_CHUNK_SIZE])
+    return digest.hexdigest()
+
+
+class PublishLedger(object):
+    """
+    发布记录和文件哈希缓存，保存在 db/publish_ledger.db 中
+
+    - content_hash 缓存文件哈希，文件大小或修改时间变化后重新计算
+    - is_published / record 按 (内容哈希, 平台, 账号) 查询和记录，同一个视频可以分别发布到不同账号
+    """
+
+    def __init__(self, db_path=None):
+        self.db_path = Path(db_path or DB_DIR / "publish_ledger.db")
+
+    def _connect(self):
+        return open_db(self.db_path, SCHEMA, sqlite3.Row)
+
+    def content_hash(self, video_path) -> str:
+        path = os.path.abspath(str(video_path))
+        stat = os.stat(path)
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT size, mtime_ns, content_hash FROM file_hashes WHERE path = ?",
+                               (path,)).fetchone()
+        if row is not None and row["size"] == stat.st_size and row["mtime_ns"] == stat.st_mtime_ns:
+            return row["content_hash"]
+        content_hash = hash_file(path)
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, content_hash) VALUES (?, ?, ?, ?)",
+                         (path, stat.st_size, stat.st_mtime_ns, content_hash))
+        return content_hash
+
+    def is_published(self, video_path, platform, account):
+        """已经发布过时返回发布记录（sqlite3.Row），否则返回 None"""
+        content_hash = self.content_hash(video_path)
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT * FROM published WHERE content_hash = ? AND platform = ? AND account = ?",
+                                (content_hash, platform, account)).fetchone()
+
+    def lookup(self, content_hashes, platform, account) -> dict:
+        """按内容哈希批量查询发布记录，返回 {内容哈希: 发布记录}"""
+        content_hashes = list(content_hashes)
+        if not content_hashes:
+            return {}
+        with closing(self._connect()) as conn:
+            rows = conn.execute(f"SELECT * FROM published WHERE platform = ? AND account = ? AND content_hash IN "
+                                f"({', '.join('?' * len(content_hashes))})",
+                                [platform, account] + content_hashes).fetchall()
+        return {row["content_hash"]: row for row in rows}
+
+    def record(self, video_path, platform, account, post_id=None):
+        content_hash = self.content_hash(video_path)
+        with closing(self._connect()) as conn:
+            conn.execute("INSERT OR REPLACE INTO published (content_hash, platform, account, post_id, video_path, "
+                         "published_at) VALUES (?, ?, ?, ?, ?, ?)",
+                         (content_hash, platform, account, None if post_id is None else str(post_id),
+                          os.path.abspath(str(video_path)), time.time()))
+
+    def forget(self, video_path, platform, account) -> bool:
+        """删除发布记录，之后可以重新发布"""
+        content_hash = self.content_hash(video_path)
+        with closing(self._connect()) as conn:
+            cursor = conn.execute("DELETE FROM published WHERE content_hash = ? AND platform = ? AND account = ?",
+                                  (content_hash, platform, account))
+        return cursor.rowcount > 0
+
+    def entries(self, platform=None, account=None) -> list:
+        sql = "SELECT * FROM published WHERE 1 = 1"
+        params = []
+        if platform:
+            sql += " AND platform = ?"
+            params.append(platform)
+        if account:
+            sql += " AND account = ?"
+            params.append(account)
+        with closing(self._connect()) as conn:
+            return conn.execute(sql + " ORDER BY published_at", params).fetchall()
+
+    def filter_unpublished(self, files, platform, account) -> list:
+        """过滤掉已经在该平台账号发布过的视频，并打印原因"""
+        unpublished = []
+        for file in files:
+            entry = self.is_published(file, platform, account)
+            if entry is not None:
+                print(f"跳过：{file} 已于 {format_time(entry['published_at'])} 发布到 {platform}:{account}")
+                continue
+            unpublished.append(file)
+        return unpublished
+
+
+def format_time(timestamp):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
+
+
+publish_ledger = PublishLedger()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="视频发布记录")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    list_parser = subparsers.add_parser("list", help="列出发布记录")
+    list_parser.add_argument("--platform")
+    list_parser.add_argument("--account")
+    forget_parser = subparsers.add_parser("forget", help="删除一条发布记录，之后可以重新发布")
+    forget_parser.add_argument("video_file")
+    forget_parser.add_argument("platform")
+    forget_parser.add_argument("account")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for entry in publish_ledger.entries(args.platform, args.account):
+            print(f"{format_time(entry['published_at'])} {entry['platform']}:{entry['account']} "
+                  f"{entry['post_id'] or '-'} {entry['video_path']}")
+    elif args.command == "forget":
+        print("已删除" if publish_ledger.forget(args.video_file, args.platform, args.account) else "没有发布记录")
+
+
+if __name__ == '__main__':
+    main()
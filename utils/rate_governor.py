@@ -0,0 +1,173 @@
+import random
+import time
+from contextlib import closing
+from datetime import date
+from pathlib import Path
+
+from loguru import logger
+
+from conf import DB_DIR, RATE_GOVERNOR_POLICIES
+from utils.sqlite_db import open_db
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS publish_slots (
+    platform TEXT NOT NULL,
+    account TEXT NOT NULL,
+    next_allowed REAL NOT NULL DEFAULT 0,
+    day TEXT NOT NULL DEFAULT '',
+    day_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (platform, account)
+);
+"""
+
+
+class DailyCapReached(Exception):
+    """该账号今天的发布次数已经用完"""
+
+
+class RateGovernor(object):
+    """
+    按 (平台, 账号) 控制发布频率，替代每次上传后固定 sleep(30)
+
+    - 同一账号两次发布之间至少间隔 min_interval 秒，再加上 0 ~ jitter 秒的随机抖动，间隔从上一次上传结束算起
+    - 每个账号每天最多成功发布 daily_cap 次（按本地日期），失败的上传不计入
+    - 状态保存在 SQLite 中，多个进程上传同一账号时也会排队；不同账号、不同平台互不影响
+
+        with rate_governor.slot("xhs", "account1"):
+            xhs_client.create_video_note(...)
+
+    策略见 conf.RATE_GOVERNOR_POLICIES，按 "平台:账号"、"平台"、"default" 的顺序查找。
+    """
+
+    def __init__(self, db_path=None, policies=None):
+        self.db_path = Path(db_path or DB_DIR / "rate_governor.db")
+        self.policies = policies or RATE_GOVERNOR_POLICIES
+
+    def _connect(self):
+        return open_db(self.db_path, SCHEMA)
+
+    def policy(self, platform, account, **overrides) -> dict:
+        policy = dict(self.policies.get("default", {}))
+        policy.update(self.policies.get(platform, {}))
+        policy.update(self.policies.get(f"{platform}:{account}", {}))
+        policy.update({k: v for k, v in overrides.items() if v is not None})
+        return policy
+
+    def _transaction(self, platform, account, update):
+        """在 BEGIN IMMEDIATE 事务里读出该账号的记录，update(row) 返回 (新记录, 返回值)"""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT next_allowed, day, day_count FROM publish_slots "
+                               "WHERE platform = ? AND account = ?", (platform, account)).fetchone()
+            (next_allowed, day, day_count), result = update(row or (0.0, "", 0))
+            conn.execute("INSERT OR REPLACE INTO publish_slots (platform, account, next_allowed, day, day_count) "
+                         "VALUES (?, ?, ?, ?, ?)", (platform, account, next_allowed, day, day_count))
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def check_daily_cap(self, platform, account, **overrides):
+        """
+        Raises:
+            DailyCapReached: 今天的次数已经用完
+        """
+        self.delay(platform, account, **overrides)
+
+    def delay(self, platform, account, **overrides) -> float:
+        """
+        该账号距离下一次允许发布还要等多少秒，不占用名额
+
+        Raises:
+            DailyCapReached: 今天的次数已经用完
+        """
+        policy = self.policy(platform, account, **overrides)
+        today = date.today().isoformat()
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT next_allowed, day, day_count FROM publish_slots "
+                               "WHERE platform = ? AND account = ?", (platform, account)).fetchone()
+        if row is None:
+            return 0.0
+        next_allowed, day, day_count = row
+        if policy.get("daily_cap") and day == today and day_count >= policy["daily_cap"]:
+            raise DailyCapReached(f"{platform}:{account} 今天已发布 {day_count} 次")
+        return max(0.0, next_allowed - time.time())
+
+    def acquire(self, platform, account, block=True, **overrides) -> float:
+        """
+        占用该账号的下一个发布时间，block 为 True 时睡眠到允许发布为止；当天次数在 release 成功时才计入
+
+        Returns:
+            需要等待（或已经等待）的秒数
+
+        Raises:
+            DailyCapReached: 今天的次数已经用完
+        """
+        policy = self.policy(platform, account, **overrides)
+        today = date.today().isoformat()
+
+        def update(row):
+            next_allowed, day, day_count = row
+            if day != today:
+                day, day_count = today, 0
+            if policy.get("daily_cap") and day_count >= policy["daily_cap"]:
+                raise DailyCapReached(f"{platform}:{account} 今天已发布 {day_count} 次")
+            start = max(time.time(), next_allowed)
+            # 先按开始时间占位，同一账号的其他进程排在后面；上传结束后 release 再往后推
+            return (start + policy.get("min_interval", 0), day, day_count), start - time.time()
+
+        wait = max(0.0, self._transaction(platform, account, update))
+        if wait and block:
+            logger.info(f"{platform}:{account} 距离上次发布间隔不足，等待 {wait:.0f} 秒")
+            time.sleep(wait)
+        return wait
+
+    def release(self, platform, account, success=True, **overrides):
+        """
+        上传结束，从现在起重新计算最小间隔并加上随机抖动
+
+        只有 success 为 True 时才计入当天的发布次数，失败或中途崩溃的上传不占用每日上限。
+        """
+        policy = self.policy(platform, account, **overrides)
+        interval = policy.get("min_interval", 0) + random.uniform(0, policy.get("jitter", 0))
+        today = date.today().isoformat()
+
+        def update(row):
+            next_allowed, day, day_count = row
+            if success:
+                if day != today:
+                    day, day_count = today, 0
+                day_count += 1
+            return (max(next_allowed, time.time() + interval), day, day_count), None
+
+        self._transaction(platform, account, update)
+
+    def slot(self, platform, account, **overrides):
+        return _GovernorSlot(self, platform, account, overrides)
+
+
+class _GovernorSlot(object):
+    def __init__(self, governor, platform, account, overrides):
+        self.governor = governor
+        self.platform = platform
+        self.account = account
+        self.overrides = overrides
+        self.waited = 0.0
+        # 上传没有抛出异常但实际失败时，调用方把它设为 False，这次上传不计入每日上限
+        self.success = True
+
+    def __enter__(self):
+        self.waited = self.governor.acquire(self.platform, self.account, **self.overrides)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.governor.release(self.platform, self.account, success=exc_type is None and self.success,
+                              **self.overrides)
+
+
+rate_governor = RateGovernor()
@@ -0,0 +1,151 @@
+import threading
+import time
+from pathlib import Path
+
+from conf import DB_DIR
+from utils.sqlite_db import open_db
+
+RATE_LIMIT_DB = Path(DB_DIR / "rate_limit.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS token_buckets (
+    name TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    rate_factor REAL NOT NULL DEFAULT 1.0
+);
+"""
+
+# 兼容没有 rate_factor 列的旧库
+MIGRATIONS = ["ALTER TABLE token_buckets ADD COLUMN rate_factor REAL NOT NULL DEFAULT 1.0"]
+
+
+class TokenBucket(object):
+    """
+    保存在 SQLite 中的令牌桶，同一台机器上的多个进程共用同一个 name 就共享同一份额度
+
+    consume 允许透支：先扣掉令牌，余额为负时睡眠到补足为止。这样一次取走的量可以大于桶容量
+    （例如一个 10MB 的分片），整体速率仍然不超过 rate。
+
+    被限流时调用 penalize 把实际速率降为 rate * rate_factor，之后每次成功调用 recover 慢慢恢复，
+    rate_factor 同样保存在 SQLite 中，所有进程一起减速。
+    """
+
+    def __init__(self, name, rate, capacity=None, db_path=RATE_LIMIT_DB, min_factor=0.05, recover_step=0.05):
+        self.name = name
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.min_factor = min_factor
+        self.recover_step = recover_step
+        self.db_path = Path(db_path)
+
+    def _connect(self):
+        return open_db(self.db_path, SCHEMA, migrations=MIGRATIONS)
+
+    def _update(self, amount=0.0, factor=None, drain=False):
+        """
+        在一个事务里补充令牌、扣除 amount，factor(old) 返回新的 rate_factor，drain 清空剩余令牌
+
+        Returns:
+            (剩余令牌, 当前实际速率)
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tokens, updated_at, rate_factor FROM token_buckets WHERE name = ?",
+                               (self.name,)).fetchone()
+            rate_factor = 1.0 if row is None else row[2]
+            rate = self.rate * rate_factor
+            tokens = self.capacity if row is None else min(self.capacity, row[0] + (now - row[1]) * rate)
+            tokens -= amount
+            if drain:
+                tokens = min(tokens, 0.0)
+            if factor is not None:
+                rate_factor = max(self.min_factor, min(1.0, factor(rate_factor)))
+            conn.execute("INSERT OR REPLACE INTO token_buckets (name, tokens, updated_at, rate_factor) "
+                         "VALUES (?, ?, ?, ?)", (self.name, tokens, now, rate_factor))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return tokens, self.rate * rate_factor
+
+    def reserve(self, amount) -> float:
+        """扣除 amount 个令牌，返回需要等待的秒数"""
+        tokens, rate = self._update(amount)
+        return max(0.0, -tokens / rate)
+
+    def penalize(self, decrease=0.5):
+        """遇到限流：速率乘以 decrease，并清空已经攒下的令牌"""
+        self._update(factor=lambda rate_factor: rate_factor * decrease, drain=True)
+
+    def recover(self):
+        self._update(factor=lambda rate_factor: rate_factor + self.recover_step)
+
+    def consume(self, amount) -> float:
+        wait = self.reserve(amount)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class AIMDController(object):
+    """
+    按吞吐量自适应调整并发数（加性增、乘性减）
+
+    - 每完成 limit 个任务为一个窗口，计算窗口内的总吞吐
+    - 吞吐比历史最好值高出 gain 以上：并发 +1
+    - 吞吐比历史最好值低 drop 以上，或者有请求出错：并发乘以 decrease
+    - 其余情况（已经到了带宽瓶颈）保持不变
+    """
+
+    def __init__(self, min_limit, max_limit, initial=None, decrease=0.5, gain=0.1, drop=0.3):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = max(min_limit, min(max_limit, initial or min_limit))
+        self.decrease = decrease
+        self.gain = gain
+        self.drop = drop
+        self.best_throughput = 0.0
+        self._lock = threading.Lock()
+        self._window_start = None
+        self._window_bytes = 0
+        self._window_count = 0
+
+    def _reset_window(self):
+        self._window_start = time.monotonic()
+        self._window_bytes = 0
+        self._window_count = 0
+
+    def on_start(self):
+        with self._lock:
+            if self._window_start is None:
+                self._reset_window()
+
+    def on_success(self, size):
+        with self._lock:
+            if self._window_start is None:
+                self._reset_window()
+            self._window_bytes += size
+            self._window_count += 1
+            if self._window_count < self.limit:
+                return
+            throughput = self._window_bytes / max(time.monotonic() - self._window_start, 1e-6)
+            if throughput > self.best_throughput * (1 + self.gain):
+                self.best_throughput = throughput
+                self.limit = min(self.max_limit, self.limit + 1)
+            elif throughput < self.best_throughput * (1 - self.drop):
+                # 网络变差或者其他任务在抢带宽，重新从当前水平开始比较
+                self.best_throughput = throughput
+                self.limit = max(self.min_limit, int(self.limit * self.decrease))
+            self._reset_window()
+
+    def on_error(self):
+        with self._lock:
+            self.limit = max(self.min_limit, int(self.limit * self.decrease))
+            self.best_throughput = 0.0
+            self._reset_window()
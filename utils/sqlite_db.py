@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+db 目录下各个 SQLite 数据库（任务队列、发布记录、视频库索引、限流状态等）共用的连接方式
+
+- WAL 模式，读写互不阻塞；其他进程正在写入时最多等待 30 秒
+- autocommit（isolation_level=None），需要事务时显式执行 BEGIN IMMEDIATE
+- 第一次打开某个数据库时才创建目录和表，import 模块不会产生文件
+"""
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+# 本进程中已经建过表的数据库
+_initialized = set()
+
+
+def open_db(db_path, schema, row_factory=None, migrations=()):
+    """
+    打开数据库连接，调用方负责关闭（with closing(open_db(...)) as conn）
+
+    Args:
+        schema: 建表语句，需要使用 CREATE ... IF NOT EXISTS
+        migrations: 兼容旧库的语句（例如 ALTER TABLE ADD COLUMN），已经执行过时的报错会被忽略
+    """
+    db_path = str(db_path)
+    if db_path not in _initialized:
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        with closing(sqlite3.connect(db_path, timeout=30, isolation_level=None)) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(schema)
+            for statement in migrations:
+                try:
+                    conn.execute(statement)
+                except sqlite3.OperationalError:
+                    pass
+        _initialized.add(db_path)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    if row_factory is not None:
+        conn.row_factory = row_factory
+    return conn
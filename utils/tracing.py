@@ -0,0 +1,184 @@
+import contextvars
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+from conf import BASE_DIR
+
+TRACE_FILE = Path(BASE_DIR / "logs" / "trace.jsonl")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_trace_attrs = contextvars.ContextVar("trace_attrs", default={})
+_span_ids = itertools.count(1)
+_write_lock = threading.Lock()
+_trace_file = None
+
+
+def _write(record: dict):
+    global _trace_file
+    with _write_lock:
+        if _trace_file is None:
+            TRACE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            _trace_file = open(TRACE_FILE, "a", encoding="utf-8", buffering=1)
+        _trace_file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+
+def set_trace_file(path):
+    """把后续的 span 写到另一个文件，例如基准测试单独输出"""
+    global TRACE_FILE, _trace_file
+    with _write_lock:
+        if _trace_file is not None:
+            _trace_file.close()
+            _trace_file = None
+        TRACE_FILE = Path(path)
+
+
+def load_spans(jsonl_file=None):
+    with open(jsonl_file or TRACE_FILE, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class trace_context(object):
+    """
+    给当前上下文内的所有 span 附加 platform / account / job_id 等属性，asyncio 任务之间互不影响
+
+        with trace_context(platform="douyin", account=account_file):
+            await app.main()
+    """
+
+    def __init__(self, **attrs):
+        self.attrs = {k: str(v) for k, v in attrs.items() if v is not None}
+        self._token = None
+
+    def __enter__(self):
+        self._token = _trace_attrs.set({**_trace_attrs.get(), **self.attrs})
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _trace_attrs.reset(self._token)
+
+
+class span(object):
+    """
+    记录一段耗时，嵌套的 span 会记录 parent_id，结束时写入 logs/trace.jsonl
+
+        with span("add_title_tags"):
+            ...
+    """
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.span_id = None
+        self.parent_id = None
+        self.trace_id = None
+        self._token = None
+        self._start = None
+        self._start_wall = None
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.span_id = f"{os.getpid()}-{next(_span_ids)}"
+        self.parent_id = parent.span_id if parent else None
+        # 没有父 span 的就是一次完整流程的根
+        self.trace_id = parent.trace_id if parent else self.span_id
+        self._token = _current_span.set(self)
+        self._start_wall = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+        attrs = dict(self.attrs)
+        if exc_type is not None:
+            attrs["error"] = f"{exc_type.__name__}: {exc}"
+        _emit(self.name, self._start_wall, duration, self.span_id, self.parent_id, self.trace_id,
+              "error" if exc_type is not None else "ok", attrs)
+
+
+def _emit(name, start, duration, span_id, parent_id, trace_id, status, attrs):
+    record = {
+        "name": name,
+        "trace_id": trace_id,
+        "span_id": span_id,
+        "parent_id": parent_id,
+        "start": start,
+        "duration_ms": round(duration * 1000, 3),
+        "status": status,
+        **_trace_attrs.get(),
+        **attrs,
+    }
+    try:
+        _write(record)
+    except OSError:
+        # 写 trace 失败不能影响上传
+        pass
+
+
+def record_span(name, start, duration, status="ok", **attrs):
+    """记录一段已经测量好的耗时（例如 utils.waits 中的等待），作为当前 span 的子 span"""
+    parent = _current_span.get()
+    span_id = f"{os.getpid()}-{next(_span_ids)}"
+    _emit(name, start, duration, span_id, parent.span_id if parent else None,
+          parent.trace_id if parent else span_id, status, attrs)
+
+
+def traced(name=None):
+    """
+    异步函数装饰器，整个调用过程记录为一个 span
+
+        @traced()
+        async def add_title_tags(self, page): ...
+    """
+
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(span_name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def export_chrome_trace(jsonl_file=None, output_file=None):
+    """
+    把 trace.jsonl 转成 Chrome trace-event 格式，可以在 chrome://tracing 或 Perfetto 中打开
+
+    同一个 trace（一次上传）放在同一行（tid），不同进程按 pid 区分
+    """
+    jsonl_file = Path(jsonl_file or TRACE_FILE)
+    output_file = Path(output_file or jsonl_file.with_suffix(".trace.json"))
+    events = []
+    thread_ids = {}
+    for record in load_spans(jsonl_file):
+        pid = int(record["span_id"].split("-")[0])
+        tid = thread_ids.setdefault(record["trace_id"], len(thread_ids) + 1)
+        args = {k: v for k, v in record.items() if k not in ("name", "start", "duration_ms")}
+        events.append({
+            "name": record["name"],
+            "cat": record.get("platform", "upload"),
+            "ph": "X",
+            "ts": record["start"] * 1e6,
+            "dur": record["duration_ms"] * 1e3,
+            "pid": pid,
+            "tid": tid,
+            "args": args,
+        })
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+    return output_file
+
+
+if __name__ == "__main__":
+    # python -m utils.tracing [logs/trace.jsonl] [output.json]
+    print(export_chrome_trace(*sys.argv[1:3]))
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+上传前的转码 / 重新封装：按平台要求把视频处理成平台直接接受的格式
+
+- 编码、分辨率或码率不符合平台配置（conf.TRANSCODE_PROFILES）时转码为 H.264/AAC
+- moov 在文件末尾时只重新封装（-c copy -movflags +faststart），平台可以边收边处理，不用等上传完再解析
+- 其余情况直接使用原文件
+
+处理在进程池中进行，输出按 (内容哈希, 处理方式, 配置) 保存在 db/cache/transcode 中，同一个视频再次发布时直接复用。
+prepare 立即返回 Future，批量上传时先为所有视频提交任务，上传前一个视频的同时处理后面的视频：
+
+    futures = [transcoder.prepare(file, "tencent") for file in files]
+    for file, future in zip(files, futures):
+        upload(future.result())
+
+没有安装 ffmpeg 时不做任何处理，直接使用原文件。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+
+from loguru import logger
+
+from conf import DB_DIR, TRANSCODE_CACHE_MAX_BYTES, TRANSCODE_FFMPEG, TRANSCODE_PROFILES, TRANSCODE_WORKERS
+from utils.media_probe import MediaProbeError, parse_mp4
+from utils.publish_ledger import publish_ledger
+
+TRANSCODE_CACHE_DIR = Path(DB_DIR / "cache" / "transcode")
+
+ACTION_REMUX = "remux"
+ACTION_TRANSCODE = "transcode"
+
+
+def prune_cache_dir(cache_dir, max_bytes):
+    """目录超过 max_bytes 时按修改时间删除最早的文件（命中缓存时会更新修改时间）"""
+    cache_dir = Path(cache_dir)
+    if not max_bytes or not cache_dir.exists():
+        return
+    files = sorted((entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                   for entry in os.scandir(cache_dir) if entry.is_file() and ".tmp" not in entry.name)
+    total = sum(size for _, size, _ in files)
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        os.unlink(path)
+        total -= size
+
+
+def get_profile(platform=None) -> dict:
+    profile = dict(TRANSCODE_PROFILES.get("default", {}))
+    profile.update(TRANSCODE_PROFILES.get(platform, {}))
+    return profile
+
+
+def plan(info, profile):
+    """根据视频信息决定处理方式：ACTION_TRANSCODE、ACTION_REMUX 或 None（直接使用原文件）"""
+    if profile.get("video_codecs") and info.video_codec not in profile["video_codecs"]:
+        return ACTION_TRANSCODE
+    if profile.get("audio_codecs") and info.audio_codec is not None and info.audio_codec not in profile["audio_codecs"]:
+        return ACTION_TRANSCODE
+    if profile.get("max_long_side") and max(info.width or 0, info.height or 0) > profile["max_long_side"]:
+        return ACTION_TRANSCODE
+    if profile.get("max_bitrate") and (info.bitrate or 0) > profile["max_bitrate"]:
+        return ACTION_TRANSCODE
+    if not info.faststart:
+        return ACTION_REMUX
+    return None
+
+
+def build_command(ffmpeg, src, dst, action, profile, threads):
+    command = [ffmpeg, "-y", "-v", "error", "-i", str(src), "-map", "0:v:0", "-map", "0:a:0?"]
+    if action == ACTION_REMUX:
+        command += ["-c", "copy"]
+    else:
+        long_side = profile.get("max_long_side")
+        if long_side:
+            # 按长边缩放，横竖屏都适用，不放大
+            command += ["-vf", f"scale='if(gte(iw,ih),min(iw,{long_side}),-2)':'if(gte(iw,ih),-2,min(ih,{long_side}))'"]
+        command += ["-c:v", "libx264", "-preset", profile.get("preset", "veryfast"), "-crf", str(profile.get("crf", 20)),
+                    "-pix_fmt", "yuv420p", "-c:a", "aac", "-b:a", profile.get("audio_bitrate", "192k")]
+        if profile.get("max_bitrate"):
+            command += ["-maxrate", str(profile["max_bitrate"]), "-bufsize", str(profile["max_bitrate"] * 2)]
+    command += ["-movflags", "+faststart", "-threads", str(threads), str(dst)]
+    return command
+
+
+def prepare_file(video_file, profile, cache_dir, ffmpeg, threads=0) -> str:
+    """
+    在进程池中执行：返回应该上传的文件路径（原文件或缓存中处理好的文件）
+
+    Raises:
+        subprocess.CalledProcessError: ffmpeg 处理失败
+    """
+    try:
+        action = plan(parse_mp4(video_file), profile)
+    except MediaProbeError:
+        # 无法解析的文件交给上传前的预检处理
+        return str(video_file)
+    if action is None:
+        return str(video_file)
+
+    profile_key = hashlib.sha1(json.dumps([action, profile], sort_keys=True).encode()).hexdigest()[:8]
+    output = Path(cache_dir) / f"{publish_ledger.content_hash(video_file)}-{action}-{profile_key}.mp4"
+    if output.exists():
+        # 更新修改时间，清理缓存时按修改时间淘汰
+        os.utime(output)
+        return str(output)
+
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = output.with_suffix(f".{os.getpid()}.tmp.mp4")
+    start = time.perf_counter()
+    try:
+        subprocess.run(build_command(ffmpeg, video_file, tmp_file, action, profile, threads),
+                       check=True, stdin=subprocess.DEVNULL, capture_output=True)
+        os.replace(tmp_file, output)
+    finally:
+        if tmp_file.exists():
+            tmp_file.unlink()
+    logger.info(f"{video_file} {action} 完成，耗时 {time.perf_counter() - start:.1f}s -> {output.name}")
+    return str(output)
+
+
+class Transcoder(object):
+    """
+    按 CPU 核数创建进程池处理视频，同一个 (文件, 平台) 处理完成之前只提交一次
+
+    处理失败时记录日志并回退为原文件，不影响上传。
+    """
+
+    def __init__(self, cache_dir=TRANSCODE_CACHE_DIR, workers=TRANSCODE_WORKERS, ffmpeg=TRANSCODE_FFMPEG,
+                 cache_max_bytes=TRANSCODE_CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.workers = workers or os.cpu_count() or 1
+        self.ffmpeg = ffmpeg
+        self.cache_max_bytes = cache_max_bytes
+        self._executor = None
+        self._futures = {}
+        # 任务已经完成时 add_done_callback 会在 prepare 持有锁的线程中直接调用 _resolve
+        self._lock = threading.RLock()
+
+    @property
+    def available(self):
+        return shutil.which(self.ffmpeg) is not None
+
+    def prepare(self, video_file, platform=None) -> Future:
+        """提交处理任务，返回结果为上传文件路径的 Future"""
+        path = os.path.abspath(str(video_file))
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        with self._lock:
+            if stat is None or not self.available:
+                # 文件不存在时交给上传步骤报错
+                future = Future()
+                future.set_result(str(video_file))
+                return future
+            # 文件被覆盖后大小或修改时间会变化，不会拿到旧文件的结果
+            key = (path, stat.st_size, stat.st_mtime_ns, platform)
+            if key in self._futures:
+                return self._futures[key]
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(self.workers)
+            # 按同时运行的 ffmpeg 数量平分 CPU 核数：只有一个视频要处理时用满所有核，
+            # 而不是按进程池大小固定分给每个任务 1 个线程
+            running = min(self.workers, len(self._futures) + 1)
+            threads = max(1, (os.cpu_count() or 1) // running)
+            inner = self._executor.submit(prepare_file, path, get_profile(platform), str(self.cache_dir),
+                                          self.ffmpeg, threads)
+            future = Future()
+            self._futures[key] = future
+            inner.add_done_callback(lambda done: self._resolve(key, future, done, str(video_file), platform))
+            return future
+
+    def _resolve(self, key, future, done, video_file, platform):
+        # 只合并进行中的任务，完成后移除，长时间运行的进程不会一直持有所有处理过的文件
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+        try:
+            future.set_result(done.result())
+        except Exception as e:
+            stderr = getattr(e, "stderr", b"") or b""
+            logger.warning(f"{video_file} 处理为 {platform} 格式失败，使用原文件上传: {e} "
+                           f"{stderr.decode(errors='replace').strip()[-500:]}")
+            future.set_result(video_file)
+
+    async def prepare_async(self, video_file, platform=None) -> str:
+        return await asyncio.wrap_future(self.prepare(video_file, platform))
+
+    def prune(self):
+        prune_cache_dir(self.cache_dir, self.cache_max_bytes)
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            self._futures.clear()
+        self.prune()
+
+
+transcoder = Transcoder()
@@ -0,0 +1,191 @@
+import asyncio
+import itertools
+import json
+import re
+import time
+
+from loguru import logger
+
+UPLOAD_SUCCESS = "success"
+UPLOAD_FAILURE = "failure"
+
+# 上传分片/提交接口的响应只用来触发一次页面检查，匹配宽一点也不会误判上传完成
+DEFAULT_RESPONSE_PATTERN = r"upload|commit|finish"
+
+_binding_ids = itertools.count()
+
+OBSERVER_SCRIPT = """
+(() => {
+    const existing = window[%(detector)s];
+    if (existing) {
+        existing.arm();
+        return;
+    }
+    const isSuccess = () => (%(success)s);
+    const isFailure = () => (%(failure)s);
+    const detector = {armed: true, timer: null};
+    const check = () => {
+        detector.timer = null;
+        if (!detector.armed) return;
+        let status = null;
+        try {
+            if (isSuccess()) status = %(UPLOAD_SUCCESS)s;
+            else if (isFailure()) status = %(UPLOAD_FAILURE)s;
+        } catch (e) {
+            return;
+        }
+        if (status) {
+            detector.armed = false;
+            window[%(binding)s](status);
+        }
+    };
+    // 进度条等会频繁修改 DOM，合并 %(throttle)s 毫秒内的变化只检查一次
+    detector.schedule = () => {
+        if (!detector.timer) detector.timer = setTimeout(check, %(throttle)s);
+    };
+    detector.arm = () => {
+        detector.armed = true;
+        detector.schedule();
+    };
+    detector.stop = () => {
+        detector.armed = false;
+        detector.observer.disconnect();
+        delete window[%(detector)s];
+    };
+    detector.observer = new MutationObserver(detector.schedule);
+    detector.observer.observe(document.documentElement,
+        {childList: true, subtree: true, attributes: true, characterData: true});
+    window[%(detector)s] = detector;
+    check();
+})()
+"""
+
+
+def js_has_text(selector: str, text: str) -> str:
+    """
+    生成 JS 表达式：selector 匹配的元素中是否有包含 text 的元素，相当于 playwright 的 selector:has-text("text")
+    """
+    return (f"Array.from(document.querySelectorAll({json.dumps(selector)}))"
+            f".some(el => el.textContent.includes({json.dumps(text, ensure_ascii=False)}))")
+
+
+def js_exists(selector: str) -> str:
+    return f"!!document.querySelector({json.dumps(selector)})"
+
+
+class UploadCompletionDetector(object):
+    """
+    基于事件的视频上传完成检测，替代每 2 秒查询一次 DOM 的轮询
+
+    - 在页面（或上传所在的 iframe）里挂一个 MutationObserver，DOM 变化时检查 success_js / failure_js，
+      命中后通过 expose_binding 回调通知 Python 侧
+    - 匹配 response_pattern 的网络响应会触发一次立即检查
+    - 每隔 fallback_interval 秒兜底检查一次，防止 observer 因为页面重绘/iframe 重建丢失
+
+    用法：
+        async with UploadCompletionDetector(page, success_js, failure_js) as detector:
+            while await detector.wait() == UPLOAD_FAILURE:
+                await handle_upload_error(page)
+    """
+
+    def __init__(self, page, success_js, failure_js="false", frame=None, response_pattern=DEFAULT_RESPONSE_PATTERN,
+                 fallback_interval=15, throttle_ms=200, log=logger):
+        self.page = page
+        self.frame = frame or page.main_frame
+        self.success_js = success_js
+        self.failure_js = failure_js
+        self.response_pattern = re.compile(response_pattern, re.I) if response_pattern else None
+        self.fallback_interval = fallback_interval
+        self.throttle_ms = throttle_ms
+        self.log = log
+        binding_id = next(_binding_ids)
+        self._binding = f"__uploadStatus{binding_id}"
+        self._detector = f"__uploadDetector{binding_id}"
+        self._future = None
+        self._started = False
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def start(self):
+        if self._started:
+            return
+        await self.page.expose_binding(self._binding, self._on_status)
+        self.page.on("response", self._on_response)
+        self.page.on("requestfailed", self._on_response)
+        self._started = True
+
+    async def stop(self):
+        if not self._started:
+            return
+        self.page.remove_listener("response", self._on_response)
+        self.page.remove_listener("requestfailed", self._on_response)
+        self._started = False
+        try:
+            await self.frame.evaluate(f"window[{json.dumps(self._detector)}] && window[{json.dumps(self._detector)}].stop()")
+        except Exception:
+            pass
+
+    def _on_status(self, source, status):
+        if self._future is not None and not self._future.done():
+            self._future.set_result(status)
+
+    def _on_response(self, response):
+        if self._future is None or self._future.done():
+            return
+        if self.response_pattern and self.response_pattern.search(response.url):
+            asyncio.ensure_future(self._poke())
+
+    async def _poke(self):
+        try:
+            await self.frame.evaluate(
+                f"window[{json.dumps(self._detector)}] && window[{json.dumps(self._detector)}].schedule()")
+        except Exception:
+            pass
+
+    async def _arm(self):
+        """安装 observer；已经安装过的话重新开始检查"""
+        script = OBSERVER_SCRIPT % {
+            "detector": json.dumps(self._detector),
+            "binding": json.dumps(self._binding),
+            "success": self.success_js,
+            "failure": self.failure_js,
+            "throttle": int(self.throttle_ms),
+            "UPLOAD_SUCCESS": json.dumps(UPLOAD_SUCCESS),
+            "UPLOAD_FAILURE": json.dumps(UPLOAD_FAILURE),
+        }
+        try:
+            await self.frame.evaluate(script)
+        except Exception as e:
+            # 页面正在跳转或 iframe 被重建，等下一次兜底检查重新安装
+            self.log.debug(f"upload detector not installed yet: {e}")
+
+    async def wait(self, timeout=None) -> str:
+        """
+        等待上传结束
+
+        Returns:
+            UPLOAD_SUCCESS 或 UPLOAD_FAILURE，失败后处理完错误可以再次调用 wait 继续等待
+
+        Raises:
+            asyncio.TimeoutError: timeout 秒内既没有成功也没有失败
+        """
+        await self.start()
+        self._future = asyncio.get_running_loop().create_future()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        await self._arm()
+        while True:
+            wait_time = self.fallback_interval
+            if deadline is not None:
+                wait_time = min(wait_time, deadline - time.monotonic())
+                if wait_time <= 0:
+                    raise asyncio.TimeoutError(f"upload not finished in {timeout} seconds")
+            try:
+                return await asyncio.wait_for(asyncio.shield(self._future), wait_time)
+            except asyncio.TimeoutError:
+                self.log.info("  [-] 正在上传视频中...")
+                await self._arm()
@@ -0,0 +1,150 @@
+import asyncio
+import re
+import time
+from collections import defaultdict
+
+from loguru import logger
+
+from utils.tracing import record_span
+
+# name -> [次数, 总耗时, 最大耗时, 超时次数]
+_wait_stats = defaultdict(lambda: [0, 0.0, 0.0, 0])
+
+
+def record_wait(name, duration, timed_out=False):
+    stats = _wait_stats[name]
+    stats[0] += 1
+    stats[1] += duration
+    stats[2] = max(stats[2], duration)
+    stats[3] += int(timed_out)
+    logger.debug(f"wait {name}: {duration * 1000:.0f} ms{' (timeout)' if timed_out else ''}")
+    record_span(f"wait:{name}", time.time() - duration, duration, status="timeout" if timed_out else "ok")
+
+
+def get_wait_stats() -> dict:
+    """每种等待实际花费的时间，用于调整超时时间"""
+    return {name: {"count": count, "total": total, "max": maximum, "avg": total / count, "timeouts": timeouts}
+            for name, (count, total, maximum, timeouts) in _wait_stats.items()}
+
+
+async def wait_for_state(locator, state="visible", timeout=10000, name=None, raise_on_timeout=False) -> bool:
+    """
+    等待元素进入 state（attached / detached / visible / hidden）
+
+    Returns:
+        是否在 timeout 毫秒内满足条件，raise_on_timeout 为 False 时超时只返回 False
+    """
+    started = time.monotonic()
+    try:
+        await locator.wait_for(state=state, timeout=timeout)
+    except Exception:
+        record_wait(name or f"state:{state}", time.monotonic() - started, timed_out=True)
+        if raise_on_timeout:
+            raise
+        return False
+    record_wait(name or f"state:{state}", time.monotonic() - started)
+    return True
+
+
+async def wait_for_stable(locator, timeout=5000, stable_ms=150, interval=50, name=None) -> bool:
+    """
+    等待元素可见并且位置大小在 stable_ms 内不再变化（下拉框/弹窗的展开动画结束）
+    """
+    started = time.monotonic()
+    deadline = started + timeout / 1000
+    last_box = None
+    stable_since = None
+    while time.monotonic() < deadline:
+        try:
+            box = await locator.bounding_box(timeout=max(1, (deadline - time.monotonic()) * 1000))
+        except Exception:
+            box = None
+        now = time.monotonic()
+        if box is not None and box == last_box:
+            if now - stable_since >= stable_ms / 1000:
+                record_wait(name or "stable", now - started)
+                return True
+        else:
+            last_box = box
+            stable_since = now
+        await asyncio.sleep(interval / 1000)
+    record_wait(name or "stable", time.monotonic() - started, timed_out=True)
+    return False
+
+
+class NetworkIdle(object):
+    """
+    等待匹配 url_pattern 的请求全部结束并空闲 idle_ms 毫秒，在触发请求的操作之前进入：
+
+        async with NetworkIdle(page, r"search/sug"):
+            await page.keyboard.type("#tag")
+
+    退出时等待；first_request_timeout 毫秒内没有出现匹配的请求则直接返回，不会一直等到 timeout。
+    """
+
+    def __init__(self, page, url_pattern, idle_ms=300, timeout=10000, first_request_timeout=2000, name=None):
+        self.page = page
+        self.url_pattern = re.compile(url_pattern)
+        self.idle_ms = idle_ms
+        self.timeout = timeout
+        self.first_request_timeout = first_request_timeout
+        self.name = name or f"network_idle:{url_pattern}"
+        self.succeeded = False
+        self._inflight = set()
+        self._seen = False
+        self._last_activity = None
+        self._changed = asyncio.Event()
+
+    def _on_request(self, request):
+        if self.url_pattern.search(request.url):
+            self._inflight.add(request)
+            self._seen = True
+            self._touch()
+
+    def _on_request_done(self, request):
+        if request in self._inflight:
+            self._inflight.discard(request)
+            self._touch()
+
+    def _touch(self):
+        self._last_activity = time.monotonic()
+        self._changed.set()
+
+    async def __aenter__(self):
+        self.page.on("request", self._on_request)
+        self.page.on("requestfinished", self._on_request_done)
+        self.page.on("requestfailed", self._on_request_done)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.succeeded = await self.wait()
+        finally:
+            self.page.remove_listener("request", self._on_request)
+            self.page.remove_listener("requestfinished", self._on_request_done)
+            self.page.remove_listener("requestfailed", self._on_request_done)
+
+    async def wait(self) -> bool:
+        started = time.monotonic()
+        deadline = started + self.timeout / 1000
+        first_request_deadline = started + self.first_request_timeout / 1000
+        while True:
+            now = time.monotonic()
+            if self._seen and not self._inflight and now - self._last_activity >= self.idle_ms / 1000:
+                record_wait(self.name, now - started)
+                return True
+            if now >= deadline or (not self._seen and now >= first_request_deadline):
+                record_wait(self.name, now - started, timed_out=True)
+                return False
+            if not self._seen:
+                wake_at = first_request_deadline
+            elif self._inflight:
+                wake_at = deadline
+            else:
+                wake_at = self._last_activity + self.idle_ms / 1000
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), max(0.0, min(wake_at, deadline) - now))
+            except asyncio.TimeoutError:
+                pass
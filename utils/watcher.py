@@ -0,0 +1,225 @@
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import os
+import struct
+import time
+from pathlib import Path
+
+from utils.log import watcher_logger
+
+VIDEO_SUFFIX = ".mp4"
+SIDECAR_SUFFIX = ".txt"
+
+# 见 <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+class Inotify(object):
+    """
+    基于 ctypes 的极简 inotify 封装，只监听单个目录下新写入/移入的文件
+    """
+
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            raise OSError(errno.ENOSYS, "libc not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not supported on this platform")
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY
+        if libc.inotify_add_watch(self.fd, os.fsencode(str(directory)), mask) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {directory}")
+
+    def read_events(self):
+        """
+        读取当前所有可读事件
+
+        Returns:
+            (文件名列表, 是否发生了事件队列溢出)
+        """
+        names = []
+        overflow = False
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                _, mask, _, name_len = INOTIFY_EVENT.unpack_from(buffer, offset)
+                offset += INOTIFY_EVENT.size
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                name = buffer[offset:offset + name_len].rstrip(b"\0")
+                offset += name_len
+                if name:
+                    names.append(os.fsdecode(name))
+        return names, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+
+class VideoDirWatcher(object):
+    """
+    监听视频目录，把写入完成的 .mp4 + .txt 成对文件放入有界队列
+
+    - 优先使用 inotify，不可用时退化为按 poll_interval 扫描目录
+    - 文件的 size/mtime 在 settle_seconds 内保持不变才认为已经写完
+    - 队列满时 put 会阻塞，形成背压，待上传的文件只在内存中登记不会丢失
+    """
+
+    def __init__(self, directory, queue: asyncio.Queue, settle_seconds=5.0, poll_interval=10.0, scan_existing=False):
+        self.directory = Path(directory)
+        self.queue = queue
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.scan_existing = scan_existing
+        # stem -> 最近一次观察到的 (mp4 状态, txt 状态) 以及状态保持不变的起始时间
+        self._pending = {}
+        # 视频路径 -> 放入队列时的状态，只保留最近一次，文件删除后移除
+        self._emitted = {}
+        self._known = {}
+        self._wakeup = asyncio.Event()
+
+    def _mark_pending(self, name):
+        path = Path(name)
+        if path.suffix.lower() not in (VIDEO_SUFFIX, SIDECAR_SUFFIX):
+            return
+        self._pending.setdefault(path.stem, (None, 0.0))
+        self._wakeup.set()
+
+    def _scan(self):
+        """扫描目录，只登记新出现或 size/mtime 变化过的文件"""
+        current = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                current[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                if self._known.get(entry.name) != current[entry.name]:
+                    self._mark_pending(entry.name)
+        self._known = current
+
+    @staticmethod
+    def _stat(path):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    async def _settle(self):
+        """检查待定文件是否稳定，稳定且成对的视频放入队列"""
+        now = time.monotonic()
+        for stem, (last_state, stable_since) in list(self._pending.items()):
+            video_file = self.directory / f"{stem}{VIDEO_SUFFIX}"
+            state = (self._stat(video_file), self._stat(self.directory / f"{stem}{SIDECAR_SUFFIX}"))
+            if state[0] is None or state[1] is None:
+                # 视频或者标题文件还没到齐，等下一个事件
+                del self._pending[stem]
+                if state[0] is None:
+                    self._emitted.pop(video_file, None)
+                continue
+            if state != last_state:
+                self._pending[stem] = (state, now)
+                continue
+            if now - stable_since < self.settle_seconds:
+                continue
+            del self._pending[stem]
+            if self._emitted.get(video_file) == state:
+                continue
+            self._emitted[video_file] = state
+            watcher_logger.info(f"[+] 发现新视频: {video_file}")
+            # 队列满时在这里等待，形成背压
+            await self.queue.put(video_file)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        inotify = None
+        try:
+            inotify = Inotify(self.directory)
+        except OSError as e:
+            watcher_logger.warning(f"inotify 不可用，改为每 {self.poll_interval} 秒扫描一次目录: {e}")
+
+        if inotify is not None:
+            def on_readable():
+                names, overflow = inotify.read_events()
+                if overflow:
+                    # 事件队列溢出，重新扫描一遍目录兜底
+                    self._scan()
+                for name in names:
+                    self._mark_pending(name)
+
+            loop.add_reader(inotify.fd, on_readable)
+
+        self._scan()
+        if not self.scan_existing:
+            # 已有文件只记录状态，不上传
+            self._pending.clear()
+
+        try:
+            while True:
+                timeout = self.poll_interval if not self._pending else min(1.0, self.settle_seconds)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    if inotify is None:
+                        self._scan()
+                self._wakeup.clear()
+                await self._settle()
+        finally:
+            if inotify is not None:
+                loop.remove_reader(inotify.fd)
+                inotify.close()
+
+
+async def watch_and_upload(directory, handler, workers=2, queue_size=10, settle_seconds=5.0, poll_interval=10.0,
+                           scan_existing=False):
+    """
+    监听目录并用 workers 个协程并发调用 await handler(video_file)
+
+    Args:
+        directory: 视频目录
+        handler: 上传协程函数，参数为视频路径
+        workers: 并发上传数
+        queue_size: 待上传队列长度，满了之后监听端等待
+        settle_seconds: 文件 size/mtime 保持不变多久才认为写入完成
+        poll_interval: inotify 不可用时的目录扫描间隔
+        scan_existing: 启动时是否上传目录中已有的视频
+    """
+    queue = asyncio.Queue(maxsize=queue_size)
+    watcher = VideoDirWatcher(directory, queue, settle_seconds, poll_interval, scan_existing)
+
+    async def worker(index):
+        while True:
+            video_file = await queue.get()
+            try:
+                await handler(video_file)
+            except Exception as e:
+                watcher_logger.exception(f"[-] worker {index} 上传 {video_file} 失败: {e}")
+            finally:
+                queue.task_done()
+
+    watcher_logger.info(f"[+] 开始监听目录 {directory}")
+    tasks = [asyncio.ensure_future(worker(i)) for i in range(workers)]
+    try:
+        await watcher.run()
+    finally:
+        for task in tasks:
+            task.cancel()